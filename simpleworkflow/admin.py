@@ -1,3 +1,177 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections
+from django.forms.models import BaseInlineFormSet
+from django.utils.functional import cached_property
+from django.utils.translation import ugettext_lazy as _
 
-# Register your models here.
+from simpleworkflow.models import (WorkFlow, WorkFlowNode, WorkFlowTransition, WorkFlowInstance,
+                                   WorkFlowProcess, WorkFlowProcessType, WorkFlowReport)
+from simpleworkflow.services import WorkFlowService
+
+# below this many rows an exact COUNT is cheap enough
+ESTIMATE_THRESHOLD = 10000
+PROCESS_INLINE_ROWS = 50
+
+
+def estimated_count(model, using):
+    # the planner's row estimate for a whole table, None where there is none
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass", [table])
+        elif connection.vendor == 'mysql':
+            cursor.execute("SELECT table_rows FROM information_schema.tables "
+                           "WHERE table_schema = DATABASE() AND table_name = %s", [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    return int(row[0]) if row and row[0] is not None else None
+
+
+class EstimatedCountPaginator(Paginator):
+    # unfiltered changelists of the large tables show an estimated total
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is not None and not query.where:
+            estimate = estimated_count(self.object_list.model, self.object_list.db)
+            if estimate is not None and estimate > ESTIMATE_THRESHOLD:
+                return estimate
+        return super(EstimatedCountPaginator, self).count
+
+
+class BoundedInlineFormSet(BaseInlineFormSet):
+    max_rows = PROCESS_INLINE_ROWS
+
+    def get_queryset(self):
+        if not hasattr(self, '_bounded_queryset'):
+            self._bounded_queryset = super(BoundedInlineFormSet, self).get_queryset().order_by(
+                '-pk')[:self.max_rows]
+        return self._bounded_queryset
+
+
+class TransitionAdminMixin(object):
+    # the rows transitions keep consistent, pending_count among them, are
+    # changed through the service actions only: the fields transitions
+    # decide on are read-only, and rows are neither added nor deleted here
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def get_actions(self, request):
+        actions = super(TransitionAdminMixin, self).get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+
+class WorkFlowNodeInline(admin.TabularInline):
+    model = WorkFlowNode
+    fk_name = 'workflow'
+    fields = ('code', 'name', 'is_start', 'is_end', 'logic_type', 'next_node', 'join_type',
+              'todo_timeout', 'escalation_type', 'escalation_user')
+    raw_id_fields = ('next_node', 'escalation_user')
+    extra = 0
+
+
+class WorkFlowTransitionInline(admin.TabularInline):
+    model = WorkFlowTransition
+    raw_id_fields = ('source', 'target')
+    extra = 0
+
+
+@admin.register(WorkFlow)
+class WorkFlowAdmin(admin.ModelAdmin):
+    list_display = ('code', 'name', 'date_updated')
+    search_fields = ('code', 'name')
+    inlines = [WorkFlowNodeInline, WorkFlowTransitionInline]
+
+
+@admin.register(WorkFlowNode)
+class WorkFlowNodeAdmin(admin.ModelAdmin):
+    list_display = ('code', 'name', 'workflow', 'is_start', 'is_end', 'logic_type', 'next_node')
+    list_select_related = ('workflow', 'next_node')
+    list_filter = ('workflow',)
+    raw_id_fields = ('workflow', 'next_node', 'users', 'groups', 'escalation_user')
+    search_fields = ('code', 'name')
+
+
+class WorkFlowProcessInline(admin.TabularInline):
+    # the latest processes only, handling goes through the process actions
+    model = WorkFlowProcess
+    formset = BoundedInlineFormSet
+    fields = readonly_fields = ('node', 'user', 'pro_type', 'todo', 'pro_time', 'note',
+                                'date_created')
+    extra = 0
+    max_num = 0
+    can_delete = False
+
+    def get_queryset(self, request):
+        return super(WorkFlowProcessInline, self).get_queryset(request).select_related(
+            'node', 'user')
+
+
+@admin.register(WorkFlowInstance)
+class WorkFlowInstanceAdmin(TransitionAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'code', 'name', 'workflow', 'current_node', 'workflow_status',
+                    'pending_count', 'starter', 'date_updated')
+    list_select_related = ('workflow', 'current_node', 'starter')
+    list_filter = ('workflow_status',)
+    readonly_fields = ('workflow', 'starter', 'content_type', 'object_id', 'workflow_status',
+                       'is_new', 'current_node', 'pending_count')
+    ordering = ('-pk',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    inlines = [WorkFlowProcessInline]
+    actions = ['terminate_instances']
+
+    def terminate_instances(self, request, queryset):
+        terminated = WorkFlowService.handle_terminated_instances(
+            queryset.values_list('pk', flat=True))
+        self.message_user(request, _("%s instances terminated.") % terminated)
+    terminate_instances.short_description = _("Terminate selected instances")
+
+
+@admin.register(WorkFlowProcess)
+class WorkFlowProcessAdmin(TransitionAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'inst', 'node', 'user', 'pro_type', 'todo', 'pro_time', 'date_created')
+    list_select_related = ('inst', 'node', 'user')
+    list_filter = ('pro_type', 'todo')
+    raw_id_fields = ('user',)
+    readonly_fields = ('inst', 'node', 'pro_type', 'todo', 'pro_time', 'escalated_at')
+    ordering = ('-pk',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ['agree_processes', 'deny_processes']
+
+    def handle_processes(self, request, queryset, pro_type):
+        # only processes awaiting a decision are handled, not ones already
+        # decided or waiting on a node that has not been reached yet
+        items = [(workflowprocess, pro_type, None) for workflowprocess in
+                 queryset.filter(todo=True, pro_type=WorkFlowProcessType.init).order_by('pk')]
+        skipped = queryset.count() - len(items)
+        WorkFlowService.handle_workflow_processes(items)
+        self.message_user(request, _("%s processes handled.") % len(items))
+        if skipped:
+            self.message_user(request, _("%s processes skipped, they are not awaiting a decision.")
+                              % skipped, messages.WARNING)
+
+    def agree_processes(self, request, queryset):
+        self.handle_processes(request, queryset, WorkFlowProcessType.agree)
+    agree_processes.short_description = _("Agree selected processes")
+
+    def deny_processes(self, request, queryset):
+        self.handle_processes(request, queryset, WorkFlowProcessType.deny)
+    deny_processes.short_description = _("Deny selected processes")
+
+
+@admin.register(WorkFlowReport)
+class WorkFlowReportAdmin(admin.ModelAdmin):
+    list_display = ('workflow', 'node', 'new_count', 'in_progress_count', 'deny_count',
+                    'terminated_count', 'completed_count', 'approval_count', 'rolled_up_to')
+    list_select_related = ('workflow', 'node')
+    list_filter = ('workflow',)
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class SimpleworkflowConfig(AppConfig):
     name = 'simpleworkflow'
+
+    def ready(self):
+        from simpleworkflow import signals  # noqa
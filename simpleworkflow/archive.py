@@ -0,0 +1,62 @@
+from __future__ import unicode_literals
+
+import datetime
+
+from django.db import transaction
+
+from simpleworkflow.models import (WorkFlowInstance, WorkFlowProcess, WorkFlowInstanceType,
+                                   WorkFlowInstanceArchive, WorkFlowProcessArchive)
+
+FINISHED_STATUSES = (
+    WorkFlowInstanceType.deny,
+    WorkFlowInstanceType.terminated,
+    WorkFlowInstanceType.completed,
+)
+
+
+def finished_instances(days):
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=days)
+    return WorkFlowInstance.objects.filter(
+        workflow_status__in=FINISHED_STATUSES, date_updated__lt=cutoff)
+
+
+def copy_rows(queryset, archive_model):
+    attnames = [field.attname for field in archive_model._meta.concrete_fields]
+    rows = [archive_model(**row) for row in queryset.values(*attnames)]
+    archive_model.objects.bulk_create(rows)
+    return len(rows)
+
+
+def archive_chunk(inst_ids):
+    # one chunk is one transaction, so an interrupted run can simply be resumed
+    with transaction.atomic():
+        instances = WorkFlowInstance.objects.filter(pk__in=inst_ids)
+        processes = WorkFlowProcess.objects.filter(inst_id__in=inst_ids)
+        archived = copy_rows(instances, WorkFlowInstanceArchive)
+        archived_processes = copy_rows(processes, WorkFlowProcessArchive)
+        processes.delete()
+        instances.delete()
+    return archived, archived_processes
+
+
+def archive_finished_instances(days, chunk_size=1000, dry_run=False, max_chunks=None,
+                               progress=None):
+    instances = finished_instances(days)
+    if dry_run:
+        return (instances.count(),
+                WorkFlowProcess.objects.filter(inst__in=instances.values('pk')).count())
+    archived = archived_processes = chunks = 0
+    last_pk = 0
+    while max_chunks is None or chunks < max_chunks:
+        inst_ids = list(instances.filter(pk__gt=last_pk).order_by('pk').values_list(
+            'pk', flat=True)[:chunk_size])
+        if not inst_ids:
+            break
+        counts = archive_chunk(inst_ids)
+        archived += counts[0]
+        archived_processes += counts[1]
+        chunks += 1
+        last_pk = inst_ids[-1]
+        if progress is not None:
+            progress(archived, archived_processes)
+    return archived, archived_processes
@@ -0,0 +1,99 @@
+from __future__ import unicode_literals
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from simpleworkflow.models import WorkFlow, WorkFlowProcess
+from simpleworkflow.services import WorkFlowService
+
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:
+    sync_to_async = None
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'SIMPLEWORKFLOW_ASYNC_WORKERS', 4))
+    return _executor
+
+
+def call_in_thread(func, *args, **kwargs):
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def run_sync(func, *args, **kwargs):
+    # every operation below is a single hop off the event loop, so all of its
+    # queries share one thread and one connection
+    if sync_to_async is not None:
+        return sync_to_async(func, thread_sensitive=True)(*args, **kwargs)
+    loop = asyncio.get_event_loop()
+    return loop.run_in_executor(get_executor(), partial(call_in_thread, func, *args, **kwargs))
+
+
+class AsyncWorkFlowService(object):
+
+    @staticmethod
+    async def gain_workflow(code, name=None):
+        if hasattr(WorkFlow.objects, 'aget_or_create'):
+            workflow, _ = await WorkFlow.objects.aget_or_create(
+                code=code, defaults={'name': name})
+            return workflow
+        return await run_sync(WorkFlowService.gain_workflow, code, name)
+
+    @staticmethod
+    async def start_workflow_instance(workflow, content_object, starter, code=None, name=None,
+                                      create_process=False, todo=True):
+        def start():
+            workflowinstance = WorkFlowService.start_workflow_instance(
+                workflow, content_object, starter, code, name)
+            if create_process and workflowinstance is not None:
+                WorkFlowService.create_workflow_process(
+                    workflowinstance, workflowinstance.current_node, todo=todo)
+            return workflowinstance
+        return await run_sync(start)
+
+    @staticmethod
+    async def start_workflow_instances(workflow, content_objects, starter, **kwargs):
+        return await run_sync(WorkFlowService.start_workflow_instances,
+                              workflow, content_objects, starter, **kwargs)
+
+    @staticmethod
+    async def inbox(user, before=None, limit=20, using=None):
+        return await run_sync(WorkFlowService.inbox, user, before, limit, using)
+
+    @staticmethod
+    async def inbox_count(user, using=None):
+        processes = WorkFlowProcess.objects.using(using).todo_for(user)
+        if hasattr(processes, 'acount'):
+            return await processes.acount()
+        return await run_sync(processes.count)
+
+    @staticmethod
+    async def can_act(user, instances, memo=None):
+        return await run_sync(WorkFlowService.can_act, user, instances, memo)
+
+    @staticmethod
+    async def handle_workflow_process(workflowprocess, pro_type, note=None, memo=None):
+        return await run_sync(WorkFlowService.handle_workflow_process,
+                              workflowprocess, pro_type, note, memo)
+
+    @staticmethod
+    async def handle_workflow_processes(items):
+        return await run_sync(WorkFlowService.handle_workflow_processes, items)
+
+    @staticmethod
+    async def handle_terminated_instance(inst):
+        return await run_sync(WorkFlowService.handle_terminated_instance, inst)
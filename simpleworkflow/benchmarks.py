@@ -0,0 +1,207 @@
+from __future__ import unicode_literals
+
+import asyncio
+import time
+
+from django.contrib.auth.models import User, Group
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from simpleworkflow.models import (WorkFlowInstance, WorkFlowProcess,
+                                   LogicType, WorkFlowProcessType)
+from simpleworkflow.services import WorkFlowService
+from simpleworkflow.async_services import AsyncWorkFlowService
+from simpleworkflow.definitions import clear_compiled_workflows, get_compiled_workflow, invalidate_group_membership
+
+OPERATIONS = (
+    'start_workflow_instance',
+    'create_workflow_process',
+    'handle_workflow_process_all',
+    'handle_workflow_process_all_advance',
+    'handle_workflow_process_any',
+    'handle_workflow_process_deny',
+    'handle_terminated_instance',
+)
+
+
+class Measurement(object):
+
+    def __init__(self):
+        self.timings = dict((operation, []) for operation in OPERATIONS)
+        self.queries = dict((operation, []) for operation in OPERATIONS)
+
+    def __call__(self, operation, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            elapsed = time.perf_counter() - start
+        self.timings[operation].append(elapsed * 1000)
+        self.queries[operation].append(len(context.captured_queries))
+        return result
+
+    def results(self):
+        results = {}
+        for operation in OPERATIONS:
+            timings = sorted(self.timings[operation])
+            if not timings:
+                continue
+            results[operation] = {
+                'runs': len(timings),
+                'queries': max(self.queries[operation]),
+                'mean_ms': round(sum(timings) / len(timings), 3),
+                'p50_ms': round(timings[len(timings) // 2], 3),
+                'max_ms': round(timings[-1], 3),
+            }
+        return results
+
+
+def generate_data(instances=10000, processes=5, group_size=100, batch_size=1000):
+    prefix = 'bench%s' % int(time.time() * 1000)
+    last_pk = User.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+    User.objects.bulk_create(
+        [User(username='%s_%s' % (prefix, i)) for i in range(max(group_size, processes, 3))],
+        batch_size=batch_size)
+    user_ids = list(User.objects.filter(pk__gt=last_pk).values_list('pk', flat=True))
+    group = Group.objects.create(name=prefix)
+    User.groups.through.objects.bulk_create(
+        [User.groups.through(user_id=user_id, group_id=group.pk)
+         for user_id in user_ids[:group_size]], batch_size=batch_size)
+    # the bulk insert sends no m2m_changed
+    invalidate_group_membership(group.pk)
+    starter = User.objects.get(pk=user_ids[0])
+
+    workflow = WorkFlowService.gain_workflow(prefix, prefix)
+    node1 = WorkFlowService.create_node(workflow, 'N01', 'all', True, False, LogicType.logic_all,
+                                       user_ids[:2])
+    node2 = WorkFlowService.create_node(workflow, 'N02', 'any', False, False, LogicType.logic_any,
+                                       None, [group], node1)
+    node3 = WorkFlowService.create_node(workflow, 'N03', 'end', False, True, LogicType.logic_all,
+                                       user_ids[:1], None, node2)
+
+    # background rows so the measured queries run against realistic tables
+    content_type = ContentType.objects.get_for_model(Group)
+    for start in range(0, instances, batch_size):
+        WorkFlowInstance.objects.bulk_create(
+            [WorkFlowInstance(workflow=workflow, starter=starter, content_type=content_type,
+                              object_id=object_id, current_node=node1)
+             for object_id in range(start, min(start + batch_size, instances))])
+    inst_ids = WorkFlowInstance.objects.filter(workflow=workflow).values_list('pk', flat=True)
+    batch = []
+    for inst_id in inst_ids.iterator():
+        batch.extend(WorkFlowProcess(inst_id=inst_id, node=node1, todo=True,
+                                     user_id=user_ids[i % len(user_ids)])
+                     for i in range(processes))
+        if len(batch) >= batch_size:
+            WorkFlowProcess.objects.bulk_create(batch)
+            batch = []
+    WorkFlowProcess.objects.bulk_create(batch)
+    return workflow, (node1, node2, node3), starter
+
+
+def run_benchmarks(instances=10000, processes=5, group_size=100, repeat=20):
+    measure = Measurement()
+    with transaction.atomic():
+        workflow, (node1, node2, node3), starter = generate_data(instances, processes, group_size)
+        clear_compiled_workflows()
+        # measure the steady state, not the first definition compile
+        get_compiled_workflow(workflow.pk)
+        targets = [Group.objects.create(name='target%s_%s' % (workflow.code, i))
+                   for i in range(repeat * 2)]
+        for i in range(repeat):
+            inst = measure('start_workflow_instance', WorkFlowService.start_workflow_instance,
+                           workflow, targets[i], starter)
+            WorkFlowService.create_workflow_process(inst, node1, todo=True)
+            measure('create_workflow_process', WorkFlowService.create_workflow_process,
+                    inst, node2)
+            WorkFlowService.create_workflow_process(inst, node3)
+            first, last = WorkFlowProcess.objects.filter(inst=inst, node=node1)
+            measure('handle_workflow_process_all', WorkFlowService.handle_workflow_process,
+                    first, WorkFlowProcessType.agree)
+            measure('handle_workflow_process_all_advance', WorkFlowService.handle_workflow_process,
+                    last, WorkFlowProcessType.agree)
+            workflowprocess = WorkFlowProcess.objects.filter(inst=inst, node=node2).first()
+            measure('handle_workflow_process_any', WorkFlowService.handle_workflow_process,
+                    workflowprocess, WorkFlowProcessType.agree)
+            workflowprocess = WorkFlowProcess.objects.get(inst=inst, node=node3)
+            measure('handle_workflow_process_deny', WorkFlowService.handle_workflow_process,
+                    workflowprocess, WorkFlowProcessType.deny)
+
+            inst = WorkFlowService.start_workflow_instance(workflow, targets[repeat + i], starter)
+            WorkFlowService.create_workflow_process(inst, node1, todo=True)
+            measure('handle_terminated_instance', WorkFlowService.handle_terminated_instance, inst)
+        transaction.set_rollback(True)
+    clear_compiled_workflows()
+    return {
+        'backend': connection.vendor,
+        'scale': {'instances': instances, 'processes': processes,
+                  'group_size': group_size, 'repeat': repeat},
+        'results': measure.results(),
+    }
+
+
+def compare_results(results, baseline, tolerance=0.5):
+    # query counts must not grow; timings may drift by ``tolerance``
+    regressions = []
+    for operation, result in results['results'].items():
+        expected = baseline.get('results', {}).get(operation)
+        if expected is None:
+            continue
+        if result['queries'] > expected['queries']:
+            regressions.append('%s: %s queries, baseline %s' % (
+                operation, result['queries'], expected['queries']))
+        if result['mean_ms'] > expected['mean_ms'] * (1 + tolerance):
+            regressions.append('%s: %.3f ms mean, baseline %.3f ms' % (
+                operation, result['mean_ms'], expected['mean_ms']))
+    return regressions
+
+
+def run_async_benchmark(approvals=100, concurrency=10):
+    # concurrent AsyncWorkFlowService approvals against the same number of
+    # sequential sync ones; the data has to be committed for the worker
+    # threads to see it, so it is deleted again afterwards
+    if connection.vendor == 'sqlite':
+        # sqlite allows a single writer, concurrent transitions only fail with
+        # "database is locked"
+        concurrency = 1
+    workflow, (node1, node2, node3), starter = generate_data(0, 0, group_size=2)
+    targets = [Group.objects.create(name='target%s_%s' % (workflow.code, i))
+               for i in range(approvals * 2)]
+    try:
+        WorkFlowService.start_workflow_instances(workflow, targets, starter, create_process=True)
+        processes = list(WorkFlowProcess.objects.filter(node=node1, user=starter).order_by('pk'))
+
+        start = time.perf_counter()
+        for workflowprocess in processes[:approvals]:
+            WorkFlowService.handle_workflow_process(workflowprocess, WorkFlowProcessType.agree)
+        sync_elapsed = time.perf_counter() - start
+
+        async def approve_all(processes):
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def approve(workflowprocess):
+                async with semaphore:
+                    await AsyncWorkFlowService.handle_workflow_process(
+                        workflowprocess, WorkFlowProcessType.agree)
+            await asyncio.gather(*[approve(workflowprocess) for workflowprocess in processes])
+
+        loop = asyncio.new_event_loop()
+        try:
+            start = time.perf_counter()
+            loop.run_until_complete(approve_all(processes[approvals:]))
+            async_elapsed = time.perf_counter() - start
+        finally:
+            loop.close()
+    finally:
+        User.objects.filter(username__startswith=workflow.code).delete()
+        Group.objects.filter(name__contains=workflow.code).delete()
+        workflow.delete()
+    return {
+        'backend': connection.vendor,
+        'approvals': approvals,
+        'concurrency': concurrency,
+        'sync_ms': round(sync_elapsed * 1000, 3),
+        'async_ms': round(async_elapsed * 1000, 3),
+        'sync_per_second': round(approvals / sync_elapsed, 1),
+        'async_per_second': round(approvals / async_elapsed, 1),
+    }
@@ -0,0 +1,216 @@
+from __future__ import unicode_literals
+
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+
+from simpleworkflow.models import WorkFlow, WorkFlowNode, WorkFlowTransition, LogicType
+
+VERSION_KEY = 'simpleworkflow:definition:version:%s'
+DEFINITION_KEY = 'simpleworkflow:definition:%s:%s'
+GROUP_VERSION_KEY = 'simpleworkflow:group:version:%s'
+
+# workflow id -> (version, CompiledWorkFlow) for this process, checked
+# against the current version on every lookup
+_compiled_workflows = {}
+
+
+class CompiledNode(object):
+    __slots__ = ('id', 'code', 'name', 'is_start', 'is_end', 'logic_type',
+                 'next_node_id', 'join_type', 'user_ids', 'group_ids')
+
+    def __init__(self, id, code, name, is_start, is_end, logic_type,
+                 next_node_id, join_type=LogicType.logic_all, user_ids=(), group_ids=()):
+        self.id = id
+        self.code = code
+        self.name = name
+        self.is_start = is_start
+        self.is_end = is_end
+        self.logic_type = logic_type
+        self.next_node_id = next_node_id
+        self.join_type = join_type
+        self.user_ids = frozenset(user_ids)
+        self.group_ids = frozenset(group_ids)
+
+    def __getstate__(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __setstate__(self, state):
+        for slot, value in zip(self.__slots__, state):
+            setattr(self, slot, value)
+
+    def __repr__(self):
+        return "<CompiledNode %s>" % self.code
+
+
+class CompiledWorkFlow(object):
+    # targets / sources are the transition table, next_node plus the extra
+    # WorkFlowTransition edges, in both directions
+    __slots__ = ('id', 'code', 'nodes', 'chain', 'start_node', 'end_nodes',
+                 'transitions', 'targets', 'sources', 'is_graph')
+
+    def __init__(self, id, code, nodes, transitions=()):
+        self.id = id
+        self.code = code
+        self.nodes = dict((node.id, node) for node in nodes)
+        self.transitions = tuple(transitions)
+        edges = [(node.id, node.next_node_id) for node in nodes
+                 if node.next_node_id in self.nodes]
+        edges.extend(edge for edge in self.transitions if edge not in edges)
+        targets, sources = {}, {}
+        for source_id, target_id in edges:
+            targets.setdefault(source_id, []).append(target_id)
+            sources.setdefault(target_id, []).append(source_id)
+        self.targets = dict((node_id, tuple(ids)) for node_id, ids in targets.items())
+        self.sources = dict((node_id, tuple(ids)) for node_id, ids in sources.items())
+        # linear workflows keep the single current node fast path
+        self.is_graph = any(len(ids) > 1 for ids in list(targets.values()) + list(sources.values()))
+        self.start_node = next(
+            (node for node in nodes if node.is_start), None)
+        self.end_nodes = tuple(node for node in nodes if node.is_end)
+        chain = []
+        node = self.start_node
+        while node is not None and node.id not in chain:
+            chain.append(node.id)
+            node = self.next_node(node.id)
+        self.chain = tuple(chain)
+
+    def __getstate__(self):
+        return (self.id, self.code, list(self.nodes.values()), self.transitions)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def node(self, node_id):
+        return self.nodes[node_id]
+
+    def next_node(self, node_id):
+        # the first target, the only one outside parallel branches
+        target_ids = self.targets.get(node_id)
+        return self.nodes[target_ids[0]] if target_ids else None
+
+    def next_nodes(self, node_id):
+        return [self.nodes[target_id] for target_id in self.targets.get(node_id, ())]
+
+    def incoming_count(self, node_id):
+        return len(self.sources.get(node_id, ()))
+
+    def ancestors(self, node_id):
+        # the ids of the nodes with a path to node_id
+        found, stack = set(), list(self.sources.get(node_id, ()))
+        while stack:
+            source_id = stack.pop()
+            if source_id not in found:
+                found.add(source_id)
+                stack.extend(self.sources.get(source_id, ()))
+        return found
+
+    def __repr__(self):
+        return "<CompiledWorkFlow %s>" % self.code
+
+
+def compile_workflow(workflow_id, using=DEFAULT_DB_ALIAS):
+    # read from the primary, a lagging replica would get its definition
+    # compiled and cached
+    code = WorkFlow.objects.using(using).filter(pk=workflow_id).values_list(
+        'code', flat=True).first()
+    user_ids, group_ids = {}, {}
+    for node_id, user_id in WorkFlowNode.users.through.objects.using(using).filter(
+            workflownode__workflow_id=workflow_id).values_list(
+            'workflownode_id', 'user_id'):
+        user_ids.setdefault(node_id, []).append(user_id)
+    for node_id, group_id in WorkFlowNode.groups.through.objects.using(using).filter(
+            workflownode__workflow_id=workflow_id).values_list(
+            'workflownode_id', 'group_id'):
+        group_ids.setdefault(node_id, []).append(group_id)
+    nodes = [CompiledNode(user_ids=user_ids.get(row['id'], ()),
+                          group_ids=group_ids.get(row['id'], ()), **row)
+             for row in WorkFlowNode.objects.using(using).filter(
+                 workflow_id=workflow_id).order_by('pk').values(
+                 'id', 'code', 'name', 'is_start', 'is_end',
+                 'logic_type', 'next_node_id', 'join_type')]
+    transitions = WorkFlowTransition.objects.using(using).filter(workflow_id=workflow_id).order_by(
+        'pk').values_list('source_id', 'target_id')
+    return CompiledWorkFlow(workflow_id, code, nodes, transitions)
+
+
+def get_definition_cache():
+    alias = getattr(settings, 'SIMPLEWORKFLOW_DEFINITION_CACHE', None)
+    if alias is None:
+        return None
+    return caches[alias]
+
+
+def get_definition_version(workflow_id):
+    # the version is the one on the workflow row, which the shared cache
+    # holds a copy of where one is configured; without one it costs a primary
+    # key lookup, so operations that load the row anyway pass it on instead
+    cache = get_definition_cache()
+    if cache is not None:
+        version = cache.get(VERSION_KEY % workflow_id)
+        if version is not None:
+            return version
+    version = WorkFlow.objects.using(DEFAULT_DB_ALIAS).filter(pk=workflow_id).values_list(
+        'definition_version', flat=True).first()
+    if cache is not None:
+        cache.add(VERSION_KEY % workflow_id, version, None)
+    return version
+
+
+def get_compiled_workflow(workflow_id, version=None):
+    # version, where given, is the definition_version of the workflow row
+    cache = get_definition_cache()
+    if version is None:
+        version = get_definition_version(workflow_id)
+    entry = _compiled_workflows.get(workflow_id)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    compiled = None
+    if cache is not None:
+        compiled = cache.get(DEFINITION_KEY % (workflow_id, version))
+    if compiled is None:
+        compiled = compile_workflow(workflow_id)
+        if cache is not None:
+            cache.set(DEFINITION_KEY % (workflow_id, version), compiled, None)
+    _compiled_workflows[workflow_id] = (version, compiled)
+    return compiled
+
+
+def peek_compiled_workflow(workflow_id):
+    # this process's definition without checking its version, for labels
+    entry = _compiled_workflows.get(workflow_id)
+    if entry is not None:
+        return entry[1]
+    return get_compiled_workflow(workflow_id)
+
+
+def invalidate_compiled_workflow(workflow_id):
+    # the workflow row is updated in the transaction of the edit, so other
+    # processes see the new version exactly when they can see the edit
+    _compiled_workflows.pop(workflow_id, None)
+    version = uuid.uuid4().hex
+    WorkFlow.objects.filter(pk=workflow_id).update(definition_version=version)
+    cache = get_definition_cache()
+    if cache is not None:
+        cache.set(VERSION_KEY % workflow_id, version, None)
+
+
+def clear_compiled_workflows():
+    _compiled_workflows.clear()
+
+
+def get_group_versions(group_ids):
+    # membership versions live in the shared cache only, a version kept in
+    # one process would miss the changes made by the others
+    group_ids = sorted(group_ids)
+    cache = get_definition_cache()
+    versions = cache.get_many([GROUP_VERSION_KEY % group_id for group_id in group_ids])
+    return tuple(versions.get(GROUP_VERSION_KEY % group_id, 0) for group_id in group_ids)
+
+
+def invalidate_group_membership(group_id):
+    cache = get_definition_cache()
+    if cache is not None:
+        cache.set(GROUP_VERSION_KEY % group_id, uuid.uuid4().hex, None)
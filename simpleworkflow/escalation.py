@@ -0,0 +1,141 @@
+from __future__ import unicode_literals
+
+import datetime
+
+from django.db import connection, transaction
+from django.db.models import F, Q
+
+from simpleworkflow.models import (WorkFlowNode, WorkFlowInstance, WorkFlowProcess,
+                                   WorkFlowInstanceType, WorkFlowProcessType, EscalationType)
+from simpleworkflow.services import WorkFlowService
+
+ESCALATION_NAMES = {
+    EscalationType.reassign: 'reassigned',
+    EscalationType.add_approver: 'approvers_added',
+    EscalationType.terminate: 'terminated',
+}
+
+
+def escalation_nodes(workflow=None):
+    nodes = WorkFlowNode.objects.filter(todo_timeout__isnull=False).exclude(
+        escalation_type=EscalationType.none).exclude(
+        ~Q(escalation_type=EscalationType.terminate), escalation_user__isnull=True)
+    if workflow is not None:
+        nodes = nodes.filter(workflow=workflow)
+    return nodes.order_by('pk')
+
+
+def overdue_todos(node, now=None):
+    # a todo's clock runs from its last escalation, or from date_created if
+    # it was never escalated; served by the (todo, escalated_at, date_created)
+    # index
+    now = now or datetime.datetime.now()
+    cutoff = now - node.todo_timeout
+    return WorkFlowProcess.objects.filter(
+        Q(escalated_at__isnull=True, date_created__lt=cutoff) | Q(escalated_at__lt=cutoff),
+        todo=True, node=node, pro_type=WorkFlowProcessType.init)
+
+
+def reassign(node, rows, now):
+    # the todo moves to the escalation user and its clock restarts; where the
+    # escalation user already has a todo on the instance, the overdue one is
+    # submitted instead of giving them a second
+    inst_ids = set(WorkFlowProcess.objects.filter(
+        inst_id__in=set(row[1] for row in rows), node=node, user=node.escalation_user_id,
+        pro_type=WorkFlowProcessType.init).values_list('inst_id', flat=True))
+    moved, merged = [], {}
+    for pk, inst_id, _ in rows:
+        if inst_id in inst_ids:
+            merged[inst_id] = merged.get(inst_id, 0) + 1
+        else:
+            inst_ids.add(inst_id)
+            moved.append(pk)
+    WorkFlowProcess.objects.filter(pk__in=moved).update(
+        user=node.escalation_user_id, escalated_at=now)
+    if merged:
+        WorkFlowProcess.objects.filter(pk__in=[row[0] for row in rows if row[0] not in moved]).update(
+            pro_type=WorkFlowProcessType.submit, todo=False, pro_time=now, escalated_at=now,
+            date_updated=now)
+        for inst_id, count in merged.items():
+            WorkFlowInstance.objects.filter(pk=inst_id, current_node=node).update(
+                pending_count=F('pending_count') - count)
+    return len(rows)
+
+
+def add_approver(node, rows, now):
+    inst_ids = set(row[1] for row in rows)
+    inst_ids -= set(WorkFlowProcess.objects.filter(
+        inst_id__in=inst_ids, node=node, user=node.escalation_user_id,
+        pro_type=WorkFlowProcessType.init).values_list('inst_id', flat=True))
+    WorkFlowProcess.objects.bulk_create([
+        WorkFlowProcess(inst_id=inst_id, node=node, user_id=node.escalation_user_id, todo=True)
+        for inst_id in sorted(inst_ids)])
+    WorkFlowInstance.objects.filter(pk__in=inst_ids, current_node=node).update(
+        pending_count=F('pending_count') + 1)
+    WorkFlowProcess.objects.filter(pk__in=[row[0] for row in rows]).update(escalated_at=now)
+    return len(inst_ids)
+
+
+def terminate(node, rows, now):
+    # escalate_chunk holds the instance locks already
+    return WorkFlowService.handle_terminated_instances(WorkFlowInstance.objects.filter(
+        pk__in=set(row[1] for row in rows), current_node=node).values_list('pk', flat=True))
+
+
+ESCALATIONS = {
+    EscalationType.reassign: reassign,
+    EscalationType.add_approver: add_approver,
+    EscalationType.terminate: terminate,
+}
+
+
+def escalate_chunk(node, after=None, chunk_size=500, now=None):
+    # two keyset passes, the todos never escalated by date_created and then
+    # the escalated ones by escalated_at. The instances are locked in pk order
+    # before their processes, the order handle_workflow_process takes them in;
+    # instances another worker has locked are skipped, so several workers can
+    # run the scan at once. Returns the keyset position and the escalation
+    # count
+    now = now or datetime.datetime.now()
+    cutoff = now - node.todo_timeout
+    field, value, pk = after or ('date_created', None, None)
+    skip_locked = connection.features.has_select_for_update_skip_locked
+    while True:
+        processes = WorkFlowProcess.objects.filter(
+            todo=True, node=node, pro_type=WorkFlowProcessType.init, **{field + '__lt': cutoff})
+        if field == 'date_created':
+            processes = processes.filter(escalated_at__isnull=True)
+        if value is not None:
+            processes = processes.filter(Q(**{field + '__gt': value}) | Q(**{field: value, 'pk__gt': pk}))
+        candidates = list(processes.order_by(field, 'pk').values_list('pk', 'inst_id', field)[:chunk_size])
+        if candidates:
+            with transaction.atomic():
+                inst_ids = list(WorkFlowInstance.objects.select_for_update(skip_locked=skip_locked).filter(
+                    pk__in=set(row[1] for row in candidates)).order_by('pk').values_list('pk', flat=True))
+                # an approver may have acted on a todo before its instance was locked
+                rows = list(processes.filter(
+                    pk__in=[row[0] for row in candidates], inst_id__in=inst_ids).order_by(
+                    field, 'pk').values_list('pk', 'inst_id', field))
+                escalated = ESCALATIONS[node.escalation_type](node, rows, now) if rows else 0
+            return (field, candidates[-1][2], candidates[-1][0]), escalated
+        if field == 'escalated_at':
+            return None, 0
+        field, value, pk = 'escalated_at', None, None
+
+
+def escalate_overdue_todos(workflow=None, chunk_size=500, now=None, max_chunks=None,
+                           progress=None):
+    now = now or datetime.datetime.now()
+    counts = dict((name, 0) for name in ESCALATION_NAMES.values())
+    chunks = 0
+    for node in escalation_nodes(workflow):
+        after = None
+        while max_chunks is None or chunks < max_chunks:
+            after, escalated = escalate_chunk(node, after, chunk_size, now)
+            if after is None:
+                break
+            counts[ESCALATION_NAMES[node.escalation_type]] += escalated
+            chunks += 1
+            if progress is not None:
+                progress(node, escalated)
+    return counts
@@ -0,0 +1,159 @@
+from __future__ import unicode_literals
+
+import datetime
+import json
+
+from django.contrib.auth.models import User, Group
+from django.db import transaction
+from django.db.models import Case, IntegerField, When
+
+from simpleworkflow.models import WorkFlow, WorkFlowNode, WorkFlowTransition, LogicType, EscalationType
+from simpleworkflow.definitions import invalidate_compiled_workflow
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+LOGIC_TYPES = {'ANY': LogicType.logic_any, 'ALL': LogicType.logic_all}
+LOGIC_NAMES = dict((value, name) for name, value in LOGIC_TYPES.items())
+ESCALATION_TYPES = {'NONE': EscalationType.none, 'REASSIGN': EscalationType.reassign,
+                    'ADD_APPROVER': EscalationType.add_approver, 'TERMINATE': EscalationType.terminate}
+ESCALATION_NAMES = dict((value, name) for name, value in ESCALATION_TYPES.items())
+
+
+def export_workflow(workflow):
+    # a workflow definition as plain data, in four queries; nodes are listed
+    # in chain order with the code of their next_node, and parallel branches
+    # are listed as extra transitions; todo_timeout is in seconds and the
+    # escalation user is a username
+    nodes = list(WorkFlowNode.objects.filter(workflow=workflow).order_by('pk').values(
+        'id', 'code', 'name', 'is_start', 'is_end', 'logic_type', 'next_node_id', 'join_type',
+        'todo_timeout', 'escalation_type', 'escalation_user__username'))
+    users, groups = {}, {}
+    for node_id, username in WorkFlowNode.users.through.objects.filter(
+            workflownode__workflow=workflow).order_by('user__username').values_list(
+            'workflownode_id', 'user__username'):
+        users.setdefault(node_id, []).append(username)
+    for node_id, name in WorkFlowNode.groups.through.objects.filter(
+            workflownode__workflow=workflow).order_by('group__name').values_list(
+            'workflownode_id', 'group__name'):
+        groups.setdefault(node_id, []).append(name)
+    transitions = list(WorkFlowTransition.objects.filter(workflow=workflow).order_by(
+        'pk').values_list('source__code', 'target__code'))
+    by_id = dict((node['id'], node) for node in nodes)
+    ordered = []
+    node = next((node for node in nodes if node['is_start']), None)
+    while node is not None and node not in ordered:
+        ordered.append(node)
+        node = by_id.get(node['next_node_id'])
+    ordered.extend(node for node in nodes if node not in ordered)
+    return {
+        'code': workflow.code,
+        'name': workflow.name,
+        'description': workflow.description,
+        'nodes': [{
+            'code': node['code'],
+            'name': node['name'],
+            'is_start': node['is_start'],
+            'is_end': node['is_end'],
+            'logic_type': LOGIC_NAMES.get(node['logic_type'], node['logic_type']),
+            'join_type': LOGIC_NAMES.get(node['join_type'], node['join_type']),
+            'next_node': by_id[node['next_node_id']]['code'] if node['next_node_id'] in by_id else None,
+            'todo_timeout': node['todo_timeout'].total_seconds() if node['todo_timeout'] is not None else None,
+            'escalation_type': ESCALATION_NAMES.get(node['escalation_type'], node['escalation_type']),
+            'escalation_user': node['escalation_user__username'],
+            'users': users.get(node['id'], []),
+            'groups': groups.get(node['id'], []),
+        } for node in ordered],
+        'transitions': [list(transition) for transition in transitions],
+    }
+
+
+def import_workflow(definition):
+    # creates a workflow and its nodes with bulk inserts in one transaction;
+    # next_node and transitions refer to nodes by code, so a node with a
+    # blank code cannot be the target of either
+    nodes = definition.get('nodes', [])
+    codes = [node.get('code') for node in nodes]
+    explicit = set(code for code in codes if code)
+    if len(explicit) != len([code for code in codes if code]):
+        raise ValueError("Duplicate node codes in workflow %s" % definition['code'])
+    referenced = set(node['next_node'] for node in nodes if node.get('next_node'))
+    referenced.update(code for transition in definition.get('transitions', []) for code in transition)
+    unknown = sorted(referenced - explicit)
+    if unknown:
+        raise ValueError("Unknown node codes in workflow %s: %s" % (
+            definition['code'], ", ".join(unknown)))
+    usernames = set(name for node in nodes for name in node.get('users', []))
+    usernames.update(node['escalation_user'] for node in nodes if node.get('escalation_user'))
+    group_names = set(name for node in nodes for name in node.get('groups', []))
+    with transaction.atomic():
+        workflow, created = WorkFlow.objects.get_or_create(
+            code=definition['code'], defaults={'name': definition.get('name'),
+                                               'description': definition.get('description')})
+        if not created and WorkFlowNode.objects.filter(workflow=workflow).exists():
+            raise ValueError("Workflow %s already has nodes" % workflow.code)
+        user_ids = dict(User.objects.filter(username__in=usernames).values_list('username', 'pk'))
+        group_ids = dict(Group.objects.filter(name__in=group_names).values_list('name', 'pk'))
+        missing = sorted(usernames - set(user_ids)) + sorted(group_names - set(group_ids))
+        if missing:
+            raise ValueError("Unknown users or groups: %s" % ", ".join(missing))
+        # blank codes come from the workflow's sequence, skipping any that the
+        # definition already uses
+        blank = len(codes) - len([code for code in codes if code])
+        generated = []
+        while len(generated) < blank:
+            generated.extend(code for code in WorkFlow.objects.reserve_node_codes(
+                workflow.pk, blank - len(generated)) if code not in explicit)
+        generated = iter(generated)
+        codes = [code or next(generated) for code in codes]
+
+        WorkFlowNode.objects.bulk_create([WorkFlowNode(
+            workflow=workflow, code=code, name=node['name'],
+            is_start=node.get('is_start', False), is_end=node.get('is_end', False),
+            logic_type=LOGIC_TYPES.get(node.get('logic_type'), node.get('logic_type', LogicType.logic_all)),
+            join_type=LOGIC_TYPES.get(node.get('join_type'), node.get('join_type', LogicType.logic_all)),
+            todo_timeout=datetime.timedelta(seconds=node['todo_timeout'])
+            if node.get('todo_timeout') is not None else None,
+            escalation_type=ESCALATION_TYPES.get(node.get('escalation_type'),
+                                                 node.get('escalation_type', EscalationType.none)),
+            escalation_user_id=user_ids[node['escalation_user']] if node.get('escalation_user') else None)
+            for code, node in zip(codes, nodes)])
+        # bulk_create does not set pks on every backend
+        node_ids = dict(WorkFlowNode.objects.filter(workflow=workflow).values_list('code', 'pk'))
+        next_codes = [(code, node['next_node']) for code, node in zip(codes, nodes)
+                      if node.get('next_node')]
+        if next_codes:
+            WorkFlowNode.objects.filter(pk__in=[node_ids[code] for code, _ in next_codes]).update(
+                next_node=Case(*[When(pk=node_ids[code], then=node_ids[next_code])
+                                 for code, next_code in next_codes],
+                               output_field=IntegerField()))
+        WorkFlowTransition.objects.bulk_create([
+            WorkFlowTransition(workflow=workflow, source_id=node_ids[source], target_id=node_ids[target])
+            for source, target in definition.get('transitions', [])])
+        WorkFlowNode.users.through.objects.bulk_create([
+            WorkFlowNode.users.through(workflownode_id=node_ids[code], user_id=user_ids[name])
+            for code, node in zip(codes, nodes) for name in set(node.get('users', []))])
+        WorkFlowNode.groups.through.objects.bulk_create([
+            WorkFlowNode.groups.through(workflownode_id=node_ids[code], group_id=group_ids[name])
+            for code, node in zip(codes, nodes) for name in set(node.get('groups', []))])
+    # none of the bulk writes above send the signals that would do this
+    invalidate_compiled_workflow(workflow.pk)
+    return workflow
+
+
+def dumps(data, format='json'):
+    if format == 'yaml':
+        if yaml is None:
+            raise ValueError("YAML support needs PyYAML")
+        return yaml.safe_dump(data, default_flow_style=False, allow_unicode=True)
+    return json.dumps(data, indent=2, sort_keys=True)
+
+
+def loads(text, format='json'):
+    if format == 'yaml':
+        if yaml is None:
+            raise ValueError("YAML support needs PyYAML")
+        return yaml.safe_load(text)
+    return json.loads(text)
@@ -0,0 +1,143 @@
+from __future__ import unicode_literals
+
+from bisect import bisect_left
+from functools import wraps
+import inspect
+import json
+import threading
+import time
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from simpleworkflow.definitions import peek_compiled_workflow
+
+# latency histogram upper bounds in milliseconds, the last bucket is open
+LATENCY_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+BUCKET_LABELS = ['<=%sms' % bound for bound in LATENCY_BUCKETS] + ['>%sms' % LATENCY_BUCKETS[-1]]
+
+_hooks = []
+_local = threading.local()
+
+
+class TransitionEvent(object):
+    __slots__ = ('operation', 'duration', 'queries', 'rows', 'workflow_code', 'node_code')
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.duration = 0.0
+        self.queries = 0
+        self.rows = 0
+        self.workflow_code = None
+        self.node_code = None
+
+    def as_dict(self):
+        return dict((slot, getattr(self, slot)) for slot in self.__slots__)
+
+    def __repr__(self):
+        return "<TransitionEvent %s %s/%s>" % (self.operation, self.workflow_code, self.node_code)
+
+
+def register_hook(hook):
+    if hook not in _hooks:
+        _hooks.append(hook)
+
+
+def unregister_hook(hook):
+    if hook in _hooks:
+        _hooks.remove(hook)
+
+
+def record_rows(count):
+    if _hooks:
+        for event in getattr(_local, 'events', ()):
+            event.rows += count
+
+
+def instrumented(operation):
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _hooks:
+                return func(*args, **kwargs)
+            arguments = signature.bind(*args, **kwargs).arguments
+            inst = arguments.get('inst')
+            # transitions move the instance, so take its node up front
+            node_id = getattr(inst, 'current_node_id', None)
+            event = TransitionEvent(operation)
+            events = _local.__dict__.setdefault('events', [])
+            events.append(event)
+            try:
+                with CaptureQueriesContext(connection) as context:
+                    start = time.perf_counter()
+                    result = func(*args, **kwargs)
+                    event.duration = (time.perf_counter() - start) * 1000
+            finally:
+                events.remove(event)
+            event.queries = len(context.captured_queries)
+            if inst is not None:
+                workflow_id = inst.workflow_id
+            elif 'node' in arguments:
+                workflow_id, node_id = arguments['node'].workflow_id, arguments['node'].pk
+            else:
+                workflow_id, node_id = arguments['workflow'].pk, getattr(result, 'current_node_id', None)
+            definition = peek_compiled_workflow(workflow_id)
+            event.workflow_code = definition.code
+            if node_id in definition.nodes:
+                event.node_code = definition.node(node_id).code
+            for hook in list(_hooks):
+                hook(event)
+            return result
+        return wrapper
+    return decorator
+
+
+class MetricsAggregator(object):
+    # in-process counters and latency histograms per operation, workflow and node
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def __call__(self, event):
+        key = (event.operation, event.workflow_code, event.node_code)
+        with self.lock:
+            metric = self.metrics.get(key)
+            if metric is None:
+                metric = self.metrics[key] = {
+                    'count': 0, 'queries': 0, 'rows': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                    'buckets': [0] * (len(LATENCY_BUCKETS) + 1)}
+            metric['count'] += 1
+            metric['queries'] += event.queries
+            metric['rows'] += event.rows
+            metric['total_ms'] += event.duration
+            metric['max_ms'] = max(metric['max_ms'], event.duration)
+            metric['buckets'][bisect_left(LATENCY_BUCKETS, event.duration)] += 1
+
+    def reset(self):
+        with self.lock:
+            self.metrics = {}
+
+    def as_list(self):
+        with self.lock:
+            metrics = sorted(self.metrics.items(), key=lambda item: tuple(
+                '' if value is None else value for value in item[0]))
+            return [dict(operation=operation, workflow=workflow_code, node=node_code,
+                         mean_ms=round(metric['total_ms'] / metric['count'], 3),
+                         max_ms=round(metric['max_ms'], 3),
+                         count=metric['count'], queries=metric['queries'], rows=metric['rows'],
+                         histogram=list(zip(BUCKET_LABELS, metric['buckets'])))
+                    for (operation, workflow_code, node_code), metric in metrics]
+
+    def dump_json(self):
+        return json.dumps(self.as_list(), indent=2, sort_keys=True)
+
+    def dump_text(self):
+        lines = []
+        for metric in self.as_list():
+            lines.append('%(operation)s %(workflow)s/%(node)s count=%(count)s queries=%(queries)s '
+                         'rows=%(rows)s mean=%(mean_ms)sms max=%(max_ms)sms' % metric)
+            lines.append('    ' + ' '.join('%s:%s' % bucket for bucket in metric['histogram']))
+        return '\n'.join(lines)
@@ -0,0 +1,31 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from simpleworkflow.archive import archive_finished_instances
+
+
+class Command(BaseCommand):
+    help = ("Move denied, terminated and completed workflow instances older than "
+            "--days, with their processes, into the archive tables.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90)
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--max-chunks', type=int, default=None,
+                            help="stop after this many chunks, a later run resumes")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="only report how many rows would be archived")
+
+    def handle(self, *args, **options):
+        def progress(instances, processes):
+            if options['verbosity'] > 1:
+                self.stdout.write("archived %s instances, %s processes" % (instances, processes))
+
+        instances, processes = archive_finished_instances(
+            options['days'], options['chunk_size'], options['dry_run'],
+            options['max_chunks'], progress)
+        if options['dry_run']:
+            self.stdout.write("Would archive %s instances and %s processes" % (instances, processes))
+        else:
+            self.stdout.write("Archived %s instances and %s processes" % (instances, processes))
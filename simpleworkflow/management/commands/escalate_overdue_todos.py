@@ -0,0 +1,33 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand, CommandError
+
+from simpleworkflow.models import WorkFlow
+from simpleworkflow.escalation import escalate_overdue_todos
+
+
+class Command(BaseCommand):
+    help = ("Escalate todos older than their node's todo timeout. Several workers "
+            "may run this at once.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workflow', help="only escalate nodes of this workflow code")
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--max-chunks', type=int, default=None,
+                            help="stop after this many chunks, a later run resumes")
+
+    def handle(self, *args, **options):
+        workflow = None
+        if options['workflow']:
+            workflow = WorkFlow.objects.filter(code=options['workflow']).first()
+            if workflow is None:
+                raise CommandError("Unknown workflow %s" % options['workflow'])
+
+        def progress(node, escalated):
+            if options['verbosity'] > 1:
+                self.stdout.write("%s/%s: escalated %s" % (node.workflow_id, node.code, escalated))
+
+        counts = escalate_overdue_todos(workflow, options['chunk_size'],
+                                        max_chunks=options['max_chunks'], progress=progress)
+        self.stdout.write("Reassigned %(reassigned)s todos, added %(approvers_added)s approvers, "
+                          "terminated %(terminated)s instances" % counts)
@@ -0,0 +1,32 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand, CommandError
+
+from simpleworkflow.models import WorkFlow
+from simpleworkflow.importexport import export_workflow, dumps
+
+
+class Command(BaseCommand):
+    help = "Export workflow definitions as JSON or YAML."
+
+    def add_arguments(self, parser):
+        parser.add_argument('codes', nargs='+', help="workflow codes")
+        parser.add_argument('--format', choices=('json', 'yaml'), default='json')
+        parser.add_argument('--output', help="write to this file instead of stdout")
+
+    def handle(self, *args, **options):
+        workflows = []
+        for code in options['codes']:
+            workflow = WorkFlow.objects.filter(code=code).first()
+            if workflow is None:
+                raise CommandError("Unknown workflow %s" % code)
+            workflows.append(export_workflow(workflow))
+        try:
+            output = dumps(workflows, options['format'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
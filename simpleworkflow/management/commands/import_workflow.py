@@ -0,0 +1,30 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from simpleworkflow.importexport import import_workflow, loads
+
+
+class Command(BaseCommand):
+    help = "Import workflow definitions exported by export_workflow."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=('json', 'yaml'), default=None,
+                            help="defaults to the file extension")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or ('yaml' if path.endswith(('.yaml', '.yml')) else 'json')
+        with open(path) as f:
+            text = f.read()
+        try:
+            definitions = loads(text, format)
+            if isinstance(definitions, dict):
+                definitions = [definitions]
+            with transaction.atomic():
+                workflows = [import_workflow(definition) for definition in definitions]
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write("Imported %s" % ", ".join(workflow.code for workflow in workflows))
@@ -0,0 +1,18 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from simpleworkflow.outbox import purge_events
+
+
+class Command(BaseCommand):
+    help = ("Delete outbox events that every consumer has acknowledged, and with "
+            "--days also events older than that.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None)
+        parser.add_argument('--chunk-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        purged = purge_events(options['days'], options['chunk_size'])
+        self.stdout.write("Purged %s events" % purged)
@@ -0,0 +1,22 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand, CommandError
+
+from simpleworkflow.models import WorkFlow
+from simpleworkflow.reports import rollup
+
+
+class Command(BaseCommand):
+    help = "Refresh the per node WorkFlowReport rollup used by dashboards."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workflow', help="only roll up the workflow with this code")
+
+    def handle(self, *args, **options):
+        workflow = None
+        if options['workflow']:
+            workflow = WorkFlow.objects.filter(code=options['workflow']).first()
+            if workflow is None:
+                raise CommandError("Unknown workflow %s" % options['workflow'])
+        reports = rollup(workflow)
+        self.stdout.write("Rolled up %s nodes" % len(reports))
@@ -0,0 +1,49 @@
+from __future__ import unicode_literals
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from simpleworkflow.benchmarks import run_benchmarks, run_async_benchmark, compare_results
+
+
+class Command(BaseCommand):
+    help = ("Benchmark WorkFlowService operations against synthetic data on the "
+            "default database. All generated data is rolled back.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--instances', type=int, default=10000)
+        parser.add_argument('--processes', type=int, default=5,
+                            help="background processes per instance")
+        parser.add_argument('--group-size', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--output', help="write the JSON results to this file")
+        parser.add_argument('--baseline', help="JSON results to compare against")
+        parser.add_argument('--tolerance', type=float, default=0.5,
+                            help="allowed relative slowdown of mean timings")
+        parser.add_argument('--async', dest='async_approvals', type=int, default=0,
+                            help="instead compare this many concurrent async approvals "
+                                 "with sync ones; commits and then deletes its data")
+        parser.add_argument('--concurrency', type=int, default=10)
+
+    def handle(self, *args, **options):
+        if options['async_approvals']:
+            results = run_async_benchmark(options['async_approvals'], options['concurrency'])
+            self.stdout.write(json.dumps(results, indent=2, sort_keys=True))
+            return
+        results = run_benchmarks(options['instances'], options['processes'],
+                                 options['group_size'], options['repeat'])
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            regressions = compare_results(results, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError("Regressions against %s:\n%s" % (
+                    options['baseline'], "\n".join(regressions)))
+            self.stdout.write("No regressions against %s" % options['baseline'])
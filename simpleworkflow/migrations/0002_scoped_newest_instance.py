@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 11:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def rebuild_newest_instance(apps, schema_editor):
+    WorkFlowInstance = apps.get_model('simpleworkflow', 'WorkFlowInstance')
+    db_alias = schema_editor.connection.alias
+    instances = WorkFlowInstance.objects.using(db_alias)
+    newest_ids = list(instances.values(
+        'workflow', 'content_type', 'object_id').annotate(
+        newest=Max('id')).values_list('newest', flat=True))
+    instances.filter(is_new=True).update(is_new=False)
+    for start in range(0, len(newest_ids), 500):
+        instances.filter(pk__in=newest_ids[start:start + 500]).update(is_new=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simpleworkflow', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='workflowinstance',
+            index=models.Index(fields=['workflow', 'content_type', 'object_id', 'is_new'], name='simpleworkf_workflo_8f3f34_idx'),
+        ),
+        migrations.RunPython(rebuild_newest_instance, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 11:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+# the index is raw SQL that the migration state does not know about, so the
+# table rebuilds SQLite does for later schema changes would drop it; it is
+# created on PostgreSQL only, and dropped wherever an older run created it
+PARTIAL_INDEX_VENDORS = ('postgresql', 'sqlite')
+
+
+def create_pending_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX simpleworkf_pending_init_idx '
+        'ON simpleworkflow_workflowprocess (inst_id, node_id) WHERE pro_type = 0')
+
+
+def drop_pending_index(apps, schema_editor):
+    if schema_editor.connection.vendor not in PARTIAL_INDEX_VENDORS:
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS simpleworkf_pending_init_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simpleworkflow', '0002_scoped_newest_instance'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='workflownode',
+            index=models.Index(fields=['workflow', 'is_start'], name='simpleworkf_workflo_fd651a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workflowprocess',
+            index=models.Index(fields=['inst', 'pro_type', 'node'], name='simpleworkf_inst_id_5a5b55_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workflowprocess',
+            index=models.Index(fields=['user', 'todo'], name='simpleworkf_user_id_e799f0_idx'),
+        ),
+        migrations.RunPython(create_pending_index, drop_pending_index),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 11:09
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, F
+
+
+def count_pending_approvals(apps, schema_editor):
+    WorkFlowInstance = apps.get_model('simpleworkflow', 'WorkFlowInstance')
+    WorkFlowProcess = apps.get_model('simpleworkflow', 'WorkFlowProcess')
+    db_alias = schema_editor.connection.alias
+    pending = WorkFlowProcess.objects.using(db_alias).filter(
+        pro_type=0, node=F('inst__current_node')).values('inst').annotate(
+        pending_count=Count('id')).values_list('inst', 'pending_count')
+    for inst_id, pending_count in pending.iterator():
+        WorkFlowInstance.objects.using(db_alias).filter(pk=inst_id).update(
+            pending_count=pending_count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simpleworkflow', '0003_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workflowinstance',
+            name='pending_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='pending approvals'),
+        ),
+        migrations.RunPython(count_pending_approvals, migrations.RunPython.noop),
+    ]
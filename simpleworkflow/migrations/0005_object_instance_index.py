@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 11:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simpleworkflow', '0004_instance_pending_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='workflowinstance',
+            index=models.Index(fields=['content_type', 'object_id', 'is_new'], name='simpleworkf_content_f6402a_idx'),
+        ),
+    ]
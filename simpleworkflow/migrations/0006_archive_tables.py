@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 11:13
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('simpleworkflow', '0005_object_instance_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkFlowInstanceArchive',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('code', models.CharField(blank=True, max_length=20, null=True, verbose_name='instance code')),
+                ('name', models.CharField(blank=True, max_length=50, null=True, verbose_name='instance name')),
+                ('object_id', models.PositiveIntegerField(verbose_name='object_id')),
+                ('workflow_status', models.IntegerField(choices=[(1, 'NEW'), (2, 'IN PROGRESS'), (3, 'DENY'), (4, 'TERMINATED'), (99, 'COMPLETED')], verbose_name='workflow status')),
+                ('is_new', models.BooleanField(default=True, verbose_name='newest_instance')),
+                ('pending_count', models.PositiveIntegerField(default=0, verbose_name='pending approvals')),
+                ('date_created', models.DateTimeField(verbose_name='date_created')),
+                ('date_updated', models.DateTimeField(verbose_name='date_updated')),
+                ('content_type', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='contenttypes.ContentType', verbose_name='content_type')),
+                ('current_node', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='simpleworkflow.WorkFlowNode')),
+                ('starter', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='start user')),
+                ('workflow', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='simpleworkflow.WorkFlow')),
+            ],
+            options={
+                'verbose_name': 'workflow_instance_archive',
+                'verbose_name_plural': 'workflow_instance_archive',
+            },
+        ),
+        migrations.CreateModel(
+            name='WorkFlowProcessArchive',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('todo', models.BooleanField(default=False, verbose_name='is todo')),
+                ('pro_time', models.DateTimeField(null=True, verbose_name='process time')),
+                ('pro_type', models.IntegerField(choices=[(0, 'INIT'), (1, 'AGREE'), (2, 'DENY'), (4, 'TERMINATED'), (3, 'SUBMIT')], verbose_name='process type')),
+                ('note', models.TextField(blank=True, null=True, verbose_name='note')),
+                ('date_created', models.DateTimeField(verbose_name='date_created')),
+                ('date_updated', models.DateTimeField(verbose_name='date_updated')),
+                ('inst', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='simpleworkflow.WorkFlowInstanceArchive', verbose_name='workflow instance')),
+                ('node', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='simpleworkflow.WorkFlowNode', verbose_name='current node')),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='submitter')),
+            ],
+            options={
+                'verbose_name': 'workflow_process_archive',
+                'verbose_name_plural': 'workflow_process_archive',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='workflowinstancearchive',
+            index=models.Index(fields=['content_type', 'object_id'], name='simpleworkf_content_e8aa4c_idx'),
+        ),
+    ]
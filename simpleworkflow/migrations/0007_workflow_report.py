@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 11:14
+from __future__ import unicode_literals
+
+import datetime
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simpleworkflow', '0006_archive_tables'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkFlowReport',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('new_count', models.PositiveIntegerField(default=0, verbose_name='new')),
+                ('in_progress_count', models.PositiveIntegerField(default=0, verbose_name='in progress')),
+                ('deny_count', models.PositiveIntegerField(default=0, verbose_name='deny')),
+                ('terminated_count', models.PositiveIntegerField(default=0, verbose_name='terminated')),
+                ('completed_count', models.PositiveIntegerField(default=0, verbose_name='completed')),
+                ('approval_count', models.PositiveIntegerField(default=0, verbose_name='approvals')),
+                ('approval_duration', models.DurationField(default=datetime.timedelta, verbose_name='total approval time')),
+                ('max_approval_duration', models.DurationField(default=datetime.timedelta, verbose_name='max approval time')),
+                ('rolled_up_to', models.DateTimeField(null=True, verbose_name='rolled up to')),
+                ('date_updated', models.DateTimeField(auto_now=True, verbose_name='date_updated')),
+                ('node', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='simpleworkflow.WorkFlowNode')),
+                ('workflow', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='simpleworkflow.WorkFlow')),
+            ],
+            options={
+                'verbose_name': 'workflow_report',
+                'verbose_name_plural': 'workflow_report',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='workflowreport',
+            unique_together=set([('workflow', 'node')]),
+        ),
+    ]
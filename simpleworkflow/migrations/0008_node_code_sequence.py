@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 11:17
+from __future__ import unicode_literals
+
+import re
+
+from django.db import migrations, models
+
+
+def seed_node_sequences(apps, schema_editor):
+    # starts each sequence past every N-code in use and renames duplicate codes
+    # so that the unique index can be created
+    WorkFlow = apps.get_model('simpleworkflow', 'WorkFlow')
+    WorkFlowNode = apps.get_model('simpleworkflow', 'WorkFlowNode')
+    db_alias = schema_editor.connection.alias
+    nodes = {}
+    for node_id, workflow_id, code in WorkFlowNode.objects.using(db_alias).order_by(
+            'pk').values_list('pk', 'workflow_id', 'code').iterator():
+        nodes.setdefault(workflow_id, []).append((node_id, code))
+    for workflow_id, codes in nodes.items():
+        sequence = len(codes)
+        for node_id, code in codes:
+            match = re.match(r'^N(\d+)$', code)
+            if match:
+                sequence = max(sequence, int(match.group(1)))
+        used = set()
+        for node_id, code in codes:
+            if code in used:
+                sequence += 1
+                code = 'N%02d' % sequence
+                WorkFlowNode.objects.using(db_alias).filter(pk=node_id).update(code=code)
+            used.add(code)
+        WorkFlow.objects.using(db_alias).filter(pk=workflow_id).update(node_sequence=sequence)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simpleworkflow', '0007_workflow_report'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workflow',
+            name='node_sequence',
+            field=models.PositiveIntegerField(default=0, verbose_name='node sequence'),
+        ),
+        migrations.RunPython(seed_node_sequences, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='workflownode',
+            unique_together=set([('workflow', 'code')]),
+        ),
+    ]
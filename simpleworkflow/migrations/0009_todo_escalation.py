@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 11:18
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('simpleworkflow', '0008_node_code_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workflownode',
+            name='escalation_type',
+            field=models.IntegerField(choices=[(0, 'NONE'), (1, 'REASSIGN'), (2, 'ADD APPROVER'), (3, 'TERMINATE')], default=0, verbose_name='escalation type'),
+        ),
+        migrations.AddField(
+            model_name='workflownode',
+            name='escalation_user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='escalation user'),
+        ),
+        migrations.AddField(
+            model_name='workflownode',
+            name='todo_timeout',
+            field=models.DurationField(blank=True, null=True, verbose_name='todo timeout'),
+        ),
+        migrations.AddIndex(
+            model_name='workflowprocess',
+            index=models.Index(fields=['todo', 'date_created'], name='simpleworkf_todo_8b40f2_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 11:19
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simpleworkflow', '0009_todo_escalation'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='workflowinstance',
+            index=models.Index(fields=['workflow_status', 'date_updated'], name='simpleworkf_workflo_3adafc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workflowprocess',
+            index=models.Index(fields=['pro_type', 'todo'], name='simpleworkf_pro_typ_08ea00_idx'),
+        ),
+    ]
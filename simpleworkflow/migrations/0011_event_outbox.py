@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 11:22
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('simpleworkflow', '0010_admin_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkFlowEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('event_type', models.IntegerField(choices=[(1, 'STARTED'), (2, 'ADVANCED'), (3, 'DENIED'), (4, 'TERMINATED'), (5, 'COMPLETED')], verbose_name='event type')),
+                ('object_id', models.PositiveIntegerField(verbose_name='object_id')),
+                ('date_created', models.DateTimeField(auto_now_add=True, verbose_name='date_created')),
+                ('content_type', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='contenttypes.ContentType', verbose_name='content_type')),
+                ('inst', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='simpleworkflow.WorkFlowInstance', verbose_name='workflow instance')),
+                ('node', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='simpleworkflow.WorkFlowNode', verbose_name='current node')),
+                ('workflow', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='simpleworkflow.WorkFlow')),
+            ],
+            options={
+                'verbose_name': 'workflow_event',
+                'verbose_name_plural': 'workflow_event',
+            },
+        ),
+        migrations.CreateModel(
+            name='WorkFlowEventConsumer',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='consumer name')),
+                ('position', models.BigIntegerField(default=0, verbose_name='position')),
+                ('date_updated', models.DateTimeField(auto_now=True, verbose_name='date_updated')),
+            ],
+            options={
+                'verbose_name': 'workflow_event_consumer',
+                'verbose_name_plural': 'workflow_event_consumer',
+            },
+        ),
+    ]
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 11:24
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simpleworkflow', '0011_event_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkFlowInstanceNode',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('is_active', models.BooleanField(default=False, verbose_name='active')),
+                ('arrivals', models.PositiveIntegerField(default=0, verbose_name='arrived branches')),
+                ('inst', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='simpleworkflow.WorkFlowInstance', verbose_name='workflow instance')),
+            ],
+            options={
+                'verbose_name': 'workflow_instance_node',
+                'verbose_name_plural': 'workflow_instance_node',
+            },
+        ),
+        migrations.CreateModel(
+            name='WorkFlowTransition',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+            options={
+                'verbose_name': 'workflow_transition',
+                'verbose_name_plural': 'workflow_transition',
+            },
+        ),
+        migrations.AddField(
+            model_name='workflownode',
+            name='join_type',
+            field=models.IntegerField(choices=[(1, 'ANY'), (2, 'ALL')], default=2, verbose_name='join type'),
+        ),
+        migrations.AddField(
+            model_name='workflowtransition',
+            name='source',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='outgoing_transitions', to='simpleworkflow.WorkFlowNode', verbose_name='source node'),
+        ),
+        migrations.AddField(
+            model_name='workflowtransition',
+            name='target',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='incoming_transitions', to='simpleworkflow.WorkFlowNode', verbose_name='target node'),
+        ),
+        migrations.AddField(
+            model_name='workflowtransition',
+            name='workflow',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='simpleworkflow.WorkFlow'),
+        ),
+        migrations.AddField(
+            model_name='workflowinstancenode',
+            name='node',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='simpleworkflow.WorkFlowNode'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='workflowtransition',
+            unique_together=set([('source', 'target')]),
+        ),
+        migrations.AddIndex(
+            model_name='workflowinstancenode',
+            index=models.Index(fields=['inst', 'is_active'], name='simpleworkf_inst_id_724691_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='workflowinstancenode',
+            unique_together=set([('inst', 'node')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 12:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simpleworkflow', '0012_parallel_branches'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workflow',
+            name='definition_version',
+            field=models.CharField(blank=True, default='', max_length=32, verbose_name='definition version'),
+        ),
+    ]
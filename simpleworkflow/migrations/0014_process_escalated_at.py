@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 12:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simpleworkflow', '0013_workflow_definition_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workflowprocess',
+            name='escalated_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='escalated at'),
+        ),
+        migrations.AddField(
+            model_name='workflowprocessarchive',
+            name='escalated_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='escalated at'),
+        ),
+        migrations.AddIndex(
+            model_name='workflowprocess',
+            index=models.Index(fields=['todo', 'escalated_at', 'date_created'], name='simpleworkf_todo_4880a6_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Count, Max
+
+INDEX_NAME = 'simpleworkflow_instance_newest_uniq'
+# backends with partial unique indexes; elsewhere is_new is kept by the
+# retire and insert sharing one transaction only. The migration state does
+# not know about the index, so a later migration that makes SQLite rebuild
+# the instance table has to create it again
+PARTIAL_INDEX_VENDORS = ('postgresql', 'sqlite')
+
+
+def create_newest_index(apps, schema_editor):
+    if schema_editor.connection.vendor not in PARTIAL_INDEX_VENDORS:
+        return
+    WorkFlowInstance = apps.get_model('simpleworkflow', 'WorkFlowInstance')
+    instances = WorkFlowInstance.objects.using(schema_editor.connection.alias)
+    # starts that raced before the index existed left several newest rows
+    for newest in instances.filter(is_new=True).values(
+            'workflow', 'content_type', 'object_id').annotate(
+            count=Count('id'), newest=Max('id')).filter(count__gt=1):
+        instances.filter(workflow=newest['workflow'], content_type=newest['content_type'],
+                         object_id=newest['object_id'], is_new=True).exclude(
+            pk=newest['newest']).update(is_new=False)
+    quote_name = schema_editor.quote_name
+    schema_editor.execute("CREATE UNIQUE INDEX %s ON %s (%s) WHERE %s" % (
+        quote_name(INDEX_NAME), quote_name(WorkFlowInstance._meta.db_table),
+        ", ".join(quote_name(column) for column in ('workflow_id', 'content_type_id', 'object_id')),
+        quote_name('is_new')))
+
+
+def drop_newest_index(apps, schema_editor):
+    if schema_editor.connection.vendor not in PARTIAL_INDEX_VENDORS:
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS %s" % schema_editor.quote_name(INDEX_NAME))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simpleworkflow', '0014_process_escalated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_newest_index, drop_newest_index),
+    ]
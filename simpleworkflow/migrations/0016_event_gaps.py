@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 12:33
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simpleworkflow', '0015_unique_newest_instance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkFlowEventGap',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.BigIntegerField(verbose_name='event id')),
+                ('date_created', models.DateTimeField(auto_now_add=True, verbose_name='date_created')),
+                ('consumer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='gaps', to='simpleworkflow.WorkFlowEventConsumer')),
+            ],
+            options={
+                'verbose_name': 'workflow_event_gap',
+                'verbose_name_plural': 'workflow_event_gap',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='workfloweventgap',
+            unique_together=set([('consumer', 'event_id')]),
+        ),
+    ]
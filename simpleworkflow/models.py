@@ -1,6 +1,9 @@
 from __future__ import unicode_literals
 
-from django.db import models
+import datetime
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
 from django.utils.translation import ugettext_lazy as _
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
@@ -8,18 +11,37 @@ from django.contrib.auth.models import User
 from django.contrib.auth.models import Group
 
 
+NODE_CODE_FORMAT = 'N%02d'
+
+
+class WorkFlowQuerySet(models.QuerySet):
+    def reserve_node_codes(self, workflow_id, count=1):
+        # the UPDATE row-locks the workflow until commit, so concurrent callers
+        # get disjoint blocks of the sequence
+        with transaction.atomic(using=self.db):
+            self.filter(pk=workflow_id).update(node_sequence=F('node_sequence') + count)
+            last = self.filter(pk=workflow_id).values_list('node_sequence', flat=True).get()
+        return [NODE_CODE_FORMAT % number for number in range(last - count + 1, last + 1)]
+
+
 class WorkFlow(models.Model):
     code = models.CharField(
         _("workflow code"), max_length=30)
     name = models.CharField(
         _("workflow name"), max_length=50)
     description = models.TextField(_("description"), blank=True, null=True)
+    node_sequence = models.PositiveIntegerField(_("node sequence"), default=0)
+    # changed on every edit of the definition, see definitions.py
+    definition_version = models.CharField(
+        _("definition version"), max_length=32, blank=True, default='')
     date_created = models.DateTimeField(_("date_created"), auto_now_add=True)
     date_updated = models.DateTimeField(_("date_updated"), auto_now=True)
 
     def __str__(self):
         return "%s" % self.name
 
+    objects = WorkFlowQuerySet.as_manager()
+
     class Meta:
         verbose_name = _("workflow")
         verbose_name_plural = _("workflow")
@@ -30,11 +52,24 @@ class LogicType(object):
     logic_all = 2
 
 
+class EscalationType(object):
+    none = 0
+    reassign = 1
+    add_approver = 2
+    terminate = 3
+
+
 class WorkFlowNode(models.Model):
     LOGIC_TYPE = (
         (LogicType.logic_any, _("ANY")),
         (LogicType.logic_all, _("ALL")),
     )
+    ESCALATION_TYPE = (
+        (EscalationType.none, _("NONE")),
+        (EscalationType.reassign, _("REASSIGN")),
+        (EscalationType.add_approver, _("ADD APPROVER")),
+        (EscalationType.terminate, _("TERMINATE")),
+    )
     workflow = models.ForeignKey(WorkFlow)
     code = models.CharField(
         _("node code"), max_length=30)
@@ -50,16 +85,36 @@ class WorkFlowNode(models.Model):
         _("logic type"), choices=LOGIC_TYPE, default=LogicType.logic_all)
     next_node = models.ForeignKey(
         'self', verbose_name=_("next node"), blank=True, null=True)
+    # with several incoming branches: ANY starts the node on the first one to
+    # arrive, ALL waits for every branch
+    join_type = models.IntegerField(
+        _("join type"), choices=LOGIC_TYPE, default=LogicType.logic_all)
+    todo_timeout = models.DurationField(_("todo timeout"), blank=True, null=True)
+    escalation_type = models.IntegerField(
+        _("escalation type"), choices=ESCALATION_TYPE, default=EscalationType.none)
+    escalation_user = models.ForeignKey(
+        User, verbose_name=_("escalation user"), blank=True, null=True,
+        on_delete=models.SET_NULL, related_name='+')
     date_created = models.DateTimeField(_("date_created"), auto_now_add=True)
     date_updated = models.DateTimeField(_("date_updated"), auto_now=True)
 
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None):
-        if not self.code:
-            fmt = 'N%02d'
-            self.code = fmt % (self.workflow.node_set.count()+1)
-        super(WorkFlowNode, self).save(
-            force_insert, force_update, using, update_fields)
+        if self.code:
+            return super(WorkFlowNode, self).save(
+                force_insert, force_update, using, update_fields)
+        # a generated code can still clash with one given explicitly earlier,
+        # the unique index catches that and the next code is tried
+        while True:
+            self.code = WorkFlow.objects.reserve_node_codes(self.workflow_id)[0]
+            try:
+                with transaction.atomic(using=using):
+                    return super(WorkFlowNode, self).save(
+                        force_insert, force_update, using, update_fields)
+            except IntegrityError:
+                if not WorkFlowNode.objects.filter(
+                        workflow_id=self.workflow_id, code=self.code).exists():
+                    raise
 
     def __str__(self):
         return "%s" % self.name
@@ -67,6 +122,28 @@ class WorkFlowNode(models.Model):
     class Meta:
         verbose_name = _("workflow_node")
         verbose_name_plural = _("workflow_node")
+        unique_together = ('workflow', 'code')
+        indexes = [
+            models.Index(fields=['workflow', 'is_start']),
+        ]
+
+
+class WorkFlowTransition(models.Model):
+    # an edge besides next_node; a node with several outgoing edges starts
+    # parallel branches, one with several incoming edges joins them
+    workflow = models.ForeignKey(WorkFlow, on_delete=models.CASCADE)
+    source = models.ForeignKey(WorkFlowNode, verbose_name=_("source node"),
+                               on_delete=models.CASCADE, related_name='outgoing_transitions')
+    target = models.ForeignKey(WorkFlowNode, verbose_name=_("target node"),
+                               on_delete=models.CASCADE, related_name='incoming_transitions')
+
+    def __str__(self):
+        return "transition:%s-%s" % (self.source_id, self.target_id)
+
+    class Meta:
+        verbose_name = _("workflow_transition")
+        verbose_name_plural = _("workflow_transition")
+        unique_together = ('source', 'target')
 
 
 class WorkFlowInstanceType(object):
@@ -77,6 +154,13 @@ class WorkFlowInstanceType(object):
     completed = 99
 
 
+class WorkFlowInstanceQuerySet(models.QuerySet):
+
+    def newest_for(self, workflow, content_type, object_id):
+        return self.filter(workflow=workflow, content_type=content_type,
+                           object_id=object_id, is_new=True)
+
+
 class WorkFlowInstance(models.Model):
     WORKFLOW_STATUS = (
         (WorkFlowInstanceType.new, _("NEW")),
@@ -99,16 +183,46 @@ class WorkFlowInstance(models.Model):
         _("workflow status"), choices=WORKFLOW_STATUS, default=WorkFlowInstanceType.new)
     is_new = models.BooleanField(_('newest_instance'), default=True)
     current_node = models.ForeignKey(WorkFlowNode, null=True)
+    pending_count = models.PositiveIntegerField(
+        _("pending approvals"), default=0)
     date_created = models.DateTimeField(
         _("date_created"), auto_now_add=True)
     date_updated = models.DateTimeField(_("date_updated"), auto_now=True)
 
+    objects = WorkFlowInstanceQuerySet.as_manager()
+
     def __str__(self):
         return "%s" % self.code
 
     class Meta:
         verbose_name = _("workflow_instance")
         verbose_name_plural = _("workflow_instance")
+        indexes = [
+            models.Index(fields=['workflow', 'content_type', 'object_id', 'is_new']),
+            models.Index(fields=['content_type', 'object_id', 'is_new']),
+            models.Index(fields=['workflow_status', 'date_updated']),
+        ]
+
+
+class WorkFlowInstanceNode(models.Model):
+    # branch state of an instance of a workflow with parallel branches: the
+    # nodes that are active and the branches that have reached each join
+    inst = models.ForeignKey(WorkFlowInstance, verbose_name=_("workflow instance"),
+                             on_delete=models.CASCADE)
+    node = models.ForeignKey(WorkFlowNode, on_delete=models.CASCADE)
+    is_active = models.BooleanField(_("active"), default=False)
+    arrivals = models.PositiveIntegerField(_("arrived branches"), default=0)
+
+    def __str__(self):
+        return "branch:%s-%s" % (self.inst_id, self.node_id)
+
+    class Meta:
+        verbose_name = _("workflow_instance_node")
+        verbose_name_plural = _("workflow_instance_node")
+        unique_together = ('inst', 'node')
+        indexes = [
+            models.Index(fields=['inst', 'is_active']),
+        ]
 
 
 class WorkFlowProcessType(object):
@@ -119,6 +233,17 @@ class WorkFlowProcessType(object):
     terminated = 4
 
 
+class WorkFlowProcessQuerySet(models.QuerySet):
+
+    def pending(self, inst, node=None):
+        if node is None:
+            return self.filter(inst=inst, pro_type=WorkFlowProcessType.init)
+        return self.filter(inst=inst, pro_type=WorkFlowProcessType.init, node=node)
+
+    def todo_for(self, user):
+        return self.filter(user=user, todo=True)
+
+
 class WorkFlowProcess(models.Model):
     PROCESS_TYPE = (
         (WorkFlowProcessType.init, _("INIT")),
@@ -140,11 +265,186 @@ class WorkFlowProcess(models.Model):
         _("note"), blank=True, null=True)
     date_created = models.DateTimeField(
          _("date_created"), auto_now_add=True)
+    # restarts the todo timeout clock, which otherwise runs from date_created
+    escalated_at = models.DateTimeField(_("escalated at"), null=True, blank=True)
     date_updated = models.DateTimeField(_("date_updated"), auto_now=True)
 
+    objects = WorkFlowProcessQuerySet.as_manager()
+
     def __str__(self):
         return "process:%s-%s" % (self.user, self.node)
 
     class Meta:
         verbose_name = _("workflow_process")
         verbose_name_plural = _("workflow_process")
+        indexes = [
+            models.Index(fields=['inst', 'pro_type', 'node']),
+            models.Index(fields=['user', 'todo']),
+            models.Index(fields=['todo', 'date_created']),
+            models.Index(fields=['todo', 'escalated_at', 'date_created']),
+            models.Index(fields=['pro_type', 'todo']),
+        ]
+
+
+class WorkFlowInstanceArchive(models.Model):
+    # finished WorkFlowInstance rows moved out of the live table, ids are kept
+    id = models.IntegerField(primary_key=True)
+    workflow = models.ForeignKey(WorkFlow, on_delete=models.DO_NOTHING,
+                                 db_constraint=False, related_name='+')
+    code = models.CharField(_("instance code"), blank=True,
+                            null=True, max_length=20)
+    name = models.CharField(_("instance name"), blank=True,
+                            null=True, max_length=50)
+    starter = models.ForeignKey(User, verbose_name=_("start user"), on_delete=models.DO_NOTHING,
+                                db_constraint=False, related_name='+')
+    content_type = models.ForeignKey(ContentType, verbose_name=_("content_type"),
+                                     on_delete=models.DO_NOTHING, db_constraint=False,
+                                     related_name='+')
+    object_id = models.PositiveIntegerField(_("object_id"))
+    content_object = GenericForeignKey('content_type', 'object_id')
+    workflow_status = models.IntegerField(
+        _("workflow status"), choices=WorkFlowInstance.WORKFLOW_STATUS)
+    is_new = models.BooleanField(_('newest_instance'), default=True)
+    current_node = models.ForeignKey(WorkFlowNode, null=True, on_delete=models.DO_NOTHING,
+                                     db_constraint=False, related_name='+')
+    pending_count = models.PositiveIntegerField(
+        _("pending approvals"), default=0)
+    date_created = models.DateTimeField(_("date_created"))
+    date_updated = models.DateTimeField(_("date_updated"))
+
+    def __str__(self):
+        return "%s" % self.code
+
+    class Meta:
+        verbose_name = _("workflow_instance_archive")
+        verbose_name_plural = _("workflow_instance_archive")
+        indexes = [
+            models.Index(fields=['content_type', 'object_id']),
+        ]
+
+
+class WorkFlowProcessArchive(models.Model):
+    # WorkFlowProcess rows of archived instances, ids are kept
+    id = models.IntegerField(primary_key=True)
+    inst = models.ForeignKey(
+        WorkFlowInstanceArchive, verbose_name=_("workflow instance"),
+        on_delete=models.DO_NOTHING, db_constraint=False)
+    node = models.ForeignKey(WorkFlowNode, verbose_name=_(
+        "current node"), blank=True, null=True, on_delete=models.DO_NOTHING,
+        db_constraint=False, related_name='+')
+    user = models.ForeignKey(User, verbose_name=_("submitter"), on_delete=models.DO_NOTHING,
+                             db_constraint=False, related_name='+')
+    todo = models.BooleanField(_("is todo"), default=False)
+    pro_time = models.DateTimeField(_("process time"), null=True)
+    pro_type = models.IntegerField(
+        _("process type"), choices=WorkFlowProcess.PROCESS_TYPE)
+    note = models.TextField(
+        _("note"), blank=True, null=True)
+    date_created = models.DateTimeField(_("date_created"))
+    escalated_at = models.DateTimeField(_("escalated at"), null=True, blank=True)
+    date_updated = models.DateTimeField(_("date_updated"))
+
+    def __str__(self):
+        return "process:%s-%s" % (self.user, self.node)
+
+    class Meta:
+        verbose_name = _("workflow_process_archive")
+        verbose_name_plural = _("workflow_process_archive")
+
+
+class WorkFlowReport(models.Model):
+    # per node rollup of instance counts and approval turnaround, kept
+    # current by the rollup_workflow_reports command
+    workflow = models.ForeignKey(WorkFlow, on_delete=models.CASCADE)
+    node = models.ForeignKey(WorkFlowNode, on_delete=models.CASCADE)
+    new_count = models.PositiveIntegerField(_("new"), default=0)
+    in_progress_count = models.PositiveIntegerField(_("in progress"), default=0)
+    deny_count = models.PositiveIntegerField(_("deny"), default=0)
+    terminated_count = models.PositiveIntegerField(_("terminated"), default=0)
+    completed_count = models.PositiveIntegerField(_("completed"), default=0)
+    approval_count = models.PositiveIntegerField(_("approvals"), default=0)
+    approval_duration = models.DurationField(_("total approval time"), default=datetime.timedelta)
+    max_approval_duration = models.DurationField(_("max approval time"), default=datetime.timedelta)
+    rolled_up_to = models.DateTimeField(_("rolled up to"), null=True)
+    date_updated = models.DateTimeField(_("date_updated"), auto_now=True)
+
+    def __str__(self):
+        return "report:%s-%s" % (self.workflow_id, self.node_id)
+
+    class Meta:
+        verbose_name = _("workflow_report")
+        verbose_name_plural = _("workflow_report")
+        unique_together = ('workflow', 'node')
+
+
+class WorkFlowEventType(object):
+    started = 1
+    advanced = 2
+    denied = 3
+    terminated = 4
+    completed = 5
+
+
+class WorkFlowEvent(models.Model):
+    # outbox row written in the transaction of the transition it describes,
+    # read by consumers in id order; references are left unconstrained so
+    # that archiving instances does not touch the outbox
+    EVENT_TYPE = (
+        (WorkFlowEventType.started, _("STARTED")),
+        (WorkFlowEventType.advanced, _("ADVANCED")),
+        (WorkFlowEventType.denied, _("DENIED")),
+        (WorkFlowEventType.terminated, _("TERMINATED")),
+        (WorkFlowEventType.completed, _("COMPLETED")),
+    )
+    id = models.BigAutoField(primary_key=True)
+    event_type = models.IntegerField(_("event type"), choices=EVENT_TYPE)
+    inst = models.ForeignKey(WorkFlowInstance, verbose_name=_("workflow instance"),
+                             on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    workflow = models.ForeignKey(WorkFlow, on_delete=models.DO_NOTHING,
+                                 db_constraint=False, related_name='+')
+    node = models.ForeignKey(WorkFlowNode, verbose_name=_("current node"), null=True,
+                             on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    content_type = models.ForeignKey(ContentType, verbose_name=_("content_type"),
+                                     on_delete=models.DO_NOTHING, db_constraint=False,
+                                     related_name='+')
+    object_id = models.PositiveIntegerField(_("object_id"))
+    date_created = models.DateTimeField(_("date_created"), auto_now_add=True)
+
+    def __str__(self):
+        return "event:%s-%s" % (self.get_event_type_display(), self.inst_id)
+
+    class Meta:
+        verbose_name = _("workflow_event")
+        verbose_name_plural = _("workflow_event")
+
+
+class WorkFlowEventConsumer(models.Model):
+    # the last event id a named consumer has acknowledged
+    name = models.CharField(_("consumer name"), max_length=50, unique=True)
+    position = models.BigIntegerField(_("position"), default=0)
+    date_updated = models.DateTimeField(_("date_updated"), auto_now=True)
+
+    def __str__(self):
+        return "%s" % self.name
+
+    class Meta:
+        verbose_name = _("workflow_event_consumer")
+        verbose_name_plural = _("workflow_event_consumer")
+
+
+class WorkFlowEventGap(models.Model):
+    # an id a consumer's position has moved past without an event behind it;
+    # the transaction holding it may still commit, so it is read again until
+    # it is filled or expires
+    consumer = models.ForeignKey(WorkFlowEventConsumer, on_delete=models.CASCADE,
+                                 related_name='gaps')
+    event_id = models.BigIntegerField(_("event id"))
+    date_created = models.DateTimeField(_("date_created"), auto_now_add=True)
+
+    def __str__(self):
+        return "gap:%s-%s" % (self.consumer_id, self.event_id)
+
+    class Meta:
+        verbose_name = _("workflow_event_gap")
+        verbose_name_plural = _("workflow_event_gap")
+        unique_together = ('consumer', 'event_id')
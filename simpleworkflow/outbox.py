@@ -0,0 +1,187 @@
+from __future__ import unicode_literals
+
+from contextlib import ExitStack
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Min
+
+from simpleworkflow.models import WorkFlowEvent, WorkFlowEventConsumer, WorkFlowEventGap
+
+
+def outbox_enabled():
+    return getattr(settings, 'SIMPLEWORKFLOW_OUTBOX', False)
+
+
+def outbox_atomic():
+    # transitions that are not atomic on their own get a transaction when the
+    # outbox is on, so that their event commits or rolls back with them
+    if outbox_enabled():
+        return transaction.atomic()
+    return ExitStack()
+
+
+def build_event(event_type, inst):
+    return WorkFlowEvent(event_type=event_type, inst_id=inst.pk, workflow_id=inst.workflow_id,
+                         node_id=inst.current_node_id, content_type_id=inst.content_type_id,
+                         object_id=inst.object_id)
+
+
+def save_events(events):
+    if not outbox_enabled() or not events:
+        return 0
+    return len(WorkFlowEvent.objects.bulk_create(events))
+
+
+def append_events(event_type, instances):
+    if not outbox_enabled():
+        return 0
+    return save_events([build_event(event_type, inst) for inst in instances])
+
+
+def read_events(after=0, limit=500, event_types=None, settle=None):
+    # events are read in id order, but a transaction that took a lower id may
+    # commit after a higher one is visible. Holding back events younger than
+    # the settle window makes that rarer, it does not rule it out: a commit
+    # that takes longer than the window still lands below a cursor that has
+    # moved on. EventConsumer keeps track of those gaps
+    if settle is None:
+        settle = getattr(settings, 'SIMPLEWORKFLOW_OUTBOX_SETTLE_SECONDS', 1)
+    events = WorkFlowEvent.objects.filter(pk__gt=after)
+    if settle:
+        events = events.filter(
+            date_created__lte=datetime.datetime.now() - datetime.timedelta(seconds=settle))
+    if event_types is not None:
+        events = events.filter(event_type__in=event_types)
+    return list(events.order_by('pk')[:limit])
+
+
+class EventConsumer(object):
+    # a named cursor over the outbox; several consumers keep their own offsets.
+    # Ids the cursor moves past without an event behind them are kept as gaps
+    # and read again for SIMPLEWORKFLOW_OUTBOX_GAP_SECONDS, so an event whose
+    # transaction commits late is still delivered, after the ones above it
+
+    def __init__(self, name, batch_size=500, event_types=None, settle=None, gap_seconds=None):
+        self.name = name
+        self.batch_size = batch_size
+        self.event_types = event_types
+        self.settle = settle
+        if gap_seconds is None:
+            gap_seconds = getattr(settings, 'SIMPLEWORKFLOW_OUTBOX_GAP_SECONDS', 300)
+        self.gap_seconds = gap_seconds
+        # ids found missing by reads not acknowledged yet, and gap ids
+        # delivered but not acknowledged yet
+        self._missing = set()
+        self._filled = set()
+
+    def get_consumer(self):
+        consumer, _ = WorkFlowEventConsumer.objects.get_or_create(name=self.name)
+        return consumer
+
+    @property
+    def position(self):
+        return self.get_consumer().position
+
+    def ack(self, event):
+        # offsets only move forward; acknowledging a gap event clears the
+        # gaps delivered up to it
+        event_id = getattr(event, 'pk', event)
+        consumer = self.get_consumer()
+        if event_id <= consumer.position:
+            filled = [gap_id for gap_id in self._filled if gap_id <= event_id]
+            consumer.gaps.filter(event_id__in=filled).delete()
+            self._filled.difference_update(filled)
+            return
+        with transaction.atomic():
+            if not WorkFlowEventConsumer.objects.filter(pk=consumer.pk, position=consumer.position).update(
+                    position=event_id, date_updated=datetime.datetime.now()):
+                # another ack moved the position meanwhile
+                return self.ack(event)
+            missing = sorted(gap_id for gap_id in self._missing
+                             if consumer.position < gap_id < event_id)
+            WorkFlowEventGap.objects.bulk_create([
+                WorkFlowEventGap(consumer=consumer, event_id=gap_id) for gap_id in missing])
+            self._missing.difference_update(missing)
+
+    def reset(self, position=0):
+        consumer, _ = WorkFlowEventConsumer.objects.update_or_create(
+            name=self.name, defaults={'position': position})
+        consumer.gaps.all().delete()
+        self._missing.clear()
+        self._filled.clear()
+
+    def read_gaps(self, consumer):
+        # the events that filled gaps so far; gaps older than gap_seconds are
+        # taken to be rolled back and dropped
+        gaps = consumer.gaps.all()
+        events = list(WorkFlowEvent.objects.filter(pk__in=gaps.values('event_id')).order_by('pk'))
+        filled = set(event.pk for event in events)
+        gaps.filter(date_created__lt=datetime.datetime.now() - datetime.timedelta(
+            seconds=self.gap_seconds)).exclude(event_id__in=filled).delete()
+        wanted = [event for event in events
+                  if self.event_types is None or event.event_type in self.event_types]
+        if len(wanted) < len(events):
+            consumer.gaps.filter(event_id__in=filled - set(event.pk for event in wanted)).delete()
+        self._filled.update(event.pk for event in wanted)
+        return wanted
+
+    def batches(self):
+        # yields lists of events, gap events first; the caller acknowledges
+        # what it has handled and a batch that is not acknowledged is read
+        # again next time
+        consumer = self.get_consumer()
+        events = self.read_gaps(consumer)
+        if events:
+            yield events
+        after = consumer.position
+        while True:
+            # all types are read, so that the ids missing from the batch are
+            # known as of one snapshot
+            events = read_events(after, self.batch_size, settle=self.settle)
+            if not events:
+                return
+            # a new consumer starts where the outbox does
+            first_id = after + 1 if after else events[0].pk
+            ids = set(event.pk for event in events)
+            self._missing.update(gap_id for gap_id in range(first_id, events[-1].pk) if gap_id not in ids)
+            wanted = [event for event in events
+                      if self.event_types is None or event.event_type in self.event_types]
+            if wanted:
+                yield wanted
+            elif self.position == after:
+                # nothing for this consumer, and nothing before it left to
+                # acknowledge
+                self.ack(events[-1])
+            after = events[-1].pk
+
+    def __iter__(self):
+        # each batch is acknowledged once all of its events were taken
+        for events in self.batches():
+            for event in events:
+                yield event
+            self.ack(events[-1])
+
+
+def purge_events(days=None, chunk_size=10000):
+    # deletes events every consumer has acknowledged, and with days also the
+    # older ones consumers have not got to
+    last_id = WorkFlowEventConsumer.objects.aggregate(position=Min('position'))['position'] or 0
+    # a gap may still be filled by a late commit
+    first_gap_id = WorkFlowEventGap.objects.aggregate(event_id=Min('event_id'))['event_id']
+    if first_gap_id is not None:
+        last_id = min(last_id, first_gap_id - 1)
+    events = WorkFlowEvent.objects.all()
+    if days is not None:
+        cutoff = datetime.datetime.now() - datetime.timedelta(days=days)
+        stale_id = events.filter(date_created__lt=cutoff).order_by('-pk').values_list(
+            'pk', flat=True).first()
+        last_id = max(last_id, stale_id or 0)
+    purged = 0
+    while True:
+        ids = list(events.filter(pk__lte=last_id).order_by('pk').values_list(
+            'pk', flat=True)[:chunk_size])
+        if not ids:
+            return purged
+        purged += WorkFlowEvent.objects.filter(pk__gte=ids[0], pk__lte=ids[-1]).delete()[0]
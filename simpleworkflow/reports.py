@@ -0,0 +1,87 @@
+from __future__ import unicode_literals
+
+import datetime
+
+from django.db import transaction
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Max, Sum
+
+from simpleworkflow.models import (WorkFlowNode, WorkFlowInstance, WorkFlowProcess,
+                                   WorkFlowInstanceType, WorkFlowReport)
+
+STATUS_FIELDS = {
+    WorkFlowInstanceType.new: 'new_count',
+    WorkFlowInstanceType.in_progress: 'in_progress_count',
+    WorkFlowInstanceType.deny: 'deny_count',
+    WorkFlowInstanceType.terminated: 'terminated_count',
+    WorkFlowInstanceType.completed: 'completed_count',
+}
+
+APPROVAL_DURATION = ExpressionWrapper(F('pro_time') - F('date_created'),
+                                      output_field=DurationField())
+
+
+def status_counts(workflow=None, using=None):
+    # live instance counts grouped by workflow, current node and status
+    instances = WorkFlowInstance.objects.using(using)
+    if workflow is not None:
+        instances = instances.filter(workflow=workflow)
+    return list(instances.values('workflow', 'current_node', 'workflow_status').annotate(
+        count=Count('pk')).order_by('workflow', 'current_node', 'workflow_status'))
+
+
+def approval_stats(workflow=None, since=None, until=None, nodes=None, using=None):
+    # handled processes grouped by node, turnaround is date_created to pro_time
+    processes = WorkFlowProcess.objects.using(using).filter(pro_time__isnull=False)
+    if workflow is not None:
+        processes = processes.filter(node__workflow=workflow)
+    if nodes is not None:
+        processes = processes.filter(node__in=nodes)
+    if since is not None:
+        processes = processes.filter(pro_time__gt=since)
+    if until is not None:
+        processes = processes.filter(pro_time__lte=until)
+    return list(processes.values('node').annotate(
+        count=Count('pk'), duration=Sum(APPROVAL_DURATION),
+        max_duration=Max(APPROVAL_DURATION)).order_by('node'))
+
+
+def rollup(workflow=None, now=None):
+    # status counts are recomputed with one grouped query, approval stats are
+    # added incrementally for processes handled since the previous rollup
+    now = now or datetime.datetime.now()
+    nodes = WorkFlowNode.objects.all()
+    if workflow is not None:
+        nodes = nodes.filter(workflow=workflow)
+    with transaction.atomic():
+        reports = dict((report.node_id, report) for report in
+                       WorkFlowReport.objects.select_for_update().filter(node__in=nodes))
+        for node_id, workflow_id in nodes.values_list('pk', 'workflow_id'):
+            if node_id not in reports:
+                reports[node_id] = WorkFlowReport(workflow_id=workflow_id, node_id=node_id)
+        for report in reports.values():
+            for field in STATUS_FIELDS.values():
+                setattr(report, field, 0)
+        for row in status_counts(workflow):
+            report = reports.get(row['current_node'])
+            if report is not None and row['workflow_status'] in STATUS_FIELDS:
+                setattr(report, STATUS_FIELDS[row['workflow_status']], row['count'])
+        watermarks = {}
+        for report in reports.values():
+            watermarks.setdefault(report.rolled_up_to, []).append(report.node_id)
+        for since, node_ids in watermarks.items():
+            for row in approval_stats(since=since, until=now, nodes=node_ids):
+                report = reports[row['node']]
+                report.approval_count += row['count']
+                report.approval_duration += row['duration']
+                report.max_approval_duration = max(report.max_approval_duration,
+                                                   row['max_duration'])
+        for report in reports.values():
+            report.rolled_up_to = now
+            report.save()
+    return sorted(reports.values(), key=lambda report: report.node_id)
+
+
+def dashboard(workflow, using=None):
+    # reads the rollup only, one row per node
+    return list(WorkFlowReport.objects.using(using).filter(workflow=workflow).select_related(
+        'node').order_by('node'))
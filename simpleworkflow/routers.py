@@ -0,0 +1,99 @@
+from __future__ import unicode_literals
+
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+_local = threading.local()
+
+
+def replica_database():
+    return getattr(settings, 'SIMPLEWORKFLOW_REPLICA_DATABASE', None)
+
+
+def pin_to_primary(seconds=None):
+    # reads by this thread go to the primary for a while, so a caller sees
+    # its own writes even while the replica lags behind
+    if seconds is None:
+        seconds = getattr(settings, 'SIMPLEWORKFLOW_REPLICA_STICKY_SECONDS', 5)
+    _local.pinned_until = max(getattr(_local, 'pinned_until', 0), time.monotonic() + seconds)
+
+
+def unpin():
+    _local.pinned_until = 0
+
+
+def pinned_seconds():
+    return max(getattr(_local, 'pinned_until', 0) - time.monotonic(), 0)
+
+
+def pin_cookie():
+    return getattr(settings, 'SIMPLEWORKFLOW_REPLICA_PIN_COOKIE', 'simpleworkflow_pinned')
+
+
+def read_database():
+    # the alias for a read-only query: the replica, unless there is none, the
+    # thread is pinned, or the read happens inside a transaction on the primary
+    replica = replica_database()
+    if (replica is None or connections[DEFAULT_DB_ALIAS].in_atomic_block or
+            getattr(_local, 'pinned_until', 0) > time.monotonic()):
+        return DEFAULT_DB_ALIAS
+    return replica
+
+
+class ReplicaPinMiddleware(object):
+    # carries the pin of a request that wrote over to the user's next
+    # requests, which usually run on another thread or process, in a cookie
+    # holding the time the pin ends; every request starts and ends unpinned,
+    # so a pin never leaks to the next request served by the thread
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        unpin()
+        try:
+            pinned_until = float(request.COOKIES.get(pin_cookie(), 0))
+        except ValueError:
+            pinned_until = 0
+        if pinned_until > time.time():
+            pin_to_primary(pinned_until - time.time())
+        try:
+            response = self.get_response(request)
+            seconds = pinned_seconds()
+            if seconds:
+                response.set_cookie(pin_cookie(), repr(time.time() + seconds), max_age=int(seconds) + 1,
+                                    httponly=True)
+            return response
+        finally:
+            unpin()
+
+
+class WorkFlowReplicaRouter(object):
+    # reads of simpleworkflow models go to SIMPLEWORKFLOW_REPLICA_DATABASE and
+    # writes to the primary; every write pins the thread's reads to the
+    # primary for SIMPLEWORKFLOW_REPLICA_STICKY_SECONDS, and
+    # ReplicaPinMiddleware carries the pin over to the user's next requests
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != 'simpleworkflow':
+            return None
+        # related objects come from the database their instance came from
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        return read_database()
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label == 'simpleworkflow':
+            pin_to_primary()
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = (DEFAULT_DB_ALIAS, replica_database())
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
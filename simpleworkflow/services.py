@@ -1,12 +1,38 @@
-from itertools import chain
+from itertools import chain, islice
 import datetime
 
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, OuterRef, QuerySet, Subquery
+from django.db.models.functions import Coalesce
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.auth.models import User
 
 from simpleworkflow.models import (WorkFlow, WorkFlowNode,
-                                   WorkFlowInstance, WorkFlowProcess)
-from simpleworkflow.models import LogicType, WorkFlowProcessType, WorkFlowInstanceType
+                                   WorkFlowInstance, WorkFlowProcess, WorkFlowInstanceNode,
+                                   WorkFlowInstanceArchive, WorkFlowProcessArchive)
+from simpleworkflow.models import LogicType, WorkFlowProcessType, WorkFlowInstanceType, WorkFlowEventType
+from simpleworkflow.definitions import get_compiled_workflow, get_definition_cache, get_group_versions
+from simpleworkflow.instrumentation import instrumented, record_rows
+from simpleworkflow.outbox import append_events, build_event, outbox_atomic, save_events
+
+# node id -> ((compiled node, group versions), assignee ids)
+_assignee_cache = {}
+# the instance fields transitions write; a full save would also write back
+# the is_new of an instance retired since it was loaded
+TRANSITION_FIELDS = ('workflow_status', 'current_node', 'pending_count', 'date_updated')
+
+
+def definition_version():
+    # the definition_version of an instance's workflow, for annotate()
+    return Subquery(WorkFlow.objects.filter(pk=OuterRef('workflow')).values('definition_version')[:1])
+
+
+def set_current_node(inst, node_id):
+    # assigning the raw id leaves a stale cached current_node behind
+    inst.current_node_id = node_id
+    cache_name = WorkFlowInstance._meta.get_field('current_node').get_cache_name()
+    inst.__dict__.pop(cache_name, None)
 
 
 class WorkFlowService(object):
@@ -33,83 +59,616 @@ class WorkFlowService(object):
         return next_node
 
     @staticmethod
-    def get_start_node(workflow):
-        return WorkFlowNode.objects.filter(workflow=workflow, is_start=True).first()
+    def get_start_node(workflow, using=None):
+        return WorkFlowNode.objects.using(using).filter(workflow=workflow, is_start=True).first()
+
+    @staticmethod
+    def retire_newest_instance(workflow, content_type, object_id):
+        return WorkFlowInstance.objects.newest_for(
+            workflow, content_type, object_id).update(is_new=False)
 
     @staticmethod
+    def retire_newest_instances(workflow, content_type, object_ids):
+        return WorkFlowInstance.objects.filter(
+            workflow=workflow, content_type=content_type, object_id__in=object_ids,
+            is_new=True).update(is_new=False)
+
+    @staticmethod
+    @instrumented('start_workflow_instance')
     def start_workflow_instance(workflow, content_object, starter, code=None, name=None):
-        WorkFlowInstance.objects.filter(is_new=True).update(is_new=False)
-        workflowinstance = WorkFlowInstance.objects.filter(is_new=True).first()
-        if workflowinstance is not None:
-                WorkFlowService.handle_terminated_instance(workflowinstance)
         content_type = ContentType.objects.get_for_model(content_object)
-        start_node = WorkFlowService.get_start_node(workflow)
-        if start_node is None:
-            return None
-        workflowinstance = WorkFlowInstance.objects.create(
-            workflow=workflow, current_node=start_node, starter=starter, object_id=content_object.id,
-            content_type=content_type, code=code, name=name)
+        definition = get_compiled_workflow(workflow.pk)
+        start_node = definition.start_node
+        for attempt in range(2):
+            try:
+                with transaction.atomic():
+                    record_rows(WorkFlowService.retire_newest_instance(
+                        workflow, content_type, content_object.id))
+                    if start_node is None:
+                        return None
+                    workflowinstance = WorkFlowInstance.objects.create(
+                        workflow=workflow, current_node_id=start_node.id, starter=starter,
+                        object_id=content_object.id, content_type=content_type, code=code, name=name)
+                    if definition.is_graph:
+                        WorkFlowInstanceNode.objects.create(
+                            inst=workflowinstance, node_id=start_node.id, is_active=True)
+                    append_events(WorkFlowEventType.started, [workflowinstance])
+                break
+            except IntegrityError:
+                # a concurrent start of the same object committed first and the
+                # unique index on its newest instance turned this one away
+                if attempt or not WorkFlowInstance.objects.newest_for(
+                        workflow, content_type, content_object.id).exists():
+                    raise
+        record_rows(1)
         return workflowinstance
 
     @staticmethod
+    def start_workflow_instances(workflow, content_objects, starter, code=None, name=None,
+                                 create_process=False, todo=True):
+        # an object listed twice is started once
+        definition = get_compiled_workflow(workflow.pk)
+        start_node = definition.start_node
+        content_types = ContentType.objects.get_for_models(
+            *set(type(content_object) for content_object in content_objects))
+        object_ids, started = {}, []
+        for content_object in content_objects:
+            ids = object_ids.setdefault(content_types[type(content_object)], [])
+            if content_object.id not in ids:
+                ids.append(content_object.id)
+                started.append(content_object)
+        for attempt in range(2):
+            try:
+                with transaction.atomic():
+                    for content_type, ids in object_ids.items():
+                        WorkFlowService.retire_newest_instances(workflow, content_type, ids)
+                    if start_node is None:
+                        return []
+                    user_ids = ()
+                    if create_process:
+                        user_ids = WorkFlowService.resolve_compiled_assignee_ids(start_node)
+                    WorkFlowInstance.objects.bulk_create(
+                        [WorkFlowInstance(workflow=workflow, current_node_id=start_node.id, starter=starter,
+                                          object_id=content_object.id, code=code, name=name,
+                                          content_type=content_types[type(content_object)],
+                                          pending_count=len(user_ids))
+                         for content_object in started])
+                    # bulk_create does not set pks on every backend
+                    workflowinstances = []
+                    for content_type, ids in object_ids.items():
+                        workflowinstances.extend(WorkFlowInstance.objects.filter(
+                            workflow=workflow, content_type=content_type, object_id__in=ids,
+                            is_new=True))
+                    if create_process:
+                        WorkFlowProcess.objects.bulk_create(
+                            [WorkFlowProcess(inst=workflowinstance, node_id=start_node.id,
+                                             todo=todo, user_id=user_id)
+                             for workflowinstance in workflowinstances for user_id in user_ids])
+                    if definition.is_graph:
+                        WorkFlowInstanceNode.objects.bulk_create(
+                            [WorkFlowInstanceNode(inst=workflowinstance, node_id=start_node.id, is_active=True)
+                             for workflowinstance in workflowinstances])
+                    append_events(WorkFlowEventType.started, workflowinstances)
+                return workflowinstances
+            except IntegrityError:
+                # as in start_workflow_instance, a concurrent start of one of
+                # the objects committed first; the retry retires its instance
+                if attempt or not any(WorkFlowInstance.objects.filter(
+                        workflow=workflow, content_type=content_type, object_id__in=ids,
+                        is_new=True).exists() for content_type, ids in object_ids.items()):
+                    raise
+
+    @staticmethod
+    def resolve_assignee_ids(node):
+        compiled_node = get_compiled_workflow(node.workflow_id).node(node.pk)
+        return WorkFlowService.resolve_compiled_assignee_ids(compiled_node)
+
+    @staticmethod
+    def resolve_compiled_assignee_ids(compiled_node):
+        if not compiled_node.group_ids:
+            return compiled_node.user_ids
+        # the cache needs SIMPLEWORKFLOW_DEFINITION_CACHE to share membership
+        # versions between processes, and is off without one; memberships
+        # written around the m2m API must call invalidate_group_membership
+        use_cache = getattr(settings, 'SIMPLEWORKFLOW_ASSIGNEE_CACHE', False) and \
+            get_definition_cache() is not None
+        if use_cache:
+            key = (compiled_node, get_group_versions(compiled_node.group_ids))
+            entry = _assignee_cache.get(compiled_node.id)
+            if entry is not None and entry[0] == key:
+                return entry[1]
+        group_user_ids = User.groups.through.objects.filter(
+            group_id__in=compiled_node.group_ids).values_list("user_id", flat=True)
+        user_ids = compiled_node.user_ids.union(group_user_ids)
+        if use_cache:
+            _assignee_cache[compiled_node.id] = (key, user_ids)
+        return user_ids
+
+    @staticmethod
+    @instrumented('create_workflow_process')
     def create_workflow_process(workflowinstance, node, todo=False, users=None):
         if users is None:
-            user_ids = node.users.values_list("pk", flat=True)
-            group_user_ids = [group.user_set.values_list(
-                "pk", flat=True) for group in node.groups.all()]
-            users = User.objects.filter(
-                pk__in=set(list(user_ids) + list(chain(*group_user_ids))))
-        WorkFlowProcess.objects.bulk_create(
+            user_ids = WorkFlowService.resolve_assignee_ids(node)
+        else:
+            user_ids = [getattr(user, "pk", user) for user in users]
+        processes = WorkFlowProcess.objects.bulk_create(
             [WorkFlowProcess(inst=workflowinstance, node=node,
-                             todo=todo, user=user) for user in users])
+                             todo=todo, user_id=user_id) for user_id in user_ids])
+        record_rows(len(processes))
+        WorkFlowService.add_pending_count(workflowinstance, node, len(processes))
+
+    @staticmethod
+    def add_pending_count(workflowinstance, node, count):
+        # pending_count tracks the init processes on the current node only
+        if count and node.pk == workflowinstance.current_node_id:
+            WorkFlowInstance.objects.filter(pk=workflowinstance.pk).update(
+                pending_count=F('pending_count') + count)
+            workflowinstance.pending_count += count
+
+    @staticmethod
+    def stream_workflow_process(workflowinstance, node, todo=False, batch_size=1000, progress=None):
+        # fan-out for nodes assigned to very large groups: assignee ids are
+        # streamed from the database and inserted batch by batch
+        compiled_node = get_compiled_workflow(node.workflow_id).node(node.pk)
+        user_ids = iter(sorted(compiled_node.user_ids))
+        if compiled_node.group_ids:
+            group_user_ids = User.groups.through.objects.filter(
+                group_id__in=compiled_node.group_ids).exclude(
+                user_id__in=compiled_node.user_ids).values_list(
+                "user_id", flat=True).distinct().order_by("user_id").iterator()
+            user_ids = chain(user_ids, group_user_ids)
+        created = 0
+        with transaction.atomic():
+            while True:
+                batch = [WorkFlowProcess(inst=workflowinstance, node=node,
+                                         todo=todo, user_id=user_id)
+                         for user_id in islice(user_ids, batch_size)]
+                if not batch:
+                    break
+                WorkFlowProcess.objects.bulk_create(batch)
+                created += len(batch)
+                if progress is not None:
+                    progress(created)
+            WorkFlowService.add_pending_count(workflowinstance, node, created)
+        return created
+
+    @staticmethod
+    def inbox(user, before=None, limit=20, using=None):
+        # keyset pagination: pass the pk of the last process of a page as
+        # ``before`` to fetch the next one
+        processes = WorkFlowProcess.objects.using(using).todo_for(user).select_related(
+            'inst__workflow', 'node').prefetch_related(
+            'inst__content_object').order_by('-pk')
+        if before is not None:
+            processes = processes.filter(pk__lt=before)
+        return list(processes[:limit])
+
+    @staticmethod
+    def inbox_count(user, using=None):
+        return WorkFlowProcess.objects.using(using).todo_for(user).count()
+
+    @staticmethod
+    def instances_for(content_objects, workflow=None, approvers=False, using=None):
+        # newest instance per object pk for a queryset or a list of objects of
+        # one model, from the archive for objects whose newest instance was
+        # archived; with approvers, each instance gets the todo processes of
+        # its current node as ``pending_processes``
+        if isinstance(content_objects, QuerySet):
+            model = content_objects.model
+            object_ids = content_objects.values('pk')
+        else:
+            content_objects = list(content_objects)
+            if not content_objects:
+                return {}
+            model = type(content_objects[0])
+            object_ids = [content_object.pk for content_object in content_objects]
+        lookups = dict(content_type=ContentType.objects.get_for_model(model),
+                       object_id__in=object_ids, is_new=True)
+        if workflow is not None:
+            lookups['workflow'] = workflow
+        result = {}
+        for inst in WorkFlowInstance.objects.using(using).filter(**lookups).select_related(
+                'current_node').order_by('pk'):
+            result[inst.object_id] = inst
+        archived = {}
+        if isinstance(object_ids, list):
+            object_ids = lookups['object_id__in'] = [
+                object_id for object_id in object_ids if object_id not in result]
+        if not isinstance(object_ids, list) or object_ids:
+            for inst in WorkFlowInstanceArchive.objects.using(using).filter(**lookups).exclude(
+                    object_id__in=list(result)).select_related('current_node').order_by('pk'):
+                inst.pending_processes = []
+                archived[inst.object_id] = inst
+        if approvers and result:
+            by_pk = dict((inst.pk, inst) for inst in result.values())
+            for inst in by_pk.values():
+                inst.pending_processes = []
+            for workflowprocess in WorkFlowProcess.objects.using(using).filter(
+                    inst_id__in=list(by_pk), todo=True).select_related('user'):
+                inst = by_pk[workflowprocess.inst_id]
+                if workflowprocess.node_id == inst.current_node_id:
+                    workflowprocess.inst = inst
+                    inst.pending_processes.append(workflowprocess)
+        result.update(archived)
+        return result
+
+    @staticmethod
+    def request_memo(request):
+        # a memo for can_act that lives as long as the request
+        return request.__dict__.setdefault('_simpleworkflow_memo', {})
+
+    @staticmethod
+    def can_act(user, instances, memo=None):
+        # the user's actionable process (todo, init, on the current node) per
+        # instance pk, from one query over the (user, todo) index; instances
+        # the user cannot act on are left out. Checks already in memo are
+        # answered from it, and the processes carry the instances passed in,
+        # so handing one to handle_workflow_process fetches nothing again
+        instances = dict((getattr(inst, 'pk', inst), inst) for inst in instances)
+        user_id = getattr(user, 'pk', user)
+        if memo is None:
+            memo = {}
+        missing = [inst_id for inst_id in instances if (user_id, inst_id) not in memo]
+        if missing:
+            definitions = {}
+            for inst_id in missing:
+                memo[(user_id, inst_id)] = None
+            processes = WorkFlowProcess.objects.filter(
+                user_id=user_id, todo=True, pro_type=WorkFlowProcessType.init,
+                inst_id__in=missing).annotate(
+                inst_current_node_id=F('inst__current_node'),
+                inst_workflow_id=F('inst__workflow')).order_by('pk')
+            for workflowprocess in processes:
+                # with parallel branches every active node is actionable
+                if workflowprocess.node_id != workflowprocess.inst_current_node_id:
+                    workflow_id = workflowprocess.inst_workflow_id
+                    if workflow_id not in definitions:
+                        definitions[workflow_id] = get_compiled_workflow(workflow_id)
+                    if not definitions[workflow_id].is_graph:
+                        continue
+                if memo[(user_id, workflowprocess.inst_id)] is not None:
+                    continue
+                inst = instances[workflowprocess.inst_id]
+                if isinstance(inst, WorkFlowInstance):
+                    workflowprocess.inst = inst
+                memo[(user_id, workflowprocess.inst_id)] = workflowprocess
+        return dict((inst_id, memo[(user_id, inst_id)]) for inst_id in instances
+                    if memo[(user_id, inst_id)] is not None)
+
+    @staticmethod
+    def get_instance(pk, using=None):
+        # live or archived instance
+        inst = WorkFlowInstance.objects.using(using).filter(pk=pk).first()
+        if inst is None:
+            inst = WorkFlowInstanceArchive.objects.using(using).filter(pk=pk).first()
+        return inst
+
+    @staticmethod
+    def instance_history(content_object, workflow=None, using=None):
+        # every instance of an object, live and archived, oldest first
+        lookups = dict(content_type=ContentType.objects.get_for_model(content_object),
+                       object_id=content_object.pk)
+        if workflow is not None:
+            lookups['workflow'] = workflow
+        instances = list(WorkFlowInstance.objects.using(using).filter(**lookups)) + \
+            list(WorkFlowInstanceArchive.objects.using(using).filter(**lookups))
+        return sorted(instances, key=lambda inst: inst.pk)
 
     @staticmethod
+    def process_history(inst, using=None):
+        if isinstance(inst, WorkFlowInstanceArchive):
+            return list(WorkFlowProcessArchive.objects.using(using).filter(
+                inst_id=inst.pk).order_by('pk'))
+        return list(WorkFlowProcess.objects.using(using).filter(inst_id=inst.pk).order_by('pk'))
+
+    @staticmethod
+    def annotate_workflow_status(queryset, workflow=None, prefix='workflow_'):
+        # the newest instance of each object, falling back to the archive
+        lookups = dict(content_type=ContentType.objects.get_for_model(queryset.model),
+                       object_id=OuterRef('pk'), is_new=True)
+        if workflow is not None:
+            lookups['workflow'] = workflow
+        instances = WorkFlowInstance.objects.filter(**lookups).order_by('-pk')
+        archived = WorkFlowInstanceArchive.objects.filter(**lookups).order_by('-pk')
+
+        def newest(field):
+            return Coalesce(Subquery(instances.values(field)[:1]), Subquery(archived.values(field)[:1]))
+        return queryset.annotate(**{
+            prefix + 'instance_id': newest('pk'),
+            prefix + 'status': newest('workflow_status'),
+            prefix + 'node_code': newest('current_node__code'),
+        })
+
+    @staticmethod
+    @instrumented('handle_deny_instance')
     def handle_deny_instance(inst):
-        WorkFlowProcess.objects.filter(inst=inst, pro_type=WorkFlowProcessType.init
-                                       ).update(pro_type=WorkFlowProcessType.submit, todo=False)
-        inst.workflow_status = WorkFlowInstanceType.deny
-        inst.save()
+        with outbox_atomic():
+            record_rows(WorkFlowProcess.objects.pending(inst).update(
+                pro_type=WorkFlowProcessType.submit, todo=False))
+            WorkFlowInstanceNode.objects.filter(inst=inst, is_active=True).update(is_active=False)
+            inst.workflow_status = WorkFlowInstanceType.deny
+            inst.pending_count = 0
+            inst.save(update_fields=TRANSITION_FIELDS)
+            append_events(WorkFlowEventType.denied, [inst])
+        record_rows(1)
 
     @staticmethod
+    @instrumented('handle_terminated_instance')
     def handle_terminated_instance(inst):
-        WorkFlowProcess.objects.filter(inst=inst, pro_type=WorkFlowProcessType.init
-                                       ).update(pro_type=WorkFlowProcessType.terminated, todo=False)
-        inst.workflow_status = WorkFlowInstanceType.terminated
-        inst.save()
+        with outbox_atomic():
+            record_rows(WorkFlowProcess.objects.pending(inst).update(
+                pro_type=WorkFlowProcessType.terminated, todo=False))
+            WorkFlowInstanceNode.objects.filter(inst=inst, is_active=True).update(is_active=False)
+            inst.workflow_status = WorkFlowInstanceType.terminated
+            inst.pending_count = 0
+            inst.save(update_fields=TRANSITION_FIELDS)
+            append_events(WorkFlowEventType.terminated, [inst])
+        record_rows(1)
+
+    @staticmethod
+    def handle_terminated_instances(instances):
+        # batched handle_terminated_instance, instances that already finished
+        # are left alone; returns the number terminated
+        inst_ids = [getattr(inst, 'pk', inst) for inst in instances]
+        with transaction.atomic():
+            inst_ids = list(WorkFlowInstance.objects.select_for_update().filter(
+                pk__in=inst_ids, workflow_status__in=(
+                    WorkFlowInstanceType.new, WorkFlowInstanceType.in_progress)).order_by(
+                'pk').values_list('pk', flat=True))
+            record_rows(WorkFlowProcess.objects.filter(
+                inst_id__in=inst_ids, pro_type=WorkFlowProcessType.init).update(
+                pro_type=WorkFlowProcessType.terminated, todo=False))
+            WorkFlowInstanceNode.objects.filter(inst_id__in=inst_ids, is_active=True).update(is_active=False)
+            instances = WorkFlowInstance.objects.filter(pk__in=inst_ids)
+            terminated = instances.update(
+                workflow_status=WorkFlowInstanceType.terminated, pending_count=0,
+                date_updated=datetime.datetime.now())
+            record_rows(terminated)
+            append_events(WorkFlowEventType.terminated, instances)
+        return terminated
 
     @staticmethod
-    def handle_agree_instance(inst):
+    def lock_instance(inst):
+        # row lock on the instance, refreshing the fields transitions decide on;
+        # returns the definition version of its workflow, read by a subquery,
+        # which FOR UPDATE leaves unlocked
+        inst.workflow_status, current_node_id, inst.pending_count, version = \
+            WorkFlowInstance.objects.select_for_update().filter(pk=inst.pk).annotate(
+                definition_version=definition_version()).values_list(
+                'workflow_status', 'current_node_id', 'pending_count', 'definition_version').get()
+        if current_node_id != inst.current_node_id:
+            set_current_node(inst, current_node_id)
+        return version
+
+    @staticmethod
+    @instrumented('handle_agree_instance')
+    def handle_agree_instance(inst, node_id=None, definition=None):
+        # the ALL decision relies on inst.pending_count, which
+        # handle_workflow_process keeps current under the instance row lock;
+        # node_id, the node agreed on, only matters with parallel branches
         merge_to_next = False
-        if inst.current_node.logic_type == LogicType.logic_any:
-            WorkFlowProcess.objects.filter(inst=inst, pro_type=WorkFlowProcessType.init,
-                                           node=inst.current_node
-                                           ).update(pro_type=WorkFlowProcessType.submit, todo=False)
-            merge_to_next = True
-        else:
-            if not WorkFlowProcess.objects.filter(inst=inst,
-                                                  pro_type=WorkFlowProcessType.init,
-                                                  node=inst.current_node).count():
+        event_type = None
+        if definition is None:
+            definition = get_compiled_workflow(inst.workflow_id)
+        if definition.is_graph:
+            return WorkFlowService.handle_agree_branch(
+                inst, definition, node_id or inst.current_node_id)
+        current_node = definition.node(inst.current_node_id)
+        with outbox_atomic():
+            if current_node.logic_type == LogicType.logic_any:
+                record_rows(WorkFlowProcess.objects.pending(inst, current_node.id).update(
+                    pro_type=WorkFlowProcessType.submit, todo=False))
                 merge_to_next = True
-        inst.workflow_status = WorkFlowInstanceType.in_progress
-        if merge_to_next:
-            next_node = inst.current_node.next_node
-            if inst.current_node.next_node is None:
-                inst.workflow_status = WorkFlowInstanceType.completed
             else:
-                inst.current_node = next_node
-                WorkFlowProcess.objects.filter(inst=inst,
-                                               pro_type=WorkFlowProcessType.init, node=next_node
-                                               ).update(todo=True)
-        inst.save()
-
-    @staticmethod
-    def handle_workflow_process(workflowprocess, pro_type, note=None):
-        workflowprocess.pro_time = datetime.datetime.now()
-        workflowprocess.pro_type = pro_type
-        workflowprocess.note = note
-        workflowprocess.todo = False
-        workflowprocess.save()
-        if pro_type == WorkFlowProcessType.agree:
-            WorkFlowService.handle_agree_instance(workflowprocess.inst)
-        elif pro_type == WorkFlowProcessType.deny:
-            WorkFlowService.handle_deny_instance(workflowprocess.inst)
+                if inst.pending_count <= 0:
+                    merge_to_next = True
+            inst.workflow_status = WorkFlowInstanceType.in_progress
+            if merge_to_next:
+                next_node = definition.next_node(current_node.id)
+                if next_node is None:
+                    inst.workflow_status = WorkFlowInstanceType.completed
+                    inst.pending_count = 0
+                    event_type = WorkFlowEventType.completed
+                else:
+                    set_current_node(inst, next_node.id)
+                    inst.pending_count = WorkFlowProcess.objects.pending(
+                        inst, next_node.id).update(todo=True)
+                    record_rows(inst.pending_count)
+                    event_type = WorkFlowEventType.advanced
+            inst.save(update_fields=TRANSITION_FIELDS)
+            if event_type is not None:
+                append_events(event_type, [inst])
+        record_rows(1)
+
+    @staticmethod
+    def handle_agree_branch(inst, definition, node_id):
+        # graph counterpart of handle_agree_instance: a finished node hands
+        # over to its targets through the transition table, a join node
+        # starts once its join_type is met by the branches that reached it
+        node = definition.node(node_id)
+        events = []
+        with outbox_atomic():
+            if node.logic_type == LogicType.logic_any:
+                record_rows(WorkFlowProcess.objects.pending(inst, node.id).update(
+                    pro_type=WorkFlowProcessType.submit, todo=False))
+                done = True
+            else:
+                done = not WorkFlowProcess.objects.pending(inst, node.id).exists()
+            inst.workflow_status = WorkFlowInstanceType.in_progress
+            branches = WorkFlowInstanceNode.objects.filter(inst=inst)
+            finished = done and branches.filter(node_id=node.id, is_active=True).update(is_active=False)
+            if done and not finished and node.id == inst.current_node_id:
+                # started before the workflow had parallel branches
+                finished = not branches.exists()
+            if finished:
+                ready, cancelled = [], set()
+                for target in definition.next_nodes(node.id):
+                    incoming = definition.incoming_count(target.id)
+                    if incoming > 1:
+                        if not branches.filter(node_id=target.id).update(arrivals=F('arrivals') + 1):
+                            WorkFlowInstanceNode.objects.create(inst=inst, node_id=target.id, arrivals=1)
+                        arrivals = branches.filter(node_id=target.id).values_list(
+                            'arrivals', flat=True).get()
+                        if arrivals != (1 if target.join_type == LogicType.logic_any else incoming):
+                            continue
+                        if target.join_type == LogicType.logic_any:
+                            # the branches that have not arrived are not waited for
+                            cancelled.update(definition.ancestors(target.id))
+                    ready.append(target)
+                cancelled.difference_update(target.id for target in ready)
+                if cancelled:
+                    branches.filter(node_id__in=cancelled, is_active=True).update(is_active=False)
+                    record_rows(WorkFlowProcess.objects.filter(
+                        inst=inst, node_id__in=cancelled, pro_type=WorkFlowProcessType.init).update(
+                        pro_type=WorkFlowProcessType.submit, todo=False))
+                for target in ready:
+                    if not branches.filter(node_id=target.id).update(is_active=True):
+                        WorkFlowInstanceNode.objects.create(inst=inst, node_id=target.id, is_active=True)
+                    set_current_node(inst, target.id)
+                    inst.pending_count = WorkFlowProcess.objects.pending(
+                        inst, target.id).update(todo=True)
+                    record_rows(inst.pending_count)
+                    events.append(build_event(WorkFlowEventType.advanced, inst))
+                if not ready and not branches.filter(is_active=True).exists():
+                    inst.workflow_status = WorkFlowInstanceType.completed
+                    inst.pending_count = 0
+                    events.append(build_event(WorkFlowEventType.completed, inst))
+            inst.save(update_fields=TRANSITION_FIELDS)
+            save_events(events)
+        record_rows(1)
+
+    @staticmethod
+    def handle_workflow_process(workflowprocess, pro_type, note=None, memo=None):
+        inst = workflowprocess.inst
+        with transaction.atomic():
+            version = WorkFlowService.lock_instance(inst)
+            now = datetime.datetime.now()
+            workflowprocess.pro_time = now
+            workflowprocess.pro_type = pro_type
+            workflowprocess.note = note
+            workflowprocess.todo = False
+            workflowprocess.date_updated = now
+            # resolving a pending process of the current node is what moves
+            # the counter; anything else is saved as is
+            resolved = pro_type != WorkFlowProcessType.init and WorkFlowProcess.objects.filter(
+                pk=workflowprocess.pk, node_id=inst.current_node_id,
+                pro_type=WorkFlowProcessType.init).update(
+                pro_time=now, pro_type=pro_type, note=note, todo=False, date_updated=now)
+            if resolved:
+                WorkFlowInstance.objects.filter(pk=inst.pk).update(
+                    pending_count=F('pending_count') - 1)
+                inst.pending_count -= 1
+            else:
+                workflowprocess.save()
+            if pro_type == WorkFlowProcessType.agree:
+                WorkFlowService.handle_agree_instance(
+                    inst, workflowprocess.node_id, get_compiled_workflow(inst.workflow_id, version))
+            elif pro_type == WorkFlowProcessType.deny:
+                WorkFlowService.handle_deny_instance(inst)
+        if memo is not None:
+            # can_act answers for this instance are stale now
+            for key in [key for key in memo if key[1] == inst.pk]:
+                del memo[key]
+
+    @staticmethod
+    def handle_workflow_processes(items, chunk_size=500):
+        # batched handle_workflow_process for (workflowprocess, pro_type, note)
+        # items: replays the single-item transitions in memory, in order, then
+        # writes the outcome with a few grouped UPDATE statements
+        now = datetime.datetime.now()
+        inst_ids = sorted(set(workflowprocess.inst_id for workflowprocess, _, _ in items))
+        with transaction.atomic():
+            instances = dict((inst.pk, inst) for inst in WorkFlowInstance.objects.select_for_update(
+                ).filter(pk__in=inst_ids).annotate(definition_version=definition_version()).order_by('pk'))
+            definitions = dict((inst.workflow_id, get_compiled_workflow(inst.workflow_id, inst.definition_version))
+                               for inst in instances.values())
+            # parallel branches are not replayed, they take the single path
+            linear_items = []
+            for workflowprocess, pro_type, note in items:
+                inst = instances[workflowprocess.inst_id]
+                if definitions[inst.workflow_id].is_graph:
+                    workflowprocess.inst = inst
+                    WorkFlowService.handle_workflow_process(workflowprocess, pro_type, note)
+                else:
+                    linear_items.append((workflowprocess, pro_type, note))
+            items = linear_items
+            linear_ids = sorted(set(workflowprocess.inst_id for workflowprocess, _, _ in items))
+            pending = dict((inst_id, {}) for inst_id in linear_ids)
+            for pk, inst_id, node_id in WorkFlowProcess.objects.filter(
+                    inst_id__in=linear_ids, pro_type=WorkFlowProcessType.init).values_list(
+                    'pk', 'inst_id', 'node_id'):
+                pending[inst_id][pk] = node_id
+            process_changes, touched, events = {}, set(), []
+
+            def resolve_pending(inst_id, node_id=None, **changes):
+                for pk, pending_node_id in list(pending[inst_id].items()):
+                    if node_id is None or pending_node_id == node_id:
+                        process_changes.setdefault(pk, {}).update(changes)
+                        if changes.get('pro_type', WorkFlowProcessType.init) != WorkFlowProcessType.init:
+                            del pending[inst_id][pk]
+
+            for workflowprocess, pro_type, note in items:
+                inst = instances[workflowprocess.inst_id]
+                process_changes[workflowprocess.pk] = dict(
+                    pro_time=now, pro_type=pro_type, note=note, todo=False)
+                if pro_type == WorkFlowProcessType.init:
+                    pending[inst.pk][workflowprocess.pk] = workflowprocess.node_id
+                else:
+                    pending[inst.pk].pop(workflowprocess.pk, None)
+                if pro_type == WorkFlowProcessType.agree:
+                    definition = definitions[inst.workflow_id]
+                    current_node = definition.node(inst.current_node_id)
+                    if current_node.logic_type == LogicType.logic_any:
+                        resolve_pending(inst.pk, current_node.id,
+                                        pro_type=WorkFlowProcessType.submit, todo=False)
+                        merge_to_next = True
+                    else:
+                        merge_to_next = not any(node_id == current_node.id
+                                                for node_id in pending[inst.pk].values())
+                    inst.workflow_status = WorkFlowInstanceType.in_progress
+                    if merge_to_next:
+                        next_node = definition.next_node(current_node.id)
+                        if next_node is None:
+                            inst.workflow_status = WorkFlowInstanceType.completed
+                            events.append(build_event(WorkFlowEventType.completed, inst))
+                        else:
+                            set_current_node(inst, next_node.id)
+                            resolve_pending(inst.pk, next_node.id, todo=True)
+                            events.append(build_event(WorkFlowEventType.advanced, inst))
+                    touched.add(inst.pk)
+                elif pro_type == WorkFlowProcessType.deny:
+                    resolve_pending(inst.pk, pro_type=WorkFlowProcessType.submit, todo=False)
+                    inst.workflow_status = WorkFlowInstanceType.deny
+                    events.append(build_event(WorkFlowEventType.denied, inst))
+                    touched.add(inst.pk)
+
+            groups = {}
+            for pk, changes in process_changes.items():
+                groups.setdefault(tuple(sorted(changes.items())), []).append(pk)
+            for changes, pks in groups.items():
+                for start in range(0, len(pks), chunk_size):
+                    WorkFlowProcess.objects.filter(pk__in=pks[start:start + chunk_size]).update(
+                        date_updated=now, **dict(changes))
+            groups = {}
+            for inst_id in linear_ids:
+                inst = instances[inst_id]
+                pending_count = sum(1 for node_id in pending[inst_id].values()
+                                    if node_id == inst.current_node_id)
+                if inst_id not in touched and pending_count == inst.pending_count:
+                    continue
+                inst.pending_count = pending_count
+                inst.date_updated = now
+                groups.setdefault((inst.workflow_status, inst.current_node_id, pending_count),
+                                  []).append(inst_id)
+            for (workflow_status, current_node_id, pending_count), pks in groups.items():
+                for start in range(0, len(pks), chunk_size):
+                    WorkFlowInstance.objects.filter(pk__in=pks[start:start + chunk_size]).update(
+                        workflow_status=workflow_status, current_node_id=current_node_id,
+                        pending_count=pending_count, date_updated=now)
+            save_events(events)
+        for workflowprocess, _, _ in items:
+            for field, value in process_changes[workflowprocess.pk].items():
+                setattr(workflowprocess, field, value)
+            workflowprocess.date_updated = now
+            workflowprocess.inst = instances[workflowprocess.inst_id]
+        return [instances[inst_id] for inst_id in inst_ids]
@@ -0,0 +1,78 @@
+from __future__ import unicode_literals
+
+from django.contrib.auth.models import User, Group
+from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from simpleworkflow.models import WorkFlow, WorkFlowNode, WorkFlowTransition
+from simpleworkflow.definitions import invalidate_compiled_workflow, invalidate_group_membership
+
+
+@receiver(post_save, sender=WorkFlow)
+@receiver(post_delete, sender=WorkFlow)
+def workflow_changed(sender, instance, **kwargs):
+    invalidate_compiled_workflow(instance.pk)
+
+
+@receiver(post_save, sender=WorkFlowNode)
+@receiver(post_delete, sender=WorkFlowNode)
+@receiver(post_save, sender=WorkFlowTransition)
+@receiver(post_delete, sender=WorkFlowTransition)
+def workflow_node_changed(sender, instance, **kwargs):
+    invalidate_compiled_workflow(instance.workflow_id)
+
+
+@receiver(m2m_changed, sender=WorkFlowNode.users.through)
+@receiver(m2m_changed, sender=WorkFlowNode.groups.through)
+def workflow_node_assignees_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear', 'post_clear'):
+        return
+    if not reverse:
+        invalidate_compiled_workflow(instance.workflow_id)
+        return
+    # user.workflownode_set / group.workflownode_set side
+    if action == 'post_clear':
+        return
+    nodes = WorkFlowNode.objects.all()
+    if action == 'pre_clear':
+        accessor = sender._meta.get_field(instance._meta.model_name).attname
+        node_ids = sender.objects.filter(**{accessor: instance.pk}).values('workflownode_id')
+        nodes = nodes.filter(pk__in=node_ids)
+    else:
+        nodes = nodes.filter(pk__in=pk_set)
+    for workflow_id in set(nodes.values_list('workflow_id', flat=True)):
+        invalidate_compiled_workflow(workflow_id)
+
+
+@receiver(post_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    invalidate_group_membership(instance.pk)
+
+
+@receiver(pre_delete, sender=User)
+def workflow_user_deleted(sender, instance, **kwargs):
+    # the cascade removes the user from the nodes without sending m2m_changed
+    for workflow_id in set(WorkFlowNode.objects.filter(users=instance).values_list(
+            'workflow_id', flat=True)):
+        invalidate_compiled_workflow(workflow_id)
+
+
+@receiver(pre_delete, sender=User)
+def group_member_deleted(sender, instance, **kwargs):
+    for group_id in User.groups.through.objects.filter(
+            user_id=instance.pk).values_list('group_id', flat=True):
+        invalidate_group_membership(group_id)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def group_membership_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        # group.user_set side
+        invalidate_group_membership(instance.pk)
+        return
+    if action == 'pre_clear':
+        pk_set = sender.objects.filter(user_id=instance.pk).values_list('group_id', flat=True)
+    for group_id in pk_set:
+        invalidate_group_membership(group_id)
@@ -1,14 +1,43 @@
 from __future__ import unicode_literals
 
+import asyncio
+import datetime
+import os
+import threading
+import tracemalloc
+import unittest
+from unittest import mock
+
 from model_mommy import mommy
 
-from django.test import TestCase
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, connection, connections, transaction
+from django.forms.models import inlineformset_factory
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.contrib import admin
 from django.contrib.auth.models import User, Group
 
 from simpleworkflow.models import (WorkFlow, WorkFlowNode,
-                                   WorkFlowInstance, WorkFlowProcess)
+                                   WorkFlowInstance, WorkFlowProcess, WorkFlowInstanceNode)
 from simpleworkflow.models import LogicType, WorkFlowProcessType, WorkFlowInstanceType, WorkFlowProcessType
+from simpleworkflow.models import EscalationType, WorkFlowEvent, WorkFlowEventGap, WorkFlowEventType, WorkFlowTransition
 from simpleworkflow.services import WorkFlowService
+from simpleworkflow.definitions import get_compiled_workflow, clear_compiled_workflows
+from simpleworkflow import definitions
+from simpleworkflow.benchmarks import run_benchmarks, compare_results, OPERATIONS
+from simpleworkflow.instrumentation import MetricsAggregator, register_hook, unregister_hook
+from simpleworkflow.archive import archive_finished_instances
+from simpleworkflow import reports
+from simpleworkflow.async_services import AsyncWorkFlowService
+from simpleworkflow.importexport import export_workflow, import_workflow, dumps, loads
+from simpleworkflow.escalation import escalate_chunk, escalate_overdue_todos
+from simpleworkflow.admin import (EstimatedCountPaginator, BoundedInlineFormSet, WorkFlowInstanceAdmin,
+                                  WorkFlowProcessAdmin)
+from simpleworkflow.routers import ReplicaPinMiddleware, unpin
+from simpleworkflow.outbox import EventConsumer, purge_events
 
 
 class WorkFlowServiceCreateTest(TestCase):
@@ -161,4 +190,1302 @@ class WorkFlowServiceTransmitTest(TestCase):
         self.assertTrue(WorkFlowProcess.objects.filter(pro_type=pro_type, todo=False).count() == 1, msg="deny workflow_process failed")
         self.assertTrue(WorkFlowProcess.objects.filter(pro_type=WorkFlowProcessType.submit,
                 node=current_node, todo=False).count() == 2, msg="deny workflow_process failed")
-        print("===test_handle_workflow_process_deny===")
\ No newline at end of file
+        print("===test_handle_workflow_process_deny===")
+
+class WorkFlowServiceNewestInstanceTest(TestCase):
+    def setUp(self):
+        self.user1 = mommy.make(User)
+        self.object1 = mommy.make(User)
+        self.object2 = mommy.make(User)
+        self.workflow = mommy.make(WorkFlow)
+        WorkFlowService.create_node(self.workflow, "demo1", "demo1", True, True, LogicType.logic_all,
+                                    [self.user1])
+
+    def test_start_workflow_instance_scoped(self):
+        instance1 = WorkFlowService.start_workflow_instance(self.workflow, self.object1, self.user1)
+        instance2 = WorkFlowService.start_workflow_instance(self.workflow, self.object2, self.user1)
+        # definition version, savepoint, retire update, instance insert, release
+        with self.assertNumQueries(5):
+            instance3 = WorkFlowService.start_workflow_instance(self.workflow, self.object1, self.user1)
+        self.assertFalse(WorkFlowInstance.objects.get(pk=instance1.pk).is_new, msg="retire newest instance failed")
+        self.assertTrue(WorkFlowInstance.objects.get(pk=instance2.pk).is_new, msg="retire newest instance failed")
+        self.assertTrue(instance3.is_new, msg="retire newest instance failed")
+        rows = WorkFlowService.retire_newest_instance(self.workflow, instance3.content_type, self.object1.id)
+        self.assertTrue(rows == 1, msg="retire newest instance failed")
+        print("===test_start_workflow_instance_scoped===")
+
+    @unittest.skipUnless(connection.vendor in ("postgresql", "sqlite"), "needs a partial unique index")
+    def test_start_workflow_instance_race(self):
+        instance1 = WorkFlowService.start_workflow_instance(self.workflow, self.object1, self.user1)
+        content_type = instance1.content_type
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            WorkFlowInstance.objects.create(workflow=self.workflow, starter=self.user1, object_id=self.object1.pk,
+                                            content_type=content_type, current_node=instance1.current_node)
+        retire = WorkFlowService.retire_newest_instance
+        calls = []
+
+        def late_retire(*args):
+            # the first retire runs before a concurrent start has committed
+            calls.append(args)
+            return 0 if len(calls) == 1 else retire(*args)
+        with mock.patch.object(WorkFlowService, "retire_newest_instance", staticmethod(late_retire)):
+            instance2 = WorkFlowService.start_workflow_instance(self.workflow, self.object1, self.user1)
+        self.assertTrue(len(calls) == 2, msg="racing start not retried")
+        self.assertTrue(list(WorkFlowInstance.objects.newest_for(self.workflow, content_type, self.object1.pk)) ==
+                        [instance2], msg="racing start left two newest instances")
+        print("===test_start_workflow_instance_race===")
+
+
+class WorkFlowQuerySetTest(TestCase):
+    def setUp(self):
+        self.user1 = mommy.make(User)
+        self.user2 = mommy.make(User)
+        self.workflow = mommy.make(WorkFlow)
+        self.node1 = WorkFlowService.create_node(self.workflow, "demo1", "demo1", True, False,
+                                                 LogicType.logic_all, [self.user1, self.user2])
+        self.node2 = WorkFlowService.create_node(self.workflow, "demo2", "demo2", False, True,
+                                                 LogicType.logic_all, [self.user1], None, self.node1)
+        self.instance = WorkFlowService.start_workflow_instance(self.workflow, self.user2, self.user1)
+        WorkFlowService.create_workflow_process(self.instance, self.node1, todo=True)
+        WorkFlowService.create_workflow_process(self.instance, self.node2)
+
+    def test_pending(self):
+        self.assertTrue(WorkFlowProcess.objects.pending(self.instance).count() == 3, msg="pending failed")
+        self.assertTrue(WorkFlowProcess.objects.pending(self.instance, self.node1).count() == 2,
+                        msg="pending failed")
+        print("===test_pending===")
+
+    def test_todo_for(self):
+        self.assertTrue(WorkFlowProcess.objects.todo_for(self.user1).count() == 1, msg="todo_for failed")
+        self.assertTrue(WorkFlowProcess.objects.todo_for(self.user2).count() == 1, msg="todo_for failed")
+        print("===test_todo_for===")
+
+    def test_newest_for(self):
+        instance = WorkFlowInstance.objects.newest_for(
+            self.workflow, self.instance.content_type, self.user2.id).get()
+        self.assertTrue(instance == self.instance, msg="newest_for failed")
+        print("===test_newest_for===")
+
+
+class WorkFlowServiceInboxTest(TestCase):
+    def setUp(self):
+        self.user1 = mommy.make(User)
+        self.user2 = mommy.make(User)
+        self.workflow = mommy.make(WorkFlow)
+        self.node1 = WorkFlowService.create_node(self.workflow, "demo1", "demo1", True, True,
+                                                 LogicType.logic_all, [self.user1, self.user2])
+        self.objects = mommy.make(User, _quantity=3) + mommy.make(Group, _quantity=2)
+        for content_object in self.objects:
+            instance = WorkFlowService.start_workflow_instance(self.workflow, content_object, self.user2)
+            WorkFlowService.create_workflow_process(instance, self.node1, todo=True)
+
+    def test_inbox(self):
+        # one query for the processes, one per content type for content_object
+        with self.assertNumQueries(3):
+            processes = WorkFlowService.inbox(self.user1, limit=10)
+            content_objects = [process.inst.content_object for process in processes]
+            [(process.node.code, process.inst.workflow.code) for process in processes]
+        self.assertTrue(len(processes) == 5, msg="inbox failed")
+        self.assertTrue(content_objects == list(reversed(self.objects)), msg="inbox failed")
+        print("===test_inbox===")
+
+    def test_inbox_pagination(self):
+        page1 = WorkFlowService.inbox(self.user1, limit=3)
+        page2 = WorkFlowService.inbox(self.user1, before=page1[-1].pk, limit=3)
+        self.assertTrue(len(page1) == 3 and len(page2) == 2, msg="inbox pagination failed")
+        self.assertTrue(not set(page1) & set(page2), msg="inbox pagination failed")
+        self.assertTrue(WorkFlowService.inbox_count(self.user1) == 5, msg="inbox count failed")
+        print("===test_inbox_pagination===")
+
+
+class CompiledWorkFlowTest(TestCase):
+    def setUp(self):
+        clear_compiled_workflows()
+        self.user1 = mommy.make(User)
+        self.user2 = mommy.make(User)
+        self.group1 = mommy.make(Group)
+        self.workflow = mommy.make(WorkFlow)
+        self.node1 = WorkFlowService.create_node(self.workflow, "demo1", "demo1", True, False,
+                                                 LogicType.logic_all, [self.user1])
+        self.node2 = WorkFlowService.create_node(self.workflow, "demo2", "demo2", False, True,
+                                                 LogicType.logic_any, [self.user2], [self.group1], self.node1)
+
+    def test_compile_workflow(self):
+        with self.assertNumQueries(6):
+            definition = get_compiled_workflow(self.workflow.pk)
+        # only the version is read while it has not changed
+        with self.assertNumQueries(1):
+            definition = get_compiled_workflow(self.workflow.pk)
+        self.assertTrue(definition.chain == (self.node1.pk, self.node2.pk), msg="compile workflow failed")
+        self.assertTrue(definition.start_node.code == "demo1", msg="compile workflow failed")
+        self.assertTrue(definition.next_node(self.node1.pk).code == "demo2", msg="compile workflow failed")
+        self.assertTrue(definition.node(self.node2.pk).group_ids == {self.group1.pk}, msg="compile workflow failed")
+        print("===test_compile_workflow===")
+
+    def test_invalidate_compiled_workflow(self):
+        get_compiled_workflow(self.workflow.pk)
+        self.node2.users.add(self.user1)
+        definition = get_compiled_workflow(self.workflow.pk)
+        self.assertTrue(definition.node(self.node2.pk).user_ids == {self.user1.pk, self.user2.pk},
+                        msg="invalidate compiled workflow failed")
+        self.user1.workflownode_set.remove(self.node2)
+        definition = get_compiled_workflow(self.workflow.pk)
+        self.assertTrue(definition.node(self.node2.pk).user_ids == {self.user2.pk},
+                        msg="invalidate compiled workflow failed")
+        self.node2.logic_type = LogicType.logic_all
+        self.node2.save()
+        definition = get_compiled_workflow(self.workflow.pk)
+        self.assertTrue(definition.node(self.node2.pk).logic_type == LogicType.logic_all,
+                        msg="invalidate compiled workflow failed")
+        print("===test_invalidate_compiled_workflow===")
+
+    def test_user_deleted(self):
+        self.node2.users.add(self.user1)
+        get_compiled_workflow(self.workflow.pk)
+        self.user2.delete()
+        instance = WorkFlowService.start_workflow_instance(self.workflow, self.user1, self.user1)
+        WorkFlowService.create_workflow_process(instance, self.node2)
+        self.assertTrue(list(WorkFlowProcess.objects.filter(inst=instance).values_list("user_id", flat=True)) ==
+                        [self.user1.pk], msg="deleted user not invalidated")
+        print("===test_user_deleted===")
+
+    def test_edit_in_other_process(self):
+        get_compiled_workflow(self.workflow.pk)
+        stale = dict(definitions._compiled_workflows)
+        self.node2.logic_type = LogicType.logic_all
+        self.node2.save()
+        # another process still holds the definition it compiled before the edit
+        definitions._compiled_workflows.update(stale)
+        definition = get_compiled_workflow(self.workflow.pk)
+        self.assertTrue(definition.node(self.node2.pk).logic_type == LogicType.logic_all,
+                        msg="definition version failed")
+        print("===test_edit_in_other_process===")
+
+    @override_settings(SIMPLEWORKFLOW_DEFINITION_CACHE='default')
+    def test_shared_definition_cache(self):
+        get_compiled_workflow(self.workflow.pk)
+        clear_compiled_workflows()
+        with self.assertNumQueries(0):
+            definition = get_compiled_workflow(self.workflow.pk)
+        self.assertTrue(definition.chain == (self.node1.pk, self.node2.pk), msg="shared definition cache failed")
+        self.node1.save()
+        with self.assertNumQueries(5):
+            get_compiled_workflow(self.workflow.pk)
+        # the cache holds the version of the workflow row
+        version = WorkFlow.objects.values_list("definition_version", flat=True).get(pk=self.workflow.pk)
+        clear_compiled_workflows()
+        with self.assertNumQueries(0):
+            get_compiled_workflow(self.workflow.pk, version)
+        print("===test_shared_definition_cache===")
+
+    def test_transition_without_definition_queries(self):
+        instance = WorkFlowService.start_workflow_instance(self.workflow, self.user2, self.user1)
+        WorkFlowService.create_workflow_process(instance, self.node1, todo=True)
+        WorkFlowService.create_workflow_process(instance, self.node2)
+        workflowprocess = WorkFlowProcess.objects.select_related('inst').get(node=self.node1)
+        # savepoint, instance lock reading the definition version, process
+        # update, pending counter, next node todo update, instance save, release
+        with self.assertNumQueries(7):
+            WorkFlowService.handle_workflow_process(workflowprocess, WorkFlowProcessType.agree)
+        self.assertTrue(workflowprocess.inst.current_node == self.node2, msg="transition failed")
+        print("===test_transition_without_definition_queries===")
+
+
+class WorkFlowServiceAssigneeTest(TestCase):
+    def setUp(self):
+        clear_compiled_workflows()
+        self.user1 = mommy.make(User)
+        self.user2 = mommy.make(User)
+        self.user3 = mommy.make(User)
+        self.group1 = mommy.make(Group)
+        self.group1.user_set.add(self.user1, self.user2)
+        self.group2 = mommy.make(Group)
+        self.group2.user_set.add(self.user2)
+        self.workflow = mommy.make(WorkFlow)
+        self.node1 = WorkFlowService.create_node(self.workflow, "demo1", "demo1", True, True,
+                                                 LogicType.logic_all, [self.user1], [self.group1, self.group2])
+        self.instance = WorkFlowService.start_workflow_instance(self.workflow, self.user3, self.user1)
+
+    def test_create_workflow_process_queries(self):
+        # definition version, group members lookup, the bulk insert and the
+        # pending counter
+        with self.assertNumQueries(4):
+            WorkFlowService.create_workflow_process(self.instance, self.node1, todo=True)
+        self.assertTrue(set(WorkFlowProcess.objects.values_list("user_id", flat=True)) ==
+                        {self.user1.pk, self.user2.pk}, msg="create workflow_process failed")
+        print("===test_create_workflow_process_queries===")
+
+    @override_settings(SIMPLEWORKFLOW_ASSIGNEE_CACHE=True, SIMPLEWORKFLOW_DEFINITION_CACHE='default')
+    def test_assignee_cache(self):
+        caches['default'].clear()
+        WorkFlowService.resolve_assignee_ids(self.node1)
+        # the definition and group versions come from the cache
+        with self.assertNumQueries(0):
+            user_ids = WorkFlowService.resolve_assignee_ids(self.node1)
+        self.assertTrue(user_ids == {self.user1.pk, self.user2.pk}, msg="assignee cache failed")
+        self.group2.user_set.add(self.user3)
+        user_ids = WorkFlowService.resolve_assignee_ids(self.node1)
+        self.assertTrue(user_ids == {self.user1.pk, self.user2.pk, self.user3.pk}, msg="assignee cache failed")
+        self.user3.groups.clear()
+        user_ids = WorkFlowService.resolve_assignee_ids(self.node1)
+        self.assertTrue(user_ids == {self.user1.pk, self.user2.pk}, msg="assignee cache failed")
+        print("===test_assignee_cache===")
+
+    @override_settings(SIMPLEWORKFLOW_ASSIGNEE_CACHE=True)
+    def test_assignee_cache_needs_shared_cache(self):
+        WorkFlowService.resolve_assignee_ids(self.node1)
+        # a member added by another process, which sends no signal here
+        User.groups.through.objects.create(user_id=self.user3.pk, group_id=self.group2.pk)
+        user_ids = WorkFlowService.resolve_assignee_ids(self.node1)
+        self.assertTrue(user_ids == {self.user1.pk, self.user2.pk, self.user3.pk},
+                        msg="assignee cache without a shared cache")
+        print("===test_assignee_cache_needs_shared_cache===")
+
+
+class WorkFlowServiceStreamTest(TestCase):
+    def setUp(self):
+        clear_compiled_workflows()
+        self.user1 = mommy.make(User)
+        self.user2 = mommy.make(User)
+        self.user3 = mommy.make(User)
+        self.group1 = mommy.make(Group)
+        self.group1.user_set.add(self.user1, self.user2, self.user3)
+        self.group2 = mommy.make(Group)
+        self.group2.user_set.add(self.user2)
+        self.workflow = mommy.make(WorkFlow)
+        self.node1 = WorkFlowService.create_node(self.workflow, "demo1", "demo1", True, True,
+                                                 LogicType.logic_all, [self.user1], [self.group1, self.group2])
+        self.instance = WorkFlowService.start_workflow_instance(self.workflow, self.user3, self.user1)
+
+    def test_stream_workflow_process(self):
+        progress = []
+        created = WorkFlowService.stream_workflow_process(self.instance, self.node1, todo=True,
+                                                          batch_size=2, progress=progress.append)
+        self.assertTrue(created == 3, msg="stream workflow_process failed")
+        self.assertTrue(progress == [2, 3], msg="stream workflow_process failed")
+        self.assertTrue(set(WorkFlowProcess.objects.filter(todo=True).values_list("user_id", flat=True)) ==
+                        {self.user1.pk, self.user2.pk, self.user3.pk}, msg="stream workflow_process failed")
+        print("===test_stream_workflow_process===")
+
+
+@unittest.skipUnless(os.environ.get("SIMPLEWORKFLOW_BENCHMARK"), "benchmark")
+class WorkFlowServiceStreamBenchmark(TestCase):
+    def setUp(self):
+        clear_compiled_workflows()
+        self.user1 = mommy.make(User)
+        self.group1 = mommy.make(Group)
+        self.workflow = mommy.make(WorkFlow)
+        self.node1 = WorkFlowService.create_node(self.workflow, "demo1", "demo1", True, True,
+                                                 LogicType.logic_all, None, [self.group1])
+        self.instance = WorkFlowService.start_workflow_instance(self.workflow, self.user1, self.user1)
+
+    def add_members(self, count):
+        last_pk = User.objects.order_by("-pk").values_list("pk", flat=True)[0]
+        User.objects.bulk_create(
+            [User(username="bench%s_%s" % (last_pk, i)) for i in range(count)], batch_size=500)
+        User.groups.through.objects.bulk_create(
+            [User.groups.through(user_id=user_id, group_id=self.group1.pk)
+             for user_id in User.objects.filter(pk__gt=last_pk).values_list("pk", flat=True)],
+            batch_size=500)
+
+    def measure(self):
+        WorkFlowProcess.objects.all().delete()
+        tracemalloc.start()
+        created = WorkFlowService.stream_workflow_process(self.instance, self.node1, batch_size=1000)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return created, peak
+
+    def test_stream_memory_is_flat(self):
+        self.add_members(10000)
+        created_small, peak_small = self.measure()
+        self.add_members(90000)
+        created_large, peak_large = self.measure()
+        print("===stream fan-out: %s rows peak %s bytes, %s rows peak %s bytes===" % (
+            created_small, peak_small, created_large, peak_large))
+        self.assertTrue(created_large == 100000)
+        self.assertTrue(peak_large < peak_small * 2, msg="stream fan-out memory grows with assignees")
+
+
+class WorkFlowServiceBulkStartTest(TestCase):
+    def setUp(self):
+        clear_compiled_workflows()
+        self.user1 = mommy.make(User)
+        self.user2 = mommy.make(User)
+        self.workflow = mommy.make(WorkFlow)
+        self.node1 = WorkFlowService.create_node(self.workflow, "demo1", "demo1", True, True,
+                                                 LogicType.logic_all, [self.user1, self.user2])
+        self.objects = mommy.make(Group, _quantity=3)
+        WorkFlowService.start_workflow_instance(self.workflow, self.objects[0], self.user1)
+
+    def test_start_workflow_instances(self):
+        more_objects = self.objects + mommy.make(Group, _quantity=20)
+        # definition version, savepoint, retire update, instance insert, instance
+        # fetch, process insert, release
+        with self.assertNumQueries(7):
+            instances = WorkFlowService.start_workflow_instances(
+                self.workflow, more_objects, self.user1, create_process=True)
+        self.assertTrue(len(instances) == 23, msg="start workflow_instances failed")
+        self.assertTrue(WorkFlowInstance.objects.filter(is_new=False).count() == 1,
+                        msg="start workflow_instances failed")
+        self.assertTrue(WorkFlowProcess.objects.filter(node=self.node1, todo=True).count() == 46,
+                        msg="start workflow_instances failed")
+        self.assertTrue(set(instance.content_object for instance in instances) == set(more_objects),
+                        msg="start workflow_instances failed")
+        print("===test_start_workflow_instances===")
+
+    def test_start_duplicate_objects(self):
+        instances = WorkFlowService.start_workflow_instances(
+            self.workflow, self.objects + self.objects[:2], self.user1)
+        self.assertTrue(sorted(instance.object_id for instance in instances) ==
+                        sorted(group.pk for group in self.objects), msg="duplicate objects started twice")
+        print("===test_start_duplicate_objects===")
+
+    @unittest.skipUnless(connection.vendor in ("postgresql", "sqlite"), "needs a partial unique index")
+    def test_start_workflow_instances_race(self):
+        retire = WorkFlowService.retire_newest_instances
+        calls = []
+
+        def late_retire(*args):
+            # the first retire runs before a concurrent start of objects[0] has committed
+            calls.append(args)
+            return 0 if len(calls) == 1 else retire(*args)
+        with mock.patch.object(WorkFlowService, "retire_newest_instances", staticmethod(late_retire)):
+            instances = WorkFlowService.start_workflow_instances(self.workflow, self.objects, self.user1)
+        self.assertTrue(len(calls) == 2 and len(instances) == 3, msg="racing start not retried")
+        self.assertTrue(WorkFlowInstance.objects.filter(object_id=self.objects[0].pk, is_new=True).count() == 1,
+                        msg="racing start left two newest instances")
+        print("===test_start_workflow_instances_race===")
+
+
+class WorkFlowServiceBatchHandleTest(TestCase):
+    def setUp(self):
+        clear_compiled_workflows()
+        self.user1 = mommy.make(User)
+        self.user2 = mommy.make(User)
+        self.user3 = mommy.make(User)
+        self.user4 = mommy.make(User)
+        self.workflow = mommy.make(WorkFlow)
+        self.node1 = WorkFlowService.create_node(self.workflow, "demo1", "demo1", True, False,
+                                                 LogicType.logic_all, [self.user1, self.user2])
+        self.node2 = WorkFlowService.create_node(self.workflow, "demo2", "demo2", False, False,
+                                                 LogicType.logic_any, [self.user3, self.user4], None, self.node1)
+        self.node3 = WorkFlowService.create_node(self.workflow, "demo3", "demo3", False, True,
+                                                 LogicType.logic_all, [self.user1], None, self.node2)
+
+    def start(self):
+        instances = WorkFlowService.start_workflow_instances(
+            self.workflow, mommy.make(Group, _quantity=4), self.user1)
+        instances.sort(key=lambda instance: instance.pk)
+        for instance in instances:
+            WorkFlowService.create_workflow_process(instance, self.node1, todo=True)
+            WorkFlowService.create_workflow_process(instance, self.node2)
+            WorkFlowService.create_workflow_process(instance, self.node3)
+        return instances
+
+    def items(self, instances):
+        def process(instance, user):
+            return WorkFlowProcess.objects.get(inst=instance, user=user, node__in=[self.node1, self.node2])
+        agree, deny = WorkFlowProcessType.agree, WorkFlowProcessType.deny
+        return [
+            (process(instances[0], self.user1), agree, "ok"),
+            (process(instances[0], self.user2), agree, "ok"),
+            (process(instances[1], self.user1), agree, None),
+            (process(instances[2], self.user2), deny, "no"),
+            (process(instances[3], self.user1), agree, "ok"),
+            (process(instances[3], self.user2), agree, "ok"),
+            (process(instances[3], self.user3), agree, "ok"),
+            (process(instances[3], self.user1), agree, "again"),
+        ]
+
+    def state(self, instances):
+        return [(instance.workflow_status, instance.current_node_id, instance.pending_count,
+                 [(process.node_id, process.user_id, process.pro_type, process.todo, process.note)
+                  for process in instance.workflowprocess_set.order_by("pk")])
+                for instance in WorkFlowInstance.objects.filter(pk__in=[i.pk for i in instances]).order_by("pk")]
+
+    def test_handle_workflow_processes(self):
+        single = self.start()
+        for workflowprocess, pro_type, note in self.items(single):
+            workflowprocess.inst = WorkFlowInstance.objects.get(pk=workflowprocess.inst_id)
+            WorkFlowService.handle_workflow_process(workflowprocess, pro_type, note)
+        batch = self.start()
+        items = self.items(batch)
+        WorkFlowService.handle_workflow_processes(items)
+        self.assertTrue(self.state(single) == self.state(batch), msg="batch handle workflow_process failed")
+        self.assertTrue(items[1][0].inst.current_node_id == self.node2.pk, msg="batch handle workflow_process failed")
+        self.assertTrue(items[3][0].inst.workflow_status == WorkFlowInstanceType.deny,
+                        msg="batch handle workflow_process failed")
+        print("===test_handle_workflow_processes===")
+
+    def test_handle_workflow_processes_queries(self):
+        instances = self.start()
+        items = [(process, WorkFlowProcessType.agree, "ok") for process in
+                 WorkFlowProcess.objects.filter(node=self.node1)]
+        # savepoint, instances with their definition versions, pending, process
+        # updates (items, activated), instance update, release
+        with self.assertNumQueries(7):
+            WorkFlowService.handle_workflow_processes(items)
+        self.assertTrue(WorkFlowInstance.objects.filter(current_node=self.node2).count() == len(instances),
+                        msg="batch handle workflow_process failed")
+        print("===test_handle_workflow_processes_queries===")
+
+
+class WorkFlowServicePendingCountTest(TestCase):
+    def setUp(self):
+        clear_compiled_workflows()
+        self.users = mommy.make(User, _quantity=3)
+        self.workflow = mommy.make(WorkFlow)
+        self.node1 = WorkFlowService.create_node(self.workflow, "demo1", "demo1", True, False,
+                                                 LogicType.logic_all, self.users)
+        self.node2 = WorkFlowService.create_node(self.workflow, "demo2", "demo2", False, True,
+                                                 LogicType.logic_all, self.users[:2], None, self.node1)
+        self.instance = WorkFlowService.start_workflow_instance(self.workflow, self.users[0], self.users[0])
+        WorkFlowService.create_workflow_process(self.instance, self.node1, todo=True)
+        WorkFlowService.create_workflow_process(self.instance, self.node2)
+
+    def test_pending_count(self):
+        self.assertTrue(WorkFlowInstance.objects.get(pk=self.instance.pk).pending_count == 3,
+                        msg="pending count failed")
+        for workflowprocess in WorkFlowProcess.objects.filter(node=self.node1):
+            WorkFlowService.handle_workflow_process(workflowprocess, WorkFlowProcessType.agree)
+        # an already handled process does not count twice
+        WorkFlowService.handle_workflow_process(workflowprocess, WorkFlowProcessType.agree)
+        instance = WorkFlowInstance.objects.get(pk=self.instance.pk)
+        self.assertTrue(instance.current_node == self.node2, msg="pending count failed")
+        self.assertTrue(instance.pending_count == 2, msg="pending count failed")
+        print("===test_pending_count===")
+
+
+@unittest.skipUnless(connection.features.has_select_for_update,
+                     "needs row locking, see test_settings.py to run on PostgreSQL")
+class WorkFlowServiceConcurrencyTest(TransactionTestCase):
+    def setUp(self):
+        clear_compiled_workflows()
+        self.users = mommy.make(User, _quantity=8)
+        self.workflow = mommy.make(WorkFlow)
+        self.node1 = WorkFlowService.create_node(self.workflow, "demo1", "demo1", True, False,
+                                                 LogicType.logic_all, self.users)
+        self.node2 = WorkFlowService.create_node(self.workflow, "demo2", "demo2", False, False,
+                                                 LogicType.logic_all, self.users[:2], None, self.node1)
+        self.node3 = WorkFlowService.create_node(self.workflow, "demo3", "demo3", False, True,
+                                                 LogicType.logic_all, self.users[:1], None, self.node2)
+        self.instance = WorkFlowService.start_workflow_instance(self.workflow, self.users[0], self.users[0])
+        WorkFlowService.create_workflow_process(self.instance, self.node1, todo=True)
+        WorkFlowService.create_workflow_process(self.instance, self.node2)
+        WorkFlowService.create_workflow_process(self.instance, self.node3)
+
+    def test_concurrent_agree_advances_once(self):
+        barrier = threading.Barrier(len(self.users))
+        errors = []
+
+        def approve(pk):
+            try:
+                workflowprocess = WorkFlowProcess.objects.get(pk=pk)
+                barrier.wait()
+                WorkFlowService.handle_workflow_process(workflowprocess, WorkFlowProcessType.agree)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=approve, args=(pk,)) for pk in
+                   WorkFlowProcess.objects.filter(node=self.node1).values_list("pk", flat=True)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertFalse(errors, msg=errors)
+        instance = WorkFlowInstance.objects.get(pk=self.instance.pk)
+        self.assertTrue(instance.current_node == self.node2, msg="concurrent agree failed")
+        self.assertTrue(instance.pending_count == 2, msg="concurrent agree failed")
+        self.assertTrue(WorkFlowProcess.objects.filter(node=self.node2, todo=True).count() == 2,
+                        msg="concurrent agree failed")
+        print("===test_concurrent_agree_advances_once===")
+
+
+class WorkFlowBenchmarkTest(TestCase):
+    def test_run_benchmarks(self):
+        results = run_benchmarks(instances=20, processes=2, group_size=5, repeat=2)
+        self.assertTrue(set(results["results"]) == set(OPERATIONS), msg="run benchmarks failed")
+        self.assertTrue(results["results"]["start_workflow_instance"]["queries"] == 5,
+                        msg="run benchmarks failed")
+        self.assertFalse(WorkFlowInstance.objects.exists(), msg="benchmark data not rolled back")
+        self.assertFalse(compare_results(results, results), msg="compare results failed")
+        baseline = {"results": {"start_workflow_instance": {"queries": 1, "mean_ms": 1000}}}
+        self.assertTrue(len(compare_results(results, baseline)) == 1, msg="compare results failed")
+        print("===test_run_benchmarks===")
+
+
+class WorkFlowInstrumentationTest(TestCase):
+    def setUp(self):
+        clear_compiled_workflows()
+        self.user1 = mommy.make(User)
+        self.user2 = mommy.make(User)
+        self.workflow = mommy.make(WorkFlow, code="wf")
+        self.node1 = WorkFlowService.create_node(self.workflow, "demo1", "demo1", True, False,
+                                                 LogicType.logic_any, [self.user1, self.user2])
+        self.node2 = WorkFlowService.create_node(self.workflow, "demo2", "demo2", False, True,
+                                                 LogicType.logic_all, [self.user1], None, self.node1)
+        self.events = []
+        self.aggregator = MetricsAggregator()
+        register_hook(self.events.append)
+        register_hook(self.aggregator)
+
+    def tearDown(self):
+        unregister_hook(self.events.append)
+        unregister_hook(self.aggregator)
+
+    def test_transition_events(self):
+        instance = WorkFlowService.start_workflow_instance(self.workflow, self.user2, self.user1)
+        WorkFlowService.create_workflow_process(instance, self.node1, todo=True)
+        WorkFlowService.create_workflow_process(instance, self.node2)
+        workflowprocess = WorkFlowProcess.objects.filter(node=self.node1).first()
+        # the instance fetch and the transition; the hooks label events without
+        # reading the definition version again
+        with self.assertNumQueries(9):
+            WorkFlowService.handle_workflow_process(workflowprocess, WorkFlowProcessType.agree)
+        WorkFlowService.handle_terminated_instance(workflowprocess.inst)
+        self.assertTrue([(event.operation, event.workflow_code, event.node_code) for event in self.events] == [
+            ("start_workflow_instance", "wf", "demo1"),
+            ("create_workflow_process", "wf", "demo1"),
+            ("create_workflow_process", "wf", "demo2"),
+            ("handle_agree_instance", "wf", "demo1"),
+            ("handle_terminated_instance", "wf", "demo2"),
+        ], msg="instrumentation events failed")
+        agree = self.events[3]
+        # other ANY approver submitted, next node activated, instance saved
+        self.assertTrue(agree.rows == 3, msg="instrumentation rows failed")
+        self.assertTrue(agree.queries == 3, msg="instrumentation queries failed")
+        metrics = self.aggregator.as_list()
+        self.assertTrue(len(metrics) == 5, msg="instrumentation aggregator failed")
+        self.assertTrue(sum(metric["count"] for metric in metrics) == 5, msg="instrumentation aggregator failed")
+        self.assertIn("handle_agree_instance wf/demo1 count=1", self.aggregator.dump_text())
+        self.assertIn('"operation": "handle_terminated_instance"', self.aggregator.dump_json())
+        print("===test_transition_events===")
+
+
+class WorkFlowServiceInstancesForTest(TestCase):
+    def setUp(self):
+        clear_compiled_workflows()
+        self.user1 = mommy.make(User)
+        self.user2 = mommy.make(User)
+        self.workflow = mommy.make(WorkFlow)
+        self.node1 = WorkFlowService.create_node(self.workflow, "demo1", "demo1", True, True,
+                                                 LogicType.logic_all, [self.user1, self.user2])
+        self.groups = mommy.make(Group, _quantity=4)
+        for group in self.groups[:3]:
+            instance = WorkFlowService.start_workflow_instance(self.workflow, group, self.user1)
+            WorkFlowService.create_workflow_process(instance, self.node1, todo=True)
+        self.newest = WorkFlowService.start_workflow_instance(self.workflow, self.groups[0], self.user1)
+        WorkFlowService.create_workflow_process(self.newest, self.node1, todo=True)
+
+    def test_instances_for(self):
+        # the group without a live instance is looked up in the archive
+        with self.assertNumQueries(3):
+            instances = WorkFlowService.instances_for(Group.objects.all(), approvers=True)
+            codes = [instance.current_node.code for instance in instances.values()]
+            approvers = [[p.user for p in instance.pending_processes] for instance in instances.values()]
+        self.assertTrue(set(instances) == set(group.pk for group in self.groups[:3]), msg="instances_for failed")
+        self.assertTrue(instances[self.groups[0].pk] == self.newest, msg="instances_for failed")
+        self.assertTrue(codes == ["demo1"] * 3, msg="instances_for failed")
+        self.assertTrue(all(set(users) == {self.user1, self.user2} for users in approvers),
+                        msg="instances_for failed")
+        instances = WorkFlowService.instances_for(self.groups[2:])
+        self.assertTrue(list(instances) == [self.groups[2].pk], msg="instances_for failed")
+        print("===test_instances_for===")
+
+    def test_annotate_workflow_status(self):
+        with self.assertNumQueries(1):
+            groups = list(WorkFlowService.annotate_workflow_status(Group.objects.order_by("pk")))
+        self.assertTrue(groups[0].workflow_instance_id == self.newest.pk, msg="annotate workflow status failed")
+        self.assertTrue([group.workflow_status for group in groups] ==
+                        [WorkFlowInstanceType.new] * 3 + [None], msg="annotate workflow status failed")
+        self.assertTrue(groups[1].workflow_node_code == "demo1", msg="annotate workflow status failed")
+        print("===test_annotate_workflow_status===")
+
+
+class WorkFlowArchiveTest(TestCase):
+    def setUp(self):
+        clear_compiled_workflows()
+        self.user1 = mommy.make(User)
+        self.workflow = mommy.make(WorkFlow)
+        self.node1 = WorkFlowService.create_node(self.workflow, "demo1", "demo1", True, True,
+                                                 LogicType.logic_all, [self.user1])
+        self.groups = mommy.make(Group, _quantity=5)
+        self.finished = []
+        for group in self.groups:
+            instance = WorkFlowService.start_workflow_instance(self.workflow, group, self.user1)
+            WorkFlowService.create_workflow_process(instance, self.node1, todo=True)
+            self.finished.append(instance)
+        self.live = WorkFlowService.start_workflow_instance(self.workflow, self.groups[0], self.user1)
+        for instance in self.finished:
+            WorkFlowService.handle_terminated_instance(instance)
+        WorkFlowInstance.objects.filter(pk__in=[i.pk for i in self.finished]).update(
+            date_updated=datetime.datetime.now() - datetime.timedelta(days=10))
+
+    def test_archive_finished_instances(self):
+        self.assertTrue(archive_finished_instances(5, dry_run=True) == (5, 5), msg="archive dry run failed")
+        self.assertTrue(archive_finished_instances(30) == (0, 0), msg="archive cutoff failed")
+        self.assertTrue(archive_finished_instances(5, chunk_size=2, max_chunks=2) == (4, 4),
+                        msg="archive chunks failed")
+        self.assertTrue(archive_finished_instances(5, chunk_size=2) == (1, 1), msg="archive resume failed")
+        self.assertTrue(list(WorkFlowInstance.objects.all()) == [self.live], msg="archive failed")
+        self.assertTrue(WorkFlowProcess.objects.count() == 0, msg="archive failed")
+        history = WorkFlowService.instance_history(self.groups[0])
+        self.assertTrue([instance.pk for instance in history] == [self.finished[0].pk, self.live.pk],
+                        msg="instance history failed")
+        archived = WorkFlowService.get_instance(self.finished[1].pk)
+        self.assertTrue(archived.content_object == self.groups[1], msg="get instance failed")
+        self.assertTrue(archived.workflow_status == WorkFlowInstanceType.terminated, msg="get instance failed")
+        processes = WorkFlowService.process_history(archived)
+        self.assertTrue(len(processes) == 1 and processes[0].pro_type == WorkFlowProcessType.terminated,
+                        msg="process history failed")
+        print("===test_archive_finished_instances===")
+
+    def test_archived_instances_for(self):
+        archive_finished_instances(5)
+        instances = WorkFlowService.instances_for(self.groups[:2], approvers=True)
+        self.assertTrue(instances[self.groups[0].pk] == self.live, msg="instances_for failed")
+        archived = instances[self.groups[1].pk]
+        self.assertTrue(archived.pk == self.finished[1].pk and archived.pending_processes == [],
+                        msg="instances_for failed")
+        self.assertTrue(archived.current_node == self.node1, msg="instances_for failed")
+        self.assertTrue(set(WorkFlowService.instances_for(Group.objects.all())) ==
+                        set(group.pk for group in self.groups), msg="instances_for failed")
+        with self.assertNumQueries(1):
+            groups = list(WorkFlowService.annotate_workflow_status(Group.objects.order_by("pk")))
+        self.assertTrue(groups[0].workflow_instance_id == self.live.pk, msg="annotate workflow status failed")
+        self.assertTrue(groups[1].workflow_instance_id == self.finished[1].pk,
+                        msg="annotate workflow status failed")
+        self.assertTrue([group.workflow_status for group in groups[1:]] == [WorkFlowInstanceType.terminated] * 4,
+                        msg="annotate workflow status failed")
+        self.assertTrue(groups[1].workflow_node_code == "demo1", msg="annotate workflow status failed")
+        print("===test_archived_instances_for===")
+
+
+class WorkFlowReportTest(TestCase):
+    def setUp(self):
+        clear_compiled_workflows()
+        self.user1 = mommy.make(User)
+        self.user2 = mommy.make(User)
+        self.workflow = mommy.make(WorkFlow)
+        self.node1 = WorkFlowService.create_node(self.workflow, "demo1", "demo1", True, False,
+                                                 LogicType.logic_any, [self.user1, self.user2])
+        self.node2 = WorkFlowService.create_node(self.workflow, "demo2", "demo2", False, True,
+                                                 LogicType.logic_all, [self.user1], None, self.node1)
+        self.instances = []
+        for group in mommy.make(Group, _quantity=3):
+            instance = WorkFlowService.start_workflow_instance(self.workflow, group, self.user1)
+            WorkFlowService.create_workflow_process(instance, self.node1, todo=True)
+            WorkFlowService.create_workflow_process(instance, self.node2)
+            self.instances.append(instance)
+
+    def approve(self, instance, node, minutes):
+        workflowprocess = WorkFlowProcess.objects.filter(inst=instance, node=node, todo=True).first()
+        WorkFlowService.handle_workflow_process(workflowprocess, WorkFlowProcessType.agree)
+        WorkFlowProcess.objects.filter(pk=workflowprocess.pk).update(
+            pro_time=workflowprocess.date_created + datetime.timedelta(minutes=minutes))
+
+    def test_rollup(self):
+        self.approve(self.instances[0], self.node1, 10)
+        self.approve(self.instances[1], self.node1, 30)
+        self.approve(self.instances[1], self.node2, 5)
+        counts = reports.status_counts(self.workflow)
+        self.assertIn({"workflow": self.workflow.pk, "current_node": self.node1.pk,
+                       "workflow_status": WorkFlowInstanceType.new, "count": 1}, counts)
+        now = datetime.datetime.now() + datetime.timedelta(hours=1)
+        reports.rollup(self.workflow, now=now)
+        with self.assertNumQueries(1):
+            node1, node2 = reports.dashboard(self.workflow)
+            self.assertTrue(node1.node.code == "demo1", msg="rollup failed")
+        self.assertTrue((node1.new_count, node2.in_progress_count, node2.completed_count) == (1, 1, 1),
+                        msg="rollup failed")
+        self.assertTrue(node1.approval_count == 2 and node1.approval_duration == datetime.timedelta(minutes=40),
+                        msg="rollup failed")
+        self.assertTrue(node1.max_approval_duration == datetime.timedelta(minutes=30), msg="rollup failed")
+        self.approve(self.instances[2], self.node1, 20)
+        WorkFlowProcess.objects.filter(pro_time__isnull=False, node=self.node1, inst=self.instances[2]).update(
+            pro_time=now + datetime.timedelta(minutes=1))
+        reports.rollup(self.workflow, now=now + datetime.timedelta(hours=1))
+        node1 = reports.dashboard(self.workflow)[0]
+        self.assertTrue(node1.approval_count == 3 and node1.new_count == 0, msg="incremental rollup failed")
+        print("===test_rollup===")
+
+
+class AsyncWorkFlowServiceTest(TransactionTestCase):
+    def setUp(self):
+        clear_compiled_workflows()
+        self.user1 = mommy.make(User)
+        self.user2 = mommy.make(User)
+        self.workflow = mommy.make(WorkFlow)
+        self.node1 = WorkFlowService.create_node(self.workflow, "demo1", "demo1", True, False,
+                                                 LogicType.logic_any, [self.user1, self.user2])
+        self.node2 = WorkFlowService.create_node(self.workflow, "demo2", "demo2", False, True,
+                                                 LogicType.logic_all, [self.user1], None, self.node1)
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_async_transitions(self):
+        async def run():
+            workflow = await AsyncWorkFlowService.gain_workflow(self.workflow.code)
+            instance = await AsyncWorkFlowService.start_workflow_instance(
+                workflow, self.user2, self.user1, create_process=True)
+            count = await AsyncWorkFlowService.inbox_count(self.user1)
+            processes = await AsyncWorkFlowService.inbox(self.user1)
+            await AsyncWorkFlowService.handle_workflow_process(processes[0], WorkFlowProcessType.agree)
+            return instance, count, processes
+        instance, count, processes = self.loop.run_until_complete(run())
+        self.assertTrue(count == 1 and processes[0].inst == instance, msg="async inbox failed")
+        self.assertTrue(WorkFlowInstance.objects.get(pk=instance.pk).current_node == self.node2,
+                        msg="async handle workflow_process failed")
+        print("===test_async_transitions===")
+
+
+class WorkFlowImportExportTest(TestCase):
+    def setUp(self):
+        clear_compiled_workflows()
+        self.user1 = mommy.make(User, username="alice")
+        self.user2 = mommy.make(User, username="bob")
+        self.group1 = mommy.make(Group, name="reviewers")
+        self.workflow = WorkFlowService.gain_workflow("source", "source")
+        node1 = WorkFlowService.create_node(self.workflow, "N01", "draft", True, False,
+                                            LogicType.logic_all, [self.user1, self.user2])
+        node2 = WorkFlowService.create_node(self.workflow, "N02", "review", False, False,
+                                            LogicType.logic_any, None, [self.group1], node1)
+        node2.todo_timeout = datetime.timedelta(hours=2)
+        node2.escalation_type = EscalationType.reassign
+        node2.escalation_user = self.user2
+        node2.save()
+        WorkFlowService.create_node(self.workflow, "N03", "sign", False, True,
+                                    LogicType.logic_all, [self.user1], None, node2)
+
+    def test_export_import(self):
+        with self.assertNumQueries(4):
+            definition = export_workflow(self.workflow)
+        self.assertTrue([node["code"] for node in definition["nodes"]] == ["N01", "N02", "N03"],
+                        msg="export workflow failed")
+        self.assertTrue(definition["nodes"][0]["users"] == ["alice", "bob"], msg="export workflow failed")
+        self.assertTrue(definition["nodes"][1]["logic_type"] == "ANY", msg="export workflow failed")
+        self.assertTrue([node["next_node"] for node in definition["nodes"]] == ["N02", "N03", None],
+                        msg="export workflow failed")
+        self.assertTrue([(node["todo_timeout"], node["escalation_type"], node["escalation_user"])
+                         for node in definition["nodes"][:2]] ==
+                        [(None, "NONE", None), (7200, "REASSIGN", "bob")], msg="export escalation failed")
+        definition = loads(dumps(definition))
+        definition["code"] = "copy"
+        # nothing links to the start node, so its code can be left to the sequence
+        definition["nodes"][0]["code"] = ""
+        workflow = import_workflow(definition)
+        copy = get_compiled_workflow(workflow.pk)
+        self.assertTrue([copy.node(node_id).code for node_id in copy.chain] == ["N01", "N02", "N03"],
+                        msg="import workflow failed")
+        start_node = copy.start_node
+        self.assertTrue(start_node.user_ids == {self.user1.pk, self.user2.pk}, msg="import workflow failed")
+        self.assertTrue(copy.next_node(start_node.id).group_ids == {self.group1.pk}, msg="import workflow failed")
+        self.assertTrue(copy.next_node(start_node.id).logic_type == LogicType.logic_any,
+                        msg="import workflow failed")
+        review = WorkFlowNode.objects.get(workflow=workflow, code="N02")
+        self.assertTrue((review.todo_timeout, review.escalation_type, review.escalation_user) ==
+                        (datetime.timedelta(hours=2), EscalationType.reassign, self.user2),
+                        msg="import escalation failed")
+        with self.assertRaises(ValueError):
+            import_workflow(definition)
+        definition["code"] = "dangling"
+        definition["nodes"][1]["next_node"] = "N09"
+        with self.assertRaises(ValueError):
+            import_workflow(definition)
+        self.assertTrue(not WorkFlow.objects.filter(code="dangling").exists(), msg="import workflow failed")
+        print("===test_export_import===")
+
+
+class WorkFlowNodeCodeTest(TestCase):
+    def setUp(self):
+        self.workflow = WorkFlowService.gain_workflow("codes", "codes")
+
+    def test_generated_codes(self):
+        node1 = WorkFlowNode.objects.create(workflow=self.workflow, name="first")
+        node2 = WorkFlowNode.objects.create(workflow=self.workflow, name="second")
+        self.assertTrue((node1.code, node2.code) == ("N01", "N02"), msg="generate node code failed")
+        node1.delete()
+        WorkFlowNode.objects.create(workflow=self.workflow, code="N04", name="explicit")
+        node3 = WorkFlowNode.objects.create(workflow=self.workflow, name="third")
+        node4 = WorkFlowNode.objects.create(workflow=self.workflow, name="fourth")
+        self.assertTrue((node3.code, node4.code) == ("N03", "N05"), msg="generate node code failed")
+        self.assertTrue(WorkFlow.objects.reserve_node_codes(self.workflow.pk, 3) == ["N06", "N07", "N08"],
+                        msg="reserve node codes failed")
+        with self.assertRaises(IntegrityError):
+            WorkFlowNode.objects.create(workflow=self.workflow, code="N02", name="duplicate")
+        print("===test_generated_codes===")
+
+
+class WorkFlowEscalationTest(TestCase):
+    def setUp(self):
+        clear_compiled_workflows()
+        self.user1 = mommy.make(User)
+        self.user2 = mommy.make(User)
+        self.workflow = mommy.make(WorkFlow)
+        self.node1 = WorkFlowService.create_node(self.workflow, "demo1", "demo1", True, True,
+                                                 LogicType.logic_all, [self.user1])
+        self.node1.todo_timeout = datetime.timedelta(hours=1)
+        self.node1.escalation_user = self.user2
+        self.node1.save()
+        self.groups = mommy.make(Group, _quantity=3)
+        self.instances = []
+        for group in self.groups:
+            instance = WorkFlowService.start_workflow_instance(self.workflow, group, self.user1)
+            WorkFlowService.create_workflow_process(instance, self.node1, todo=True)
+            self.instances.append(instance)
+        WorkFlowProcess.objects.filter(inst__in=self.instances[:2]).update(
+            date_created=datetime.datetime.now() - datetime.timedelta(hours=2))
+
+    def escalate(self, escalation_type):
+        WorkFlowNode.objects.filter(pk=self.node1.pk).update(escalation_type=escalation_type)
+        return escalate_overdue_todos(chunk_size=1)
+
+    def test_reassign(self):
+        created = dict(WorkFlowProcess.objects.values_list("pk", "date_created"))
+        counts = self.escalate(EscalationType.reassign)
+        self.assertTrue(counts["reassigned"] == 2, msg="reassign overdue todos failed")
+        self.assertTrue(WorkFlowProcess.objects.todo_for(self.user2).count() == 2,
+                        msg="reassign overdue todos failed")
+        self.assertTrue(dict(WorkFlowProcess.objects.values_list("pk", "date_created")) == created,
+                        msg="escalation changed date_created")
+        self.assertTrue(escalate_overdue_todos()["reassigned"] == 0, msg="reassign overdue todos failed")
+        # the clock of an escalated todo runs from its escalation
+        WorkFlowProcess.objects.filter(escalated_at__isnull=False).update(
+            escalated_at=datetime.datetime.now() - datetime.timedelta(hours=2))
+        self.assertTrue(escalate_overdue_todos()["reassigned"] == 2, msg="reassign escalated todos failed")
+        print("===test_reassign===")
+
+    def test_reassign_to_existing_approver(self):
+        WorkFlowService.create_workflow_process(self.instances[0], self.node1, todo=True, users=[self.user2])
+        counts = self.escalate(EscalationType.reassign)
+        self.assertTrue(counts["reassigned"] == 2, msg="reassign overdue todos failed")
+        self.assertTrue(WorkFlowProcess.objects.filter(inst=self.instances[0], user=self.user2).count() == 1,
+                        msg="escalation user got a second todo")
+        self.assertTrue(WorkFlowProcess.objects.get(inst=self.instances[0], user=self.user1).pro_type ==
+                        WorkFlowProcessType.submit, msg="merge overdue todo failed")
+        pending = dict(WorkFlowInstance.objects.values_list("pk", "pending_count"))
+        self.assertTrue([pending[instance.pk] for instance in self.instances] == [1, 1, 1],
+                        msg="merge overdue todo failed")
+        print("===test_reassign_to_existing_approver===")
+
+    def test_add_approver(self):
+        counts = self.escalate(EscalationType.add_approver)
+        self.assertTrue(counts["approvers_added"] == 2, msg="add approver failed")
+        self.assertTrue(WorkFlowProcess.objects.todo_for(self.user1).count() == 3, msg="add approver failed")
+        self.assertTrue(WorkFlowProcess.objects.todo_for(self.user2).count() == 2, msg="add approver failed")
+        pending = dict(WorkFlowInstance.objects.values_list("pk", "pending_count"))
+        self.assertTrue([pending[instance.pk] for instance in self.instances] == [2, 2, 1],
+                        msg="add approver failed")
+        print("===test_add_approver===")
+
+    def test_terminate(self):
+        counts = self.escalate(EscalationType.terminate)
+        self.assertTrue(counts["terminated"] == 2, msg="terminate overdue instances failed")
+        status = dict(WorkFlowInstance.objects.values_list("pk", "workflow_status"))
+        self.assertTrue([status[instance.pk] for instance in self.instances] ==
+                        [WorkFlowInstanceType.terminated] * 2 + [WorkFlowInstanceType.new],
+                        msg="terminate overdue instances failed")
+        print("===test_terminate===")
+
+    def test_instances_locked_first(self):
+        WorkFlowNode.objects.filter(pk=self.node1.pk).update(escalation_type=EscalationType.reassign)
+        self.node1.refresh_from_db()
+        with CaptureQueriesContext(connection) as queries:
+            escalate_chunk(self.node1)
+        statements = [query["sql"] for query in queries.captured_queries]
+        locked = next(i for i, sql in enumerate(statements) if 'FROM "simpleworkflow_workflowinstance"' in sql)
+        updated = next(i for i, sql in enumerate(statements) if 'UPDATE "simpleworkflow_workflowprocess"' in sql)
+        self.assertTrue(locked < updated, msg="escalation locked processes before instances")
+        print("===test_instances_locked_first===")
+
+    def test_todo_handled_during_scan(self):
+        WorkFlowNode.objects.filter(pk=self.node1.pk).update(escalation_type=EscalationType.terminate)
+        self.node1.refresh_from_db()
+        workflowprocess = WorkFlowProcess.objects.select_related("inst").get(inst=self.instances[0])
+        lock_instances = WorkFlowInstance.objects.select_for_update
+        agreed = []
+
+        def agree_then_lock(*args, **kwargs):
+            # the approver acts between the scan's read and its instance lock
+            if not agreed:
+                agreed.append(workflowprocess)
+                WorkFlowService.handle_workflow_process(workflowprocess, WorkFlowProcessType.agree)
+            return lock_instances(*args, **kwargs)
+        with mock.patch.object(WorkFlowInstance.objects, "select_for_update", agree_then_lock):
+            after, terminated = escalate_chunk(self.node1)
+        self.assertTrue(terminated == 1 and after is not None, msg="escalated a handled todo")
+        status = dict(WorkFlowInstance.objects.values_list("pk", "workflow_status"))
+        self.assertTrue([status[instance.pk] for instance in self.instances] ==
+                        [WorkFlowInstanceType.completed, WorkFlowInstanceType.terminated, WorkFlowInstanceType.new],
+                        msg="escalated a handled todo")
+        print("===test_todo_handled_during_scan===")
+
+
+class WorkFlowAdminTest(TestCase):
+    def setUp(self):
+        clear_compiled_workflows()
+        self.user1 = mommy.make(User)
+        self.workflow = mommy.make(WorkFlow)
+        self.node1 = WorkFlowService.create_node(self.workflow, "demo1", "demo1", True, True,
+                                                 LogicType.logic_all, [self.user1])
+        self.groups = mommy.make(Group, _quantity=3)
+        self.instances = WorkFlowService.start_workflow_instances(
+            self.workflow, self.groups, self.user1, create_process=True)
+
+    def test_terminate_instances(self):
+        self.assertTrue(WorkFlowService.handle_terminated_instances(self.instances[:2]) == 2,
+                        msg="terminate instances failed")
+        self.assertTrue(WorkFlowService.handle_terminated_instances(self.instances) == 1,
+                        msg="terminate instances failed")
+        self.assertTrue(not WorkFlowProcess.objects.filter(pro_type=WorkFlowProcessType.init).exists(),
+                        msg="terminate instances failed")
+        print("===test_terminate_instances===")
+
+    def test_handle_processes(self):
+        WorkFlowService.create_workflow_process(self.instances[0], self.node1, users=[self.user1])
+        handled = []
+
+        class ProcessAdmin(WorkFlowProcessAdmin):
+            def message_user(self, request, message, level=None):
+                handled.append(str(message))
+        ProcessAdmin(WorkFlowProcess, admin.site).agree_processes(None, WorkFlowProcess.objects.all())
+        self.assertTrue(WorkFlowProcess.objects.filter(pro_type=WorkFlowProcessType.agree).count() == 3,
+                        msg="admin agree processes failed")
+        self.assertTrue(WorkFlowProcess.objects.get(inst=self.instances[0], todo=False,
+                                                    pro_type=WorkFlowProcessType.init),
+                        msg="admin agreed a process that is not a todo")
+        self.assertTrue(handled == ["3 processes handled.",
+                                    "1 processes skipped, they are not awaiting a decision."],
+                        msg="admin agree processes failed")
+        print("===test_handle_processes===")
+
+    def test_transition_fields_read_only(self):
+        request = RequestFactory().get("/admin/")
+        request.user = mommy.make(User, is_superuser=True, is_staff=True)
+        for model, model_admin, fields in (
+                (WorkFlowInstance, WorkFlowInstanceAdmin, {"workflow_status", "current_node", "pending_count"}),
+                (WorkFlowProcess, WorkFlowProcessAdmin, {"inst", "node", "pro_type", "todo"})):
+            model_admin = model_admin(model, admin.site)
+            self.assertTrue(fields <= set(model_admin.get_readonly_fields(request)),
+                            msg="admin transition fields editable")
+            self.assertTrue("delete_selected" not in model_admin.get_actions(request),
+                            msg="admin delete action enabled")
+            self.assertTrue(not model_admin.has_add_permission(request) and
+                            not model_admin.has_delete_permission(request),
+                            msg="admin add or delete enabled")
+        print("===test_transition_fields_read_only===")
+
+    def test_changelist(self):
+        paginator = EstimatedCountPaginator(WorkFlowProcess.objects.order_by("-pk"), 2)
+        self.assertTrue(paginator.count == 3 and paginator.num_pages == 2, msg="admin paginator failed")
+        WorkFlowService.create_workflow_process(self.instances[0], self.node1, users=[self.user1])
+
+        class OneRowFormSet(BoundedInlineFormSet):
+            max_rows = 1
+        FormSet = inlineformset_factory(WorkFlowInstance, WorkFlowProcess, formset=OneRowFormSet,
+                                        fields=("note",), extra=0)
+        self.assertTrue(len(FormSet(instance=self.instances[0]).forms) == 1,
+                        msg="bounded process inline failed")
+        print("===test_changelist===")
+
+
+@unittest.skipUnless("replica" in settings.DATABASES, "needs a second database aliased replica")
+@override_settings(SIMPLEWORKFLOW_REPLICA_DATABASE="replica",
+                   DATABASE_ROUTERS=["simpleworkflow.routers.WorkFlowReplicaRouter"])
+class WorkFlowReplicaRouterTest(TransactionTestCase):
+    # the two databases are not replicated, so a read that reaches the
+    # replica finds nothing
+    multi_db = True
+
+    def setUp(self):
+        clear_compiled_workflows()
+        self.user1 = mommy.make(User)
+        self.workflow = mommy.make(WorkFlow)
+        self.node1 = WorkFlowService.create_node(self.workflow, "demo1", "demo1", True, True,
+                                                 LogicType.logic_all, [self.user1])
+        self.instance = WorkFlowService.start_workflow_instance(self.workflow, self.user1, self.user1)
+        WorkFlowService.create_workflow_process(self.instance, self.node1, todo=True)
+        unpin()
+
+    def tearDown(self):
+        unpin()
+
+    def test_read_routing(self):
+        self.assertTrue(WorkFlowService.get_start_node(self.workflow) is None, msg="replica read failed")
+        self.assertTrue(WorkFlowService.inbox_count(self.user1) == 0, msg="replica read failed")
+        self.assertTrue(WorkFlowService.inbox_count(self.user1, using="default") == 1,
+                        msg="explicit database failed")
+        with transaction.atomic():
+            self.assertTrue(WorkFlowService.inbox_count(self.user1) == 1, msg="transaction read failed")
+        print("===test_read_routing===")
+
+    def test_definitions_from_primary(self):
+        clear_compiled_workflows()
+        definition = get_compiled_workflow(self.workflow.pk)
+        self.assertTrue(definition.start_node is not None and definition.start_node.id == self.node1.pk,
+                        msg="definition read from the replica")
+        print("===test_definitions_from_primary===")
+
+    def test_read_your_writes(self):
+        workflowprocess = WorkFlowProcess.objects.using("default").get(user=self.user1)
+        WorkFlowService.handle_workflow_process(workflowprocess, WorkFlowProcessType.agree)
+        self.assertTrue(WorkFlowService.get_instance(self.instance.pk).workflow_status ==
+                        WorkFlowInstanceType.completed, msg="sticky read failed")
+        unpin()
+        self.assertTrue(WorkFlowService.get_instance(self.instance.pk) is None, msg="replica read failed")
+        print("===test_read_your_writes===")
+
+    def test_pin_across_requests(self):
+        results = []
+
+        def agree(request):
+            workflowprocess = WorkFlowProcess.objects.using("default").get(user=self.user1)
+            WorkFlowService.handle_workflow_process(workflowprocess, WorkFlowProcessType.agree)
+            return HttpResponse()
+
+        def read(request):
+            try:
+                results.append(WorkFlowService.get_instance(self.instance.pk))
+            finally:
+                if threading.current_thread() is not threading.main_thread():
+                    connections.close_all()
+            return HttpResponse()
+        response = ReplicaPinMiddleware(agree)(RequestFactory().get("/"))
+        cookie = response.cookies["simpleworkflow_pinned"].value
+        # the same thread serves another user next
+        ReplicaPinMiddleware(read)(RequestFactory().get("/"))
+        # and the user's next request runs on another thread
+        request = RequestFactory().get("/")
+        request.COOKIES["simpleworkflow_pinned"] = cookie
+        thread = threading.Thread(target=ReplicaPinMiddleware(read), args=(request,))
+        thread.start()
+        thread.join()
+        self.assertTrue(results[0] is None, msg="pin leaked to another request")
+        self.assertTrue(results[1].workflow_status == WorkFlowInstanceType.completed,
+                        msg="pin not carried to the next request")
+        print("===test_pin_across_requests===")
+
+
+@override_settings(SIMPLEWORKFLOW_OUTBOX=True, SIMPLEWORKFLOW_OUTBOX_SETTLE_SECONDS=0)
+class WorkFlowOutboxTest(TestCase):
+    def setUp(self):
+        clear_compiled_workflows()
+        self.user1 = mommy.make(User)
+        self.user2 = mommy.make(User)
+        self.workflow = mommy.make(WorkFlow)
+        self.node1 = WorkFlowService.create_node(self.workflow, "demo1", "demo1", True, False,
+                                                 LogicType.logic_all, [self.user1])
+        self.node2 = WorkFlowService.create_node(self.workflow, "demo2", "demo2", False, True,
+                                                 LogicType.logic_all, [self.user2], None, self.node1)
+        self.groups = mommy.make(Group, _quantity=3)
+
+    def test_transition_events(self):
+        instance1 = WorkFlowService.start_workflow_instance(self.workflow, self.groups[0], self.user1)
+        instance2, instance3 = WorkFlowService.start_workflow_instances(
+            self.workflow, self.groups[1:], self.user1, create_process=True)
+        WorkFlowService.create_workflow_process(instance1, self.node1, todo=True)
+        WorkFlowService.create_workflow_process(instance1, self.node2)
+        workflowprocess = WorkFlowProcess.objects.get(inst=instance1, node=self.node1)
+        WorkFlowService.handle_workflow_process(workflowprocess, WorkFlowProcessType.agree)
+        workflowprocess = WorkFlowProcess.objects.get(inst=instance1, node=self.node2)
+        WorkFlowService.handle_workflow_process(workflowprocess, WorkFlowProcessType.agree)
+        WorkFlowService.handle_workflow_processes(
+            [(WorkFlowProcess.objects.get(inst=instance2), WorkFlowProcessType.deny, None)])
+        WorkFlowService.handle_terminated_instance(instance3)
+        events = list(WorkFlowEvent.objects.order_by("pk").values_list("event_type", "inst_id", "node_id"))
+        self.assertTrue(events == [
+            (WorkFlowEventType.started, instance1.pk, self.node1.pk),
+            (WorkFlowEventType.started, instance2.pk, self.node1.pk),
+            (WorkFlowEventType.started, instance3.pk, self.node1.pk),
+            (WorkFlowEventType.advanced, instance1.pk, self.node2.pk),
+            (WorkFlowEventType.completed, instance1.pk, self.node2.pk),
+            (WorkFlowEventType.denied, instance2.pk, self.node1.pk),
+            (WorkFlowEventType.terminated, instance3.pk, self.node1.pk),
+        ], msg="outbox events failed")
+        print("===test_transition_events===")
+
+    def test_consumers(self):
+        WorkFlowService.start_workflow_instances(self.workflow, self.groups, self.user1)
+        consumer1 = EventConsumer("search", batch_size=2)
+        consumer2 = EventConsumer("warehouse", batch_size=2)
+        events = list(consumer1)
+        self.assertTrue(len(events) == 3 and consumer1.position == events[-1].pk, msg="consume events failed")
+        completed = EventConsumer("completed", event_types=[WorkFlowEventType.completed])
+        self.assertTrue(list(completed) == [] and completed.position == events[-1].pk,
+                        msg="consume event types failed")
+        completed.get_consumer().delete()
+        batch = next(consumer2.batches())
+        self.assertTrue(consumer2.position == 0, msg="unacknowledged batch failed")
+        consumer2.ack(batch[-1])
+        self.assertTrue(purge_events() == 2, msg="purge events failed")
+        self.assertTrue([event.pk for event in consumer2] == [events[-1].pk], msg="consume events failed")
+        self.assertTrue(purge_events() == 1 and list(consumer1) == [], msg="purge events failed")
+        print("===test_consumers===")
+
+    def test_late_commit(self):
+        WorkFlowService.start_workflow_instances(self.workflow, self.groups, self.user1)
+        events = list(WorkFlowEvent.objects.order_by("pk"))
+        # the second event's transaction has not committed yet
+        WorkFlowEvent.objects.filter(pk=events[1].pk).delete()
+        consumer = EventConsumer("search")
+        self.assertTrue([event.pk for event in consumer] == [events[0].pk, events[2].pk],
+                        msg="consume events failed")
+        self.assertTrue(purge_events() == 1, msg="purge removed events below a gap")
+        events[1].save(force_insert=True)
+        self.assertTrue([event.pk for event in consumer] == [events[1].pk], msg="late event skipped")
+        self.assertTrue(list(consumer) == [] and not WorkFlowEventGap.objects.exists(),
+                        msg="gap not cleared")
+        # a gap no commit fills expires
+        WorkFlowService.start_workflow_instances(self.workflow, self.groups, self.user1)
+        WorkFlowEvent.objects.filter(pk__gt=events[2].pk).order_by("pk")[1].delete()
+        expiring = EventConsumer("search", gap_seconds=0)
+        self.assertTrue(len(list(expiring)) == 2 and WorkFlowEventGap.objects.count() == 1,
+                        msg="gap not kept")
+        self.assertTrue(list(expiring) == [] and not WorkFlowEventGap.objects.exists(),
+                        msg="gap not expired")
+        print("===test_late_commit===")
+
+
+class WorkFlowParallelBranchTest(TestCase):
+    def setUp(self):
+        clear_compiled_workflows()
+        self.user1 = mommy.make(User)
+        self.user2 = mommy.make(User)
+        self.user3 = mommy.make(User)
+        self.workflow = mommy.make(WorkFlow)
+        # start -> (review1, review2) -> sign
+        self.start = WorkFlowService.create_node(self.workflow, "start", "start", True, False,
+                                                 LogicType.logic_all, [self.user1])
+        self.review1 = WorkFlowService.create_node(self.workflow, "review1", "review1", False, False,
+                                                   LogicType.logic_all, [self.user2], None, self.start)
+        self.review2 = WorkFlowService.create_node(self.workflow, "review2", "review2", False, False,
+                                                   LogicType.logic_any, [self.user3])
+        self.sign = WorkFlowService.create_node(self.workflow, "sign", "sign", False, True,
+                                                LogicType.logic_all, [self.user1], None, self.review1)
+        self.review2.next_node = self.sign
+        self.review2.save()
+        WorkFlowTransition.objects.create(workflow=self.workflow, source=self.start, target=self.review2)
+
+    def start_instance(self):
+        instance = WorkFlowService.start_workflow_instance(self.workflow, self.user1, self.user1)
+        WorkFlowService.create_workflow_process(instance, self.start, todo=True)
+        for node in (self.review1, self.review2, self.sign):
+            WorkFlowService.create_workflow_process(instance, node)
+        return instance
+
+    def agree(self, instance, node):
+        workflowprocess = WorkFlowProcess.objects.get(inst=instance, node=node)
+        WorkFlowService.handle_workflow_process(workflowprocess, WorkFlowProcessType.agree)
+        return WorkFlowInstance.objects.get(pk=instance.pk)
+
+    def test_transition_table(self):
+        definition = get_compiled_workflow(self.workflow.pk)
+        self.assertTrue(definition.is_graph, msg="compile transitions failed")
+        self.assertTrue(definition.targets[self.start.pk] == (self.review1.pk, self.review2.pk),
+                        msg="compile transitions failed")
+        self.assertTrue(definition.incoming_count(self.sign.pk) == 2, msg="compile transitions failed")
+        exported = export_workflow(self.workflow)
+        self.assertTrue(exported["transitions"] == [["start", "review2"]], msg="export transitions failed")
+        exported["code"] = "copy"
+        copy = get_compiled_workflow(import_workflow(exported).pk)
+
+        def edges(definition):
+            return set((definition.node(source_id).code, definition.node(target_id).code)
+                       for source_id, target_ids in definition.targets.items() for target_id in target_ids)
+        self.assertTrue(edges(copy) == edges(definition) == {
+            ("start", "review1"), ("start", "review2"), ("review1", "sign"), ("review2", "sign")},
+            msg="import transitions failed")
+        sign = next(node for node in copy.nodes.values() if node.code == "sign")
+        self.assertTrue(copy.is_graph and sorted(copy.node(source_id).code for source_id in copy.sources[sign.id]) ==
+                        ["review1", "review2"], msg="import transitions failed")
+        self.assertTrue(sign.next_node_id is None, msg="import transitions failed")
+        print("===test_transition_table===")
+
+    def test_all_join(self):
+        instance = self.agree(self.start_instance(), self.start)
+        self.assertTrue(set(WorkFlowProcess.objects.filter(todo=True).values_list("node_id", flat=True)) ==
+                        {self.review1.pk, self.review2.pk}, msg="fork failed")
+        instance = self.agree(instance, self.review1)
+        self.assertTrue(not WorkFlowProcess.objects.get(inst=instance, node=self.sign).todo, msg="join failed")
+        instance = self.agree(instance, self.review2)
+        self.assertTrue(instance.current_node == self.sign, msg="join failed")
+        self.assertTrue(WorkFlowProcess.objects.get(inst=instance, node=self.sign).todo, msg="join failed")
+        instance = self.agree(instance, self.sign)
+        self.assertTrue(instance.workflow_status == WorkFlowInstanceType.completed, msg="complete failed")
+        print("===test_all_join===")
+
+    def test_any_join(self):
+        WorkFlowNode.objects.filter(pk=self.sign.pk).update(join_type=LogicType.logic_any)
+        clear_compiled_workflows()
+        instances = [self.start_instance() for _ in range(2)]
+        WorkFlowService.handle_workflow_processes(
+            [(WorkFlowProcess.objects.get(inst=instance, node=self.start), WorkFlowProcessType.agree, None)
+             for instance in instances])
+        WorkFlowService.handle_workflow_processes(
+            [(WorkFlowProcess.objects.get(inst=instance, node=self.review2), WorkFlowProcessType.agree, None)
+             for instance in instances])
+        self.assertTrue(WorkFlowProcess.objects.filter(node=self.sign, todo=True).count() == 2, msg="join failed")
+        # the review1 branch is not waited for
+        self.assertTrue(not WorkFlowProcess.objects.filter(node=self.review1, todo=True).exists() and
+                        set(WorkFlowProcess.objects.filter(node=self.review1).values_list("pro_type", flat=True)) ==
+                        {WorkFlowProcessType.submit}, msg="sibling branch todos left open")
+        self.assertTrue(list(WorkFlowInstanceNode.objects.filter(
+            inst=instances[0], is_active=True).values_list("node_id", flat=True)) == [self.sign.pk],
+            msg="sibling branch left active")
+        instance = self.agree(instances[0], self.sign)
+        self.assertTrue(instance.workflow_status == WorkFlowInstanceType.completed, msg="complete failed")
+        self.assertTrue(WorkFlowProcess.objects.get(inst=instance, node=self.sign).pro_type ==
+                        WorkFlowProcessType.agree, msg="join failed")
+        print("===test_any_join===")
+
+    def test_deny_branch(self):
+        instance = self.agree(self.start_instance(), self.start)
+        workflowprocess = WorkFlowProcess.objects.get(inst=instance, node=self.review2)
+        WorkFlowService.handle_workflow_process(workflowprocess, WorkFlowProcessType.deny)
+        instance = WorkFlowInstance.objects.get(pk=instance.pk)
+        self.assertTrue(instance.workflow_status == WorkFlowInstanceType.deny, msg="deny failed")
+        self.assertTrue(not WorkFlowProcess.objects.filter(inst=instance, todo=True).exists(),
+                        msg="branch todos left open")
+        self.assertTrue(not WorkFlowInstanceNode.objects.filter(inst=instance, is_active=True).exists(),
+                        msg="branch left active")
+        print("===test_deny_branch===")
+
+
+class WorkFlowServiceCanActTest(TestCase):
+    def setUp(self):
+        clear_compiled_workflows()
+        self.user1 = mommy.make(User)
+        self.user2 = mommy.make(User)
+        self.workflow = mommy.make(WorkFlow)
+        self.node1 = WorkFlowService.create_node(self.workflow, "demo1", "demo1", True, False,
+                                                 LogicType.logic_all, [self.user1, self.user2])
+        self.node2 = WorkFlowService.create_node(self.workflow, "demo2", "demo2", False, True,
+                                                 LogicType.logic_all, [self.user1], None, self.node1)
+        self.instances = WorkFlowService.start_workflow_instances(
+            self.workflow, mommy.make(Group, _quantity=3), self.user1, create_process=True)
+        WorkFlowProcess.objects.filter(inst=self.instances[2], user=self.user1).delete()
+        WorkFlowService.create_workflow_process(self.instances[2], self.node2, todo=True)
+        get_compiled_workflow(self.workflow.pk)
+
+    def test_can_act(self):
+        memo = {}
+        # the processes, and the definition version for the one off the current node
+        with self.assertNumQueries(2):
+            processes = WorkFlowService.can_act(self.user1, self.instances, memo)
+        self.assertTrue(sorted(processes) == sorted(instance.pk for instance in self.instances[:2]),
+                        msg="can act failed")
+        self.assertTrue(processes[self.instances[0].pk].inst is self.instances[0], msg="can act failed")
+        with self.assertNumQueries(0):
+            WorkFlowService.can_act(self.user1, [instance.pk for instance in self.instances], memo)
+        with self.assertNumQueries(6):
+            WorkFlowService.handle_workflow_process(
+                processes[self.instances[0].pk], WorkFlowProcessType.agree, memo=memo)
+        with self.assertNumQueries(1):
+            processes = WorkFlowService.can_act(self.user1, self.instances, memo)
+        self.assertTrue(list(processes) == [self.instances[1].pk], msg="can act failed")
+        print("===test_can_act===")
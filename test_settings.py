@@ -0,0 +1,40 @@
+# settings for running the app's tests:
+#   DJANGO_SETTINGS_MODULE=test_settings django-admin test simpleworkflow
+# the replica alias is a second, unreplicated database, so the tests can
+# tell which of the two a query went to. SQLite has no row locking and
+# skips the concurrency tests; SIMPLEWORKFLOW_TEST_ENGINE and the other
+# SIMPLEWORKFLOW_TEST_* variables below run the tests on PostgreSQL instead
+import os
+
+SECRET_KEY = 'simpleworkflow-tests'
+
+INSTALLED_APPS = [
+    'django.contrib.admin',
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'django.contrib.messages',
+    'django.contrib.sessions',
+    'simpleworkflow',
+]
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': 'simpleworkflow.sqlite3',
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': 'simpleworkflow_replica.sqlite3',
+    },
+}
+
+if os.environ.get('SIMPLEWORKFLOW_TEST_ENGINE'):
+    DATABASES['default'] = {
+        'ENGINE': os.environ['SIMPLEWORKFLOW_TEST_ENGINE'],
+        'NAME': os.environ.get('SIMPLEWORKFLOW_TEST_NAME', 'simpleworkflow'),
+        'USER': os.environ.get('SIMPLEWORKFLOW_TEST_USER', ''),
+        'PASSWORD': os.environ.get('SIMPLEWORKFLOW_TEST_PASSWORD', ''),
+        'HOST': os.environ.get('SIMPLEWORKFLOW_TEST_HOST', ''),
+        'PORT': os.environ.get('SIMPLEWORKFLOW_TEST_PORT', ''),
+    }
+    DATABASES['replica'] = dict(DATABASES['default'], NAME=DATABASES['default']['NAME'] + '_replica')